@@ -1,9 +1,20 @@
 # -*- mode: python ; coding: utf-8 -*-
 import sys
-from PyInstaller.utils.hooks import collect_submodules
 
 block_cipher = None
 
+# Только модули Qt, которые использует программа: QtSvg импортируется
+# внутри функции, поэтому указан явно. Остальные части PyQt5 в сборку не попадают.
+QT_MODULES = ['PyQt5.QtCore', 'PyQt5.QtGui', 'PyQt5.QtWidgets', 'PyQt5.QtSvg']
+QT_EXCLUDES = [
+    'PyQt5.QtNetwork', 'PyQt5.QtQml', 'PyQt5.QtQuick', 'PyQt5.QtQuickWidgets', 'PyQt5.QtWebEngine',
+    'PyQt5.QtWebEngineCore', 'PyQt5.QtWebEngineWidgets', 'PyQt5.QtWebSockets', 'PyQt5.QtMultimedia',
+    'PyQt5.QtMultimediaWidgets', 'PyQt5.QtOpenGL', 'PyQt5.QtPrintSupport', 'PyQt5.QtSql', 'PyQt5.QtTest',
+    'PyQt5.QtXml', 'PyQt5.QtXmlPatterns', 'PyQt5.QtDBus', 'PyQt5.QtBluetooth', 'PyQt5.QtPositioning',
+    'PyQt5.QtLocation', 'PyQt5.QtSensors', 'PyQt5.QtSerialPort', 'PyQt5.QtDesigner', 'PyQt5.QtHelp',
+    'PyQt5.Qt3DCore', 'PyQt5.QtChart', 'PyQt5.QtNfc', 'PyQt5.QtRemoteObjects', 'PyQt5.QtTextToSpeech',
+]
+
 a = Analysis([
     'main.py',
 ],
@@ -16,10 +27,10 @@ a = Analysis([
         ('profiles.json', '.'),
         ('appsettings.json', '.'),
     ],
-    hiddenimports=collect_submodules('PyQt5'),
+    hiddenimports=QT_MODULES,
     hookspath=[],
     runtime_hooks=[],
-    excludes=[],
+    excludes=QT_EXCLUDES + ['tkinter'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -0,0 +1,68 @@
+"""Замер холодного запуска окна: время до первой отрисовки.
+
+    python bench_startup.py                      # main.py текущим интерпретатором
+    python bench_startup.py --exe dist/CheckDB/CheckDB.exe --runs 10
+    python bench_startup.py --offscreen          # без дисплея (Qt offscreen)
+
+Программа запускается несколько раз подряд с переменной CHECKDB_STARTUP_BENCH;
+окно после первой отрисовки записывает времена этапов в файл и закрывается.
+Этапы (мс от начала main.py): import — модули загружены, window — окно
+построено, first_paint — окно отрисовано. launch — от запуска процесса до
+его завершения, включая старт интерпретатора. Печатаются медиана и минимум.
+"""
+import sys
+import os
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+METRICS = ('import_ms', 'window_ms', 'first_paint_ms', 'launch_ms')
+
+def run_once(command, env, timeout):
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        started = time.perf_counter()
+        subprocess.run(command, env={**env, 'CHECKDB_STARTUP_BENCH': path}, cwd=HERE, timeout=timeout,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        launch = round((time.perf_counter() - started) * 1000, 1)
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        if not text:
+            raise RuntimeError('окно не отрисовалось — замер не записан')
+        return {**json.loads(text), 'launch_ms': launch}
+    finally:
+        os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Время запуска CheckDB до первой отрисовки окна')
+    parser.add_argument('--runs', type=int, default=7, help='число запусков (по умолчанию 7)')
+    parser.add_argument('--exe', help='собранный CheckDB.exe вместо main.py')
+    parser.add_argument('--offscreen', action='store_true', help='запуск без дисплея (QT_QPA_PLATFORM=offscreen)')
+    parser.add_argument('--timeout', type=float, default=60, help='предел одного запуска, с')
+    parser.add_argument('--json', action='store_true', help='вывести все замеры в JSON')
+    args = parser.parse_args()
+
+    command = [args.exe] if args.exe else [sys.executable, os.path.join(HERE, 'main.py')]
+    env = dict(os.environ)
+    if args.offscreen:
+        env['QT_QPA_PLATFORM'] = 'offscreen'
+    # Первый запуск прогревает файловый кэш ОС и в итог не входит
+    run_once(command, env, args.timeout)
+    results = [run_once(command, env, args.timeout) for _ in range(args.runs)]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'этап':<16}{'медиана, мс':>14}{'минимум, мс':>14}")
+    for metric in METRICS:
+        values = [result[metric] for result in results if metric in result]
+        if values:
+            print(f"{metric[:-3]:<16}{statistics.median(values):>14.1f}{min(values):>14.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Проверка кодов из командной строки, без окна и без Qt.
+
+Пример:
+    python cli.py check --line Спайдер --product "вода 60шт" --from 2024-05-01 --to 2024-05-31 --format csv > codes.csv
+
+Строки читаются серверным курсором пакетами и сразу пишутся в stdout,
+поэтому выгрузка любого размера не держится в памяти целиком.
+Код возврата: 0 — записи найдены, 1 — записей нет, 2 — ошибка.
+"""
+import sys
+import os
+import json
+import argparse
+import datetime
+import time
+import psycopg2
+from core import (
+    GTIN_MATCH_MODES, GTIN_MATCH_AUTO, STREAM_BATCH_START, load_lines, load_products, normalize_gtin,
+    line_conn_params, fetch_schema, resolve_gtin_match, build_check_query, build_count_query,
+    is_csv_quoted_column, csv_header, csv_line, tune_itersize, PhaseTimer, append_history, STORE_FILE,
+)
+
+EXIT_OK = 0
+EXIT_EMPTY = 1
+EXIT_ERROR = 2
+
+class CheckError(Exception):
+    """Проверку нельзя выполнить с такими параметрами"""
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'неверная дата {value!r}, нужен формат ГГГГ-ММ-ДД')
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Проверка кодов маркировки без окна программы')
+    commands = parser.add_subparsers(dest='command', required=True)
+    check = commands.add_parser('check', help='записи кодов продукта за период')
+    check.add_argument('--line', required=True, help='линия из базы checkdb.db (вкладка "Линии")')
+    product = check.add_mutually_exclusive_group(required=True)
+    product.add_argument('--product', help='продукт из базы checkdb.db (вкладка "Продукты")')
+    product.add_argument('--gtin', help='GTIN напрямую, без справочника продуктов')
+    check.add_argument('--from', dest='date_from', type=parse_date, default=datetime.date.today(),
+                       help='начало периода ГГГГ-ММ-ДД (по умолчанию сегодня)')
+    check.add_argument('--to', dest='date_to', type=parse_date,
+                       help='конец периода ГГГГ-ММ-ДД включительно (по умолчанию без ограничения)')
+    check.add_argument('--date-field', choices=('dtime_ins', 'production_date'), default='dtime_ins',
+                       help='поле даты (по умолчанию dtime_ins)')
+    check.add_argument('--gtin-match', choices=[mode for mode, _ in GTIN_MATCH_MODES], default=GTIN_MATCH_AUTO,
+                       help='способ поиска GTIN в коде (по умолчанию auto)')
+    check.add_argument('--format', choices=('csv', 'json'), default='csv', help='формат вывода (по умолчанию csv)')
+    check.add_argument('--count', action='store_true', help='вывести только количество записей')
+    return parser
+
+def resolve_product(args):
+    if args.gtin:
+        return normalize_gtin(args.gtin)
+    products = load_products()
+    if args.product not in products:
+        raise CheckError(f'Продукт {args.product!r} не найден в базе продуктов ({STORE_FILE})')
+    return products[args.product]
+
+def write_csv(out, colnames, batches):
+    out.write(csv_header(colnames))
+    special_cols = [i for i, name in enumerate(colnames) if is_csv_quoted_column(name)]
+    for rows in batches:
+        out.write(''.join(csv_line(row, special_cols) for row in rows))
+
+def write_json(out, colnames, batches):
+    # Массив пишется по частям, чтобы не собирать весь результат в памяти
+    out.write('[')
+    first = True
+    for rows in batches:
+        for row in rows:
+            out.write('\n' if first else ',\n')
+            out.write(json.dumps(dict(zip(colnames, row)), ensure_ascii=False, default=str))
+            first = False
+    out.write('\n]\n')
+
+WRITERS = {'csv': write_csv, 'json': write_json}
+
+def fetch_batches(cur, timer):
+    """Пакеты строк серверного курсора; размер пакета подстраивается, как в окне"""
+    itersize = STREAM_BATCH_START
+    while True:
+        started = time.monotonic()
+        with timer.phase('fetch'):
+            rows = cur.fetchmany(itersize)
+        if not rows:
+            return
+        timer.count(rows)
+        yield rows
+        itersize = tune_itersize(itersize, time.monotonic() - started)
+
+def run_check(args, out):
+    lines = load_lines()
+    if args.line not in lines:
+        raise CheckError(f'Линия {args.line!r} не найдена в базе линий ({STORE_FILE})')
+    line = lines[args.line]
+    gtin = resolve_product(args)
+    date_from = args.date_from.isoformat()
+    date_to = args.date_to.isoformat() if args.date_to else None
+    timer = PhaseTimer('cli', line=args.line, gtin=gtin, date_from=date_from, date_to=date_to,
+                       date_field=args.date_field, format='count' if args.count else args.format)
+    status = 'error'
+    total = 0
+    conn = None
+    try:
+        with timer.phase('connect'):
+            conn = psycopg2.connect(**line_conn_params(line))
+        cur = conn.cursor()
+        schema = fetch_schema(cur)
+        columns = line.get('columns')
+        error = schema.validate(args.date_field, columns)
+        if error:
+            raise CheckError(error)
+        gtin_match = resolve_gtin_match(args.gtin_match, schema)
+        if args.count:
+            sql, params = build_count_query(gtin, date_from, date_to, args.date_field, gtin_match)
+            with timer.phase('execute'):
+                cur.execute(sql, params)
+            total = cur.fetchone()[0]
+            out.write(f'{total}\n')
+        else:
+            sql, params = build_check_query(gtin, date_from, date_to, args.date_field, gtin_match, columns=columns)
+            stream = conn.cursor(name='checkdb_cli')
+            with timer.phase('execute'):
+                stream.execute(sql, params)
+                # Первый пакет нужен, чтобы узнать имена столбцов
+                first = stream.fetchmany(STREAM_BATCH_START)
+            timer.count(first)
+            colnames = [desc[0] for desc in stream.description]
+
+            def batches():
+                nonlocal total
+                if first:
+                    total += len(first)
+                    yield first
+                for rows in fetch_batches(stream, timer):
+                    total += len(rows)
+                    yield rows
+
+            with timer.phase('export'):
+                WRITERS[args.format](out, colnames, batches())
+            stream.close()
+        out.flush()
+        status = 'ok' if total else 'empty'
+    except KeyboardInterrupt:
+        status = 'cancelled'
+        if conn is not None:
+            conn.cancel()
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+        append_history(timer.finish(status, total))
+    return EXIT_OK if total else EXIT_EMPTY
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Вывод в UTF-8 и с \n, как у выгрузки CSV из окна, независимо от кодировки консоли
+    sys.stdout.reconfigure(encoding='utf-8', newline='\n')
+    try:
+        return run_check(args, sys.stdout)
+    except CheckError as e:
+        print(f'Ошибка: {e}', file=sys.stderr)
+    except psycopg2.Error as e:
+        print(f'Ошибка БД: {str(e).strip()}', file=sys.stderr)
+    except BrokenPipeError:
+        # Вывод оборвал получатель (например, head) — это не ошибка проверки.
+        # stdout подменяется, чтобы при выходе Python не сообщал о сбое записи
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return EXIT_OK
+    except KeyboardInterrupt:
+        print('Проверка прервана', file=sys.stderr)
+    return EXIT_ERROR
+
+if __name__ == '__main__':
+    sys.exit(main())
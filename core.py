@@ -0,0 +1,1147 @@
+"""Общая часть проверки без Qt: настройки, запросы, пулы соединений и замеры.
+
+Используется окном (main.py) и командной строкой (cli.py).
+"""
+import sys
+import json
+import os
+import csv
+import datetime
+import time
+import threading
+import contextlib
+import collections
+import heapq
+import re
+import tempfile
+# psycopg2 импортируется при первом обращении к БД, чтобы не задерживать запуск окна
+
+PROFILES_FILE = 'profiles.json'
+PRODUCTS_FILE = 'products.json'
+HISTORY_FILE = 'history.jsonl'  # замеры проверок, по записи JSON на строку
+
+def resource_path(relative_path):
+    if hasattr(sys, '_MEIPASS'):
+        return os.path.join(sys._MEIPASS, relative_path)
+    return os.path.join(os.path.abspath("."), relative_path)
+
+# Линии и продукты хранятся в SQLite в режиме WAL: изменение одной записи —
+# одна короткая транзакция, а сбой посреди записи не портит остальные данные.
+# JSON-файлы остаются форматом импорта и экспорта; при первом запуске
+# их содержимое переносится в базу.
+STORE_FILE = 'checkdb.db'
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (name TEXT PRIMARY KEY, gtin TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS lines (name TEXT PRIMARY KEY, params TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+PRODUCT_UPSERT = "INSERT INTO products (name, gtin) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET gtin = excluded.gtin"
+LINE_UPSERT = "INSERT INTO lines (name, params) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET params = excluded.params"
+META_UPSERT = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)"
+
+def read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json(path, data):
+    """Запись через временный файл: при сбое остаётся прежний файл, а не обрезанный"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.checkdb-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+class LocalStore:
+    """Линии и продукты в SQLite. Порядок записей — порядок добавления, как в JSON-файлах"""
+    def __init__(self, path=STORE_FILE):
+        import sqlite3
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # В WAL этого достаточно для целостности; сбой питания может потерять лишь последние правки
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(STORE_SCHEMA)
+        self.migrate_json()
+
+    def json_sources(self):
+        return ((PROFILES_FILE, self.put_lines), (PRODUCTS_FILE, self.put_products))
+
+    def migrate_json(self):
+        """Однократный перенос profiles.json и products.json.
+
+        Перенос отмечается, только если файл есть и прочитан целиком: отсутствующий
+        или нечитаемый файл пробуем снова при следующем запуске.
+        """
+        for path, put_all in self.json_sources():
+            if os.path.exists(path) and self.imported_at(path) is None:
+                self.import_json(path, put_all)
+
+    def imported_at(self, path):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (f'imported:{path}',)).fetchone()
+        return datetime.datetime.fromisoformat(row[0]) if row else None
+
+    def import_json(self, path, put_all):
+        """Импорт файла целиком вместе с отметкой о переносе; False — файл не прочитан"""
+        try:
+            data = read_json(path)
+            if not isinstance(data, dict):
+                return False
+            put_all(data, [(META_UPSERT, (f'imported:{path}', datetime.datetime.now().isoformat(timespec='seconds')))])
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def changed_json(self):
+        """Уже перенесённые JSON-файлы, которые изменены после переноса"""
+        changed = []
+        for path, _ in self.json_sources():
+            imported = self.imported_at(path)
+            # Время переноса хранится с точностью до секунды — так же сравниваем и время файла
+            if imported is not None and os.path.exists(path) and int(os.path.getmtime(path)) > imported.timestamp():
+                changed.append(path)
+        return changed
+
+    def reimport_json(self, path):
+        return self.import_json(path, dict(self.json_sources())[path])
+
+    def mark_json_current(self, path):
+        """Файл совпадает с базой (только что выгружен или от повторного импорта отказались)"""
+        for source, _ in self.json_sources():
+            if os.path.abspath(path) == os.path.abspath(source):
+                with self.conn:
+                    self.conn.execute(META_UPSERT, (f'imported:{source}', datetime.datetime.now().isoformat(timespec='seconds')))
+
+    def close(self):
+        self.conn.close()
+
+    def products(self):
+        return dict(self.conn.execute("SELECT name, gtin FROM products ORDER BY rowid"))
+
+    def lines(self):
+        return {name: json.loads(params) for name, params in self.conn.execute("SELECT name, params FROM lines ORDER BY rowid")}
+
+    def put_product(self, name, gtin, old_name=None):
+        """Добавление или изменение продукта; при переименовании запись переезжает в конец, как в словаре"""
+        with self.conn:
+            if old_name is not None and old_name != name:
+                self.conn.execute("DELETE FROM products WHERE name = ?", (old_name,))
+            self.conn.execute(PRODUCT_UPSERT, (name, gtin))
+
+    def delete_product(self, name):
+        with self.conn:
+            self.conn.execute("DELETE FROM products WHERE name = ?", (name,))
+
+    def put_products(self, products, extra=()):
+        """Импорт многих продуктов одной транзакцией: либо все, либо ни одного"""
+        with self.conn:
+            self.conn.executemany(PRODUCT_UPSERT, ((name, str(gtin)) for name, gtin in products.items()))
+            for sql, params in extra:
+                self.conn.execute(sql, params)
+
+    def put_line(self, name, line, old_name=None):
+        with self.conn:
+            if old_name is not None and old_name != name:
+                self.conn.execute("DELETE FROM lines WHERE name = ?", (old_name,))
+            self.conn.execute(LINE_UPSERT, (name, json.dumps(line, ensure_ascii=False)))
+
+    def delete_line(self, name):
+        with self.conn:
+            self.conn.execute("DELETE FROM lines WHERE name = ?", (name,))
+
+    def put_lines(self, lines, extra=()):
+        with self.conn:
+            self.conn.executemany(LINE_UPSERT, ((name, json.dumps(line, ensure_ascii=False)) for name, line in lines.items()))
+            for sql, params in extra:
+                self.conn.execute(sql, params)
+
+STORE = None
+
+def get_store():
+    global STORE
+    if STORE is None:
+        STORE = LocalStore()
+    return STORE
+
+def close_store():
+    global STORE
+    if STORE is not None:
+        STORE.close()
+        STORE = None
+
+# Загрузка линий (ранее профилей)
+def load_lines():
+    try:
+        return get_store().lines()
+    except Exception:
+        # База недоступна (например, папка только для чтения) — читаем JSON как раньше
+        try:
+            return read_json(PROFILES_FILE)
+        except Exception:
+            return {}
+
+# Загрузка продуктов
+def load_products():
+    try:
+        return get_store().products()
+    except Exception:
+        try:
+            return read_json(PRODUCTS_FILE)
+        except Exception:
+            return {}
+
+def parse_products_file(data):
+    """Продукты из JSON: словарь название → GTIN (products.json) или список {"Name", "Gtin"} (выгрузка 1С)"""
+    if isinstance(data, dict):
+        return {str(name): str(gtin) for name, gtin in data.items() if name and gtin}
+    return {item.get('Name'): str(item.get('Gtin')) for item in data if item.get('Name') and item.get('Gtin')}
+
+# Поиск продукта по части названия или GTIN
+SEARCH_NGRAM = 3
+
+class ProductIndex:
+    """Индекс продуктов для поиска по подстроке названия или GTIN без учёта регистра.
+
+    Для каждой триграммы хранится список продуктов, где она встречается.
+    Проверять подстрокой нужно только продукты из самого короткого списка
+    среди триграмм запроса. Запросы короче триграммы проверяются перебором:
+    им всё равно подходит большая часть справочника. Триграммы собираются
+    в фоновом потоке при первом запросе; до готовности поиск идёт перебором.
+    """
+    def __init__(self, products):
+        self.names = list(products)
+        self.texts = [name.casefold() for name in self.names]
+        self.gtins = [str(products[name]) for name in self.names]
+        # Название и GTIN через перевод строки: запрос без него не найдётся на стыке
+        self.haystacks = [text + '\n' + gtin for text, gtin in zip(self.texts, self.gtins)]
+        self.grams = None
+        self.building = False
+        # Последний запрос и его совпадения: при наборе запрос удлиняется, и новые
+        # совпадения ищутся среди прежних
+        self.last_query = None
+        self.last_matches = set()
+
+    def __len__(self):
+        return len(self.names)
+
+    def build(self):
+        grams = collections.defaultdict(list)
+        for i, value in enumerate(self.haystacks):
+            for gram in {value[start:start + SEARCH_NGRAM] for start in range(len(value) - SEARCH_NGRAM + 1)}:
+                grams[gram].append(i)
+        self.grams = grams
+
+    def build_in_background(self):
+        if not self.building:
+            self.building = True
+            threading.Thread(target=self.build, daemon=True).start()
+
+    def matches(self, query):
+        """Номера продуктов, в названии или GTIN которых есть query"""
+        query = query.casefold()
+        if not query:
+            return set(range(len(self.names)))
+        grams = self.grams
+        if grams is None:
+            self.build_in_background()
+        candidates = range(len(self.names))
+        if len(query) >= SEARCH_NGRAM and grams is not None:
+            candidates = min((grams.get(query[start:start + SEARCH_NGRAM], ())
+                              for start in range(len(query) - SEARCH_NGRAM + 1)), key=len)
+        if self.last_query and self.last_query in query and len(self.last_matches) < len(candidates):
+            candidates = self.last_matches
+        haystacks = self.haystacks
+        found = {i for i in candidates if query in haystacks[i]}
+        self.last_query, self.last_matches = query, found
+        return found
+
+    def count(self, query):
+        return len(self.matches(query))
+
+    def rank(self, i, query):
+        """Ключ сортировки: точное совпадение, начало названия, начало слова, середина слова, GTIN"""
+        text = self.texts[i]
+        pos = text.find(query)
+        if pos < 0:
+            kind, pos = 4, self.gtins[i].find(query)
+        elif text == query:
+            kind = 0
+        elif pos == 0:
+            kind = 1
+        elif not text[pos - 1].isalnum():
+            kind = 2
+        else:
+            kind = 3
+        return kind, pos, len(text), text
+
+    def search(self, query, limit=None):
+        """Названия найденных продуктов, самые подходящие первыми"""
+        found = self.matches(query)
+        query = query.casefold()
+        if not query:
+            ranked = sorted(found)
+            return [self.names[i] for i in (ranked[:limit] if limit else ranked)]
+        key = lambda i: self.rank(i, query)
+        ranked = heapq.nsmallest(limit, found, key=key) if limit else sorted(found, key=key)
+        return [self.names[i] for i in ranked]
+
+# Способы поиска GTIN в коде маркировки.
+# В коде GS1 DataMatrix GTIN идёт сразу за идентификатором применения (01),
+# т.е. занимает символы 3–16 кода. Поиск по началу кода и по позиции может
+# обслуживаться индексом, поиск вхождения — только полным сканированием.
+GTIN_MATCH_AUTO = 'auto'  # prefix или position — смотря какой индекс есть на линии
+GTIN_MATCH_PREFIX = 'prefix'
+GTIN_MATCH_POSITION = 'position'
+GTIN_MATCH_CONTAINS = 'contains'
+
+GTIN_MATCH_MODES = [
+    (GTIN_MATCH_AUTO, 'Авто: по индексам линии'),
+    (GTIN_MATCH_PREFIX, 'Начало кода: (01) + GTIN'),
+    (GTIN_MATCH_POSITION, 'GTIN на позиции 3–16 кода'),
+    (GTIN_MATCH_CONTAINS, 'Вхождение в любом месте (медленно)'),
+]
+
+def normalize_gtin(gtin):
+    """GTIN в AI (01) всегда 14-значный — дополняем ведущими нулями"""
+    gtin = str(gtin).strip()
+    if gtin.isdigit() and len(gtin) < 14:
+        gtin = gtin.zfill(14)
+    return gtin
+
+def gtin_aliases(products):
+    """Обратный индекс справочника: GTIN → названия всех продуктов с ним, в порядке справочника"""
+    aliases = {}
+    for name, gtin in products.items():
+        aliases.setdefault(normalize_gtin(gtin), []).append(name)
+    return aliases
+
+def gtin_key(gtin, gtin_match=GTIN_MATCH_PREFIX):
+    """GTIN, по которому совпадают проверки: contains ищет значение как оно записано, остальные — 14-значный"""
+    return str(gtin) if gtin_match == GTIN_MATCH_CONTAINS else normalize_gtin(gtin)
+
+def group_by_gtin(names, products, gtin_match=GTIN_MATCH_PREFIX):
+    """Выбранные продукты по различным GTIN: [(gtin, [названия])] в порядке выбора"""
+    groups = {}
+    for name in names:
+        groups.setdefault(gtin_key(products[name], gtin_match), []).append(name)
+    return list(groups.items())
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def build_gtin_condition(gtin, mode=GTIN_MATCH_PREFIX):
+    """Условие WHERE для поиска по GTIN и его параметры.
+
+    prefix   — code LIKE '01<GTIN>%', индекс: CREATE INDEX ON codes (code text_pattern_ops)
+    position — substr(code, 3, 14) = GTIN, индекс: CREATE INDEX ON codes (substr(code, 3, 14))
+    contains — code LIKE '%GTIN%', индекс не используется (для кодов другого формата)
+    """
+    if mode in (GTIN_MATCH_PREFIX, GTIN_MATCH_AUTO):
+        return "code LIKE %s", [f"01{escape_like(normalize_gtin(gtin))}%"]
+    if mode == GTIN_MATCH_POSITION:
+        return "substr(code, 3, 14) = %s", [normalize_gtin(gtin)]
+    return "code LIKE %s", [f"%{gtin}%"]
+
+def to_date(value):
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value
+
+def date_range_bounds(date_from, date_to):
+    """Полуинтервал [начало дня date_from; начало дня после date_to)"""
+    start = to_date(date_from)
+    end = to_date(date_to) + datetime.timedelta(days=1) if date_to else None
+    return start, end
+
+def build_check_where(gtin, date_from, date_to, date_field='dtime_ins', gtin_match=GTIN_MATCH_PREFIX, since=None):
+    """Условие WHERE проверки и параметры к нему.
+
+    Диапазон дат сравнивается с самим столбцом, без приведения ::date, чтобы
+    мог использоваться индекс по dtime_ins / production_date. Границы — даты,
+    для timestamptz сервер переводит их во время часового пояса сессии (линии).
+    since — дополнительная нижняя граница по dtime_ins, для догрузки новых строк: время вставки
+    только растёт, а production_date у строки, добавленной позже, может оказаться и старым.
+    """
+    where, params = build_gtin_condition(gtin, gtin_match)
+    date_where, date_params = build_date_condition(date_from, date_to, date_field, since)
+    return f"{where} AND {date_where}", params + date_params
+
+def build_date_condition(date_from, date_to, date_field='dtime_ins', since=None):
+    start, end = date_range_bounds(date_from, date_to)
+    where = f"{date_field} >= %s"
+    params = [start]
+    if end:
+        where += f" AND {date_field} < %s"
+        params.append(end)
+    if since is not None:
+        where += " AND dtime_ins >= %s"
+        params.append(since)
+    return where, params
+
+def quote_column(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def build_check_query(gtin, date_from, date_to, date_field='dtime_ins', gtin_match=GTIN_MATCH_PREFIX, limit=None,
+                      since=None, columns=None):
+    """SQL проверки записей и параметры к нему; columns — список столбцов (по умолчанию все)"""
+    where, params = build_check_where(gtin, date_from, date_to, date_field, gtin_match, since)
+    select_list = ', '.join(quote_column(name) for name in columns) if columns else '*'
+    sql = f"SELECT {select_list} FROM codes WHERE {where}"
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, params
+
+def build_count_query(gtin, date_from, date_to, date_field='dtime_ins', gtin_match=GTIN_MATCH_PREFIX):
+    where, params = build_check_where(gtin, date_from, date_to, date_field, gtin_match)
+    return f"SELECT count(*) FROM codes WHERE {where}", params
+
+def build_batch_count_query(gtins, date_from, date_to, date_field='dtime_ins', gtin_match=GTIN_MATCH_PREFIX):
+    """Количество строк по каждому из нескольких GTIN за один проход по таблице.
+
+    Условия GTIN объединяются через OR (для prefix/position сервер склеивает
+    индексные сканирования), а CASE относит строку к её GTIN для GROUP BY.
+    """
+    conditions = [build_gtin_condition(gtin, gtin_match) for gtin in gtins]
+    case_sql = ' '.join(f"WHEN {sql} THEN %s" for sql, _ in conditions)
+    case_params = []
+    for gtin, (_, params) in zip(gtins, conditions):
+        case_params += params + [gtin_key(gtin, gtin_match)]
+    where = ' OR '.join(sql for sql, _ in conditions)
+    where_params = [param for _, params in conditions for param in params]
+    date_where, date_params = build_date_condition(date_from, date_to, date_field)
+    sql = (f"SELECT CASE {case_sql} END AS gtin, count(*) FROM codes "
+           f"WHERE ({where}) AND {date_where} GROUP BY 1")
+    return sql, case_params + where_params + date_params
+
+# Выбор столбцов: без этих не работают проверка, кэш, мониторинг и поиск дублей
+REQUIRED_COLUMNS = ('code', 'dtime_ins', 'production_date')
+
+def fetch_table_columns(cur, table='codes'):
+    """Столбцы таблицы и их типы в порядке объявления"""
+    cur.execute("SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+                "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped ORDER BY attnum", (table,))
+    return cur.fetchall()
+
+def fetch_primary_key(cur, table='codes'):
+    cur.execute("SELECT a.attname FROM pg_index i "
+                "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+                "WHERE i.indrelid = %s::regclass AND i.indisprimary ORDER BY a.attnum", (table,))
+    return [row[0] for row in cur.fetchall()]
+
+# Индексы, которые обслуживают поиск GTIN (по тексту pg_get_indexdef)
+PREFIX_INDEX_RE = re.compile(r'\(code (text_pattern_ops|varchar_pattern_ops|COLLATE "C")')
+POSITION_INDEX_RE = re.compile(r'\(substr\(code, 3, 14\)\)')
+
+class TableSchema:
+    """Столбцы, индексы и оценка числа строк таблицы codes на одной линии"""
+    def __init__(self, exists, columns=(), primary_key=(), indexes=(), reltuples=None):
+        self.exists = exists
+        self.columns = list(columns)  # (имя, тип)
+        self.primary_key = list(primary_key)
+        self.indexes = list(indexes)  # (имя, определение)
+        self.reltuples = reltuples  # оценка из pg_class, None — таблица ещё не анализировалась
+
+    def column_names(self):
+        return [name for name, _ in self.columns]
+
+    def has_index(self, pattern):
+        return any(pattern.search(definition) for _, definition in self.indexes)
+
+    def best_gtin_match(self):
+        if self.has_index(PREFIX_INDEX_RE):
+            return GTIN_MATCH_PREFIX
+        if self.has_index(POSITION_INDEX_RE):
+            return GTIN_MATCH_POSITION
+        return GTIN_MATCH_PREFIX
+
+    def validate(self, date_field, columns=None):
+        """Текст ошибки, если проверку с такими параметрами заведомо не выполнить"""
+        if not self.exists:
+            return 'На линии нет таблицы codes'
+        names = self.column_names()
+        missing = [name for name in ['code', date_field] + list(columns or []) if name not in names]
+        if missing:
+            return f"В таблице codes нет столбцов: {', '.join(dict.fromkeys(missing))}"
+        return None
+
+def fetch_schema(cur, table='codes'):
+    cur.execute("SELECT to_regclass(%s)", (table,))
+    if cur.fetchone()[0] is None:
+        return TableSchema(False)
+    columns = fetch_table_columns(cur, table)
+    primary_key = fetch_primary_key(cur, table)
+    cur.execute("SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid) FROM pg_index "
+                "WHERE indrelid = %s::regclass ORDER BY 1", (table,))
+    indexes = cur.fetchall()
+    cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (table,))
+    reltuples = cur.fetchone()[0]
+    return TableSchema(True, columns, primary_key, indexes, reltuples if reltuples >= 0 else None)
+
+# Структура таблицы по имени линии; сбрасывается вместе с пулом или по кнопке
+SCHEMAS = {}
+SCHEMAS_LOCK = threading.Lock()
+
+def get_schema(line_name):
+    with SCHEMAS_LOCK:
+        return SCHEMAS.get(line_name)
+
+def set_schema(line_name, schema):
+    with SCHEMAS_LOCK:
+        SCHEMAS[line_name] = schema
+
+def invalidate_schema(line_name):
+    with SCHEMAS_LOCK:
+        SCHEMAS.pop(line_name, None)
+
+def resolve_gtin_match(gtin_match, schema):
+    """Режим "авто" превращается в конкретный способ поиска по известной структуре таблицы"""
+    if gtin_match != GTIN_MATCH_AUTO:
+        return gtin_match
+    return schema.best_gtin_match() if schema is not None and schema.exists else GTIN_MATCH_PREFIX
+
+# Гистограмма выработки: размер интервала для date_trunc
+HISTOGRAM_BUCKETS = [
+    ('minute', 'Минута', datetime.timedelta(minutes=1), '%H:%M'),
+    ('hour', 'Час', datetime.timedelta(hours=1), '%d.%m %H:00'),
+    ('day', 'День', datetime.timedelta(days=1), '%d.%m.%Y'),
+    ('week', 'Неделя', datetime.timedelta(weeks=1), '%d.%m.%Y'),
+]
+HISTOGRAM_MAX_GAPS = 5000  # пустые интервалы дорисовываются, только если их не слишком много
+
+def build_histogram_query(gtin, date_from, date_to, date_field='dtime_ins', gtin_match=GTIN_MATCH_PREFIX,
+                          bucket='hour'):
+    """Число строк по интервалам времени: с сервера приходят только итоги по интервалам"""
+    where, params = build_check_where(gtin, date_from, date_to, date_field, gtin_match)
+    sql = f"SELECT date_trunc(%s, {date_field}) AS bucket, count(*) FROM codes WHERE {where} GROUP BY 1 ORDER BY 1"
+    return sql, [bucket] + params
+
+def fill_histogram_gaps(buckets, step):
+    """Добавляет нулевые интервалы между непустыми, чтобы шкала времени была равномерной"""
+    if not buckets:
+        return buckets
+    first, last = buckets[0][0], buckets[-1][0]
+    if (last - first) / step > HISTOGRAM_MAX_GAPS:
+        return buckets
+    counts = dict(buckets)
+    moment = first
+    while moment <= last:
+        counts.setdefault(moment, 0)
+        moment += step
+    return sorted(counts.items())
+
+# Поиск повторяющихся кодов
+DUPLICATE_COLUMNS = ['code', 'Повторов', 'Первый раз', 'Последний раз']
+DUP_MEMORY_CODES = 500000  # столько разных кодов клиент держит в памяти, дальше — разбиение по файлам
+DUP_PARTITIONS = 32
+
+def build_duplicates_query(gtin, date_from, date_to, date_field='dtime_ins', gtin_match=GTIN_MATCH_PREFIX):
+    """Повторяющиеся коды считает сервер: на клиент приходят только сами дубли"""
+    where, params = build_check_where(gtin, date_from, date_to, date_field, gtin_match)
+    sql = (f"SELECT code, count(*), min({date_field}), max({date_field}) FROM codes WHERE {where} "
+           f"GROUP BY code HAVING count(*) > 1 ORDER BY count(*) DESC, code")
+    return sql, params
+
+def parse_moment(text):
+    if 'T' in text:
+        return datetime.datetime.fromisoformat(text)
+    return datetime.date.fromisoformat(text)
+
+def merge_occurrence(counts, code, count, first, last):
+    item = counts.get(code)
+    if item is None:
+        counts[code] = [count, first, last]
+    else:
+        item[0] += count
+        item[1] = min(item[1], first)
+        item[2] = max(item[2], last)
+
+def collect_duplicates(counts):
+    return [(code, count, first, last) for code, (count, first, last) in counts.items() if count > 1]
+
+def find_duplicates(batches, max_codes=DUP_MEMORY_CODES, partitions=DUP_PARTITIONS):
+    """Повторяющиеся коды по потоку пакетов строк (code, дата) с ограниченной памятью.
+
+    Пока разных кодов не больше max_codes, счётчики живут в словаре. Дальше
+    словарь и все следующие строки раскладываются по временным файлам по хешу
+    кода, и каждый файл досчитывается отдельно — одинаковые коды всегда
+    попадают в один файл.
+    """
+    counts = {}
+    files = None
+    try:
+        for rows in batches:
+            for code, moment in rows:
+                if code is None:
+                    continue
+                if files is None:
+                    merge_occurrence(counts, code, 1, moment, moment)
+                    if len(counts) > max_codes:
+                        files = [tempfile.TemporaryFile('w+', encoding='utf-8', newline='') for _ in range(partitions)]
+                        writers = [csv.writer(f) for f in files]
+                        for spilled, (count, first, last) in counts.items():
+                            writers[hash(spilled) % partitions].writerow(
+                                [spilled, count, first.isoformat(), last.isoformat()])
+                        counts = {}
+                else:
+                    writers[hash(code) % partitions].writerow([code, 1, moment.isoformat(), moment.isoformat()])
+        if files is None:
+            duplicates = collect_duplicates(counts)
+        else:
+            duplicates = []
+            for f in files:
+                f.seek(0)
+                counts = {}
+                for code, count, first, last in csv.reader(f):
+                    merge_occurrence(counts, code, int(count), parse_moment(first), parse_moment(last))
+                duplicates += collect_duplicates(counts)
+        duplicates.sort(key=lambda item: (-item[1], item[0]))
+        return duplicates
+    finally:
+        for f in files or []:
+            f.close()
+
+# Столбцы, значения которых в CSV всегда в кавычках
+CSV_QUOTED_COLUMNS = ('code', 'grcode', 'sscc')
+
+def is_csv_quoted_column(name):
+    return name.strip().lower().replace('_', '') in CSV_QUOTED_COLUMNS
+
+def csv_header(colnames):
+    # Заголовки вручную, чтобы всегда были в кавычках
+    return ','.join('"' + name.replace('"', '""') + '"' for name in colnames) + '\n'
+
+def csv_line(row, special_cols):
+    """Строка CSV; столбцы special_cols — всегда в кавычках и с экранированием"""
+    rowdata = []
+    for col, value in enumerate(row):
+        val = '' if value is None else str(value)
+        if col in special_cols and val != '':
+            val = '"' + val.replace('"', '""') + '"'
+        rowdata.append(val)
+    return ','.join(rowdata) + '\n'
+
+# Режимы проверки: сколько данных забирать с сервера
+CHECK_MODE_PREVIEW = 'preview'  # количество + первые строки
+CHECK_MODE_COUNT = 'count'      # только количество
+CHECK_MODE_ALL = 'all'          # все строки
+
+CHECK_MODES = [
+    (CHECK_MODE_PREVIEW, 'Количество + первые строки'),
+    (CHECK_MODE_COUNT, 'Только количество'),
+    (CHECK_MODE_ALL, 'Все строки'),
+]
+PREVIEW_LIMIT = 100
+
+def line_conn_params(line):
+    """Параметры psycopg2.connect для линии из profiles.json"""
+    conn_params = {
+        'host': line['ip'],
+        'port': line['port'],
+        'user': line['user'],
+        'password': line['password'],
+        'dbname': line['dbname']
+    }
+    options = []
+    # Часовой пояс линии: границы дат считаются в нём
+    if line.get('timezone'):
+        options.append(f"-c timezone={line['timezone']}")
+    # Ограничения времени для запросов проверки, в секундах
+    for key in ('statement_timeout', 'lock_timeout'):
+        if line.get(key):
+            options.append(f"-c {key}={int(line[key])}s")
+    if options:
+        conn_params['options'] = ' '.join(options)
+    return conn_params
+
+# Порог оценки прочитанных строк, после которого проверку нужно подтвердить
+PREFLIGHT_MAX_ROWS = 1000000
+
+# Необязательные параметры линии в profiles.json: ключ, подпись, подсказка
+LINE_EXTRA_FIELDS = [
+    ('timezone', 'Часовой пояс', 'например, Asia/Yekaterinburg (необязательно)'),
+    ('statement_timeout', 'Таймаут запроса, с', 'например, 60 (необязательно)'),
+    ('lock_timeout', 'Таймаут блокировки, с', 'например, 5 (необязательно)'),
+    ('preflight_rows', 'Порог строк для подтверждения', f'по умолчанию {PREFLIGHT_MAX_ROWS} (необязательно)'),
+    ('notify_channel', 'Канал NOTIFY', 'для мониторинга, если на codes есть триггер (необязательно)'),
+]
+LINE_NUMERIC_FIELDS = ('statement_timeout', 'lock_timeout', 'preflight_rows')
+
+# Пул соединений линии: повторные проверки не тратят время на подключение
+POOL_MAX_SIZE = 4
+POOL_MAX_IDLE_SEC = 300   # дольше простаивающие соединения закрываются
+POOL_CHECK_IDLE_SEC = 30  # после такого простоя соединение проверяется перед выдачей
+KEEPALIVE_PARAMS = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 3,
+}
+CONNECT_TIMEOUT_SEC = 5
+
+class LinePool:
+    """Пул соединений с БД одной линии"""
+    def __init__(self, conn_params, name=None, max_size=POOL_MAX_SIZE):
+        self.conn_params = conn_params
+        self.name = name
+        self.max_size = max_size
+        self.idle = []  # (соединение, время возврата в пул)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def getconn(self):
+        while True:
+            with self.lock:
+                self.evict_idle()
+                item = self.idle.pop() if self.idle else None
+            if item is None:
+                import psycopg2
+                return psycopg2.connect(**self.conn_params, **KEEPALIVE_PARAMS, connect_timeout=CONNECT_TIMEOUT_SEC)
+            conn, returned = item
+            if self.is_alive(conn, time.monotonic() - returned):
+                return conn
+            close_quietly(conn)
+
+    def putconn(self, conn):
+        if conn.closed:
+            return
+        try:
+            # Незавершённая транзакция не должна достаться следующей проверке
+            conn.rollback()
+        except Exception:
+            close_quietly(conn)
+            return
+        with self.lock:
+            if not self.closed and len(self.idle) < self.max_size:
+                self.idle.append((conn, time.monotonic()))
+                return
+        close_quietly(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def is_alive(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < POOL_CHECK_IDLE_SEC:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def evict_idle(self):
+        """Закрывает давно простаивающие соединения (вызывать под self.lock)"""
+        now = time.monotonic()
+        alive = []
+        for conn, returned in self.idle:
+            if now - returned > POOL_MAX_IDLE_SEC:
+                close_quietly(conn)
+            else:
+                alive.append((conn, returned))
+        self.idle = alive
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            close_quietly(conn)
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+# Пулы по имени линии из profiles.json
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+def get_pool(line_name, line):
+    """Пул линии; пересоздаётся, если параметры подключения изменились"""
+    conn_params = line_conn_params(line)
+    with POOLS_LOCK:
+        pool = POOLS.get(line_name)
+        if pool is not None and pool.conn_params == conn_params:
+            return pool
+        POOLS[line_name] = LinePool(conn_params, line_name)
+    if pool is not None:
+        pool.close()
+        RESULT_CACHE.drop_line(line_name)
+        invalidate_schema(line_name)
+    return POOLS[line_name]
+
+def close_pool(line_name):
+    with POOLS_LOCK:
+        pool = POOLS.pop(line_name, None)
+    if pool is not None:
+        pool.close()
+    RESULT_CACHE.drop_line(line_name)
+    invalidate_schema(line_name)
+
+def close_all_pools():
+    for line_name in list(POOLS):
+        close_pool(line_name)
+
+def evict_idle_connections():
+    with POOLS_LOCK:
+        pools = list(POOLS.values())
+    for pool in pools:
+        with pool.lock:
+            pool.evict_idle()
+
+# Кэш результатов проверки
+CACHE_MAX_ROWS = 300000  # суммарно по всем записям кэша
+CACHE_TTL_SEC = 600      # для диапазонов, которые ещё могут пополняться
+
+def row_day(value):
+    """Дата строки по значению поля даты (datetime приходит во времени сессии линии)"""
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+class CacheEntry:
+    """Строки проверки за полуинтервал дат [start; end)"""
+    def __init__(self, colnames, rows, start, end, date_index, created=None):
+        self.colnames = colnames
+        self.rows = rows
+        self.start = start
+        self.end = end
+        self.date_index = date_index
+        self.insert_index = colnames.index('dtime_ins')
+        self.created = time.monotonic() if created is None else created
+
+    def is_immutable(self):
+        # Диапазон dtime_ins целиком в прошлом (с запасом в сутки на часовой пояс линии) уже не меняется.
+        # По production_date строки за прошлые дни могут добавиться в любой момент
+        if self.date_index != self.insert_index:
+            return False
+        return self.end <= datetime.date.today() - datetime.timedelta(days=1)
+
+    def is_expired(self):
+        return not self.is_immutable() and time.monotonic() - self.created > CACHE_TTL_SEC
+
+    def high_water(self):
+        """Наибольшее dtime_ins среди строк кэша"""
+        values = [row[self.insert_index] for row in self.rows if row[self.insert_index] is not None]
+        return max(values) if values else None
+
+    def rows_between(self, start, end):
+        if start <= self.start and end >= self.end:
+            return list(self.rows)
+        return [row for row in self.rows
+                if row[self.date_index] is not None and start <= row_day(row[self.date_index]) < end]
+
+def refresh_entry(entry, start, end, fetch_range):
+    """Запись кэша, расширенная до [start; end) и догруженная новыми строками.
+
+    fetch_range(start, end, since) возвращает строки полуинтервала дат, при since —
+    только вставленные не раньше since (по dtime_ins). Дни вне кэша читаются целиком.
+    Внутри кэша перечитываются строки с dtime_ins не раньше самого позднего в кэше:
+    у вставленной позже строки production_date может быть и старым, а за ту же
+    секунду, что и последняя строка кэша, могли добавиться ещё. Возвращает
+    (запись, сколько строк пришло с сервера).
+    """
+    rows = list(entry.rows)
+    fetched = 0
+    created = entry.created
+    if entry.is_immutable():
+        created = time.monotonic()
+    else:
+        since = entry.high_water()
+        if since is None:
+            # Времени вставки в кэше нет — окно кэша перечитывается целиком, а не дописывается
+            rows = []
+        else:
+            rows = [row for row in rows if row[entry.insert_index] is None or row[entry.insert_index] < since]
+        new_rows = fetch_range(entry.start, entry.end, since)
+        rows += new_rows
+        fetched += len(new_rows)
+    if start < entry.start:
+        new_rows = fetch_range(start, entry.start, None)
+        rows += new_rows
+        fetched += len(new_rows)
+    if end > entry.end:
+        new_rows = fetch_range(entry.end, end, None)
+        rows += new_rows
+        fetched += len(new_rows)
+    entry = CacheEntry(entry.colnames, rows, min(start, entry.start), max(end, entry.end), entry.date_index, created)
+    return entry, fetched
+
+class ResultCache:
+    """Кэш результатов в памяти: вытеснение давно не использованных записей по числу строк и TTL"""
+    def __init__(self, max_rows=CACHE_MAX_ROWS):
+        self.max_rows = max_rows
+        self.entries = collections.OrderedDict()
+        self.rows_total = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.is_expired():
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.remove(key)
+            if len(entry.rows) > self.max_rows:
+                return
+            self.entries[key] = entry
+            self.rows_total += len(entry.rows)
+            while self.rows_total > self.max_rows:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        """Удаляет запись (вызывать под self.lock)"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.rows_total -= len(entry.rows)
+
+    def drop_line(self, line_name):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == line_name]:
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.rows_total = 0
+
+RESULT_CACHE = ResultCache()
+
+# Потоковая загрузка: размер пакета подбирается так, чтобы один пакет
+# приходил примерно за STREAM_BATCH_TARGET_SEC
+STREAM_BATCH_START = 2000
+STREAM_BATCH_MIN = 500
+STREAM_BATCH_MAX = 50000
+STREAM_BATCH_TARGET_SEC = 0.25
+# Сколько пакетов может ждать обработки в интерфейсе, прежде чем поток остановит чтение
+STREAM_MAX_PENDING = 4
+
+def tune_itersize(itersize, elapsed):
+    """Новый размер пакета по времени получения предыдущего"""
+    if elapsed <= 0:
+        wanted = itersize * 2
+    else:
+        wanted = int(itersize * STREAM_BATCH_TARGET_SEC / elapsed)
+    # Меняем размер не более чем вдвое за шаг
+    wanted = max(itersize // 2, min(itersize * 2, wanted))
+    return max(STREAM_BATCH_MIN, min(STREAM_BATCH_MAX, wanted))
+
+def plan_nodes(plan):
+    """Все узлы плана EXPLAIN (FORMAT JSON) в порядке обхода"""
+    nodes = [plan]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+def plan_uses_index(plan):
+    return any('Index' in node['Node Type'] for node in plan_nodes(plan))
+
+def fetch_relation_rows(cur, plan):
+    """Оценка размера (reltuples) таблиц, которые план читает целиком: {таблица: строк или None — неизвестно}"""
+    from psycopg2.extensions import quote_ident
+    relation_rows = {}
+    for node in plan_nodes(plan):
+        name = node.get('Relation Name')
+        if node['Node Type'] != 'Seq Scan' or not name or name in relation_rows:
+            continue
+        cur.execute("SELECT reltuples::bigint, relpages FROM pg_class WHERE oid = %s::regclass",
+                    (quote_ident(name, cur),))
+        reltuples, relpages = cur.fetchone()
+        # -1 (PostgreSQL 14+) или 0 при непустых страницах — таблица ещё не анализировалась
+        unknown = reltuples < 0 or (reltuples == 0 and relpages > 0)
+        relation_rows[name] = None if unknown else reltuples
+    return relation_rows
+
+def plan_summary(plan, relation_rows=None):
+    """Оценки плана: строк в результате, строк к чтению, стоимость и способы чтения.
+
+    Последовательное сканирование читает всю таблицу, поэтому для него берётся
+    оценка размера таблицы (reltuples из fetch_relation_rows), а не число строк
+    после фильтра. Если размер таблицы неизвестен, rows_read — None.
+    """
+    scans = [node for node in plan_nodes(plan) if 'Scan' in node['Node Type'] and not node.get('Plans')]
+    rows_read = 0
+    for node in scans:
+        if node['Node Type'] == 'Seq Scan':
+            table_rows = (relation_rows or {}).get(node.get('Relation Name'))
+            if table_rows is None:
+                rows_read = None
+                break
+            rows_read += table_rows
+        else:
+            rows_read += node['Plan Rows']
+    return {
+        'rows': plan['Plan Rows'],
+        'rows_read': rows_read,
+        'cost': plan['Total Cost'],
+        'scans': [node['Node Type'] + (f" ({node['Index Name']})" if node.get('Index Name') else '') for node in scans],
+    }
+
+# Замеры проверок: время по фазам, строки и объём данных
+PHASE_TITLES = {
+    'connect': 'Подключение',
+    'execute': 'Выполнение запроса',
+    'fetch': 'Получение строк',
+    'wait': 'Ожидание интерфейса',
+    'render': 'Отображение',
+    'export': 'Выгрузка',
+}
+
+def estimate_bytes(rows, sample=200):
+    """Примерный объём строк результата по первым sample строкам"""
+    if not rows:
+        return 0
+    head = rows[:sample]
+    size = sum(len(value) if isinstance(value, (str, bytes)) else len(str(value))
+               for row in head for value in row if value is not None)
+    return int(size * len(rows) / len(head))
+
+class PhaseTimer:
+    """Время проверки по фазам, число полученных строк и примерный объём данных"""
+    def __init__(self, kind='check', **info):
+        self.started = time.perf_counter()
+        self.info = {'kind': kind, **info}
+        self.phases = {}
+        self.rows = 0
+        self.bytes = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, rows, size=None):
+        self.rows += len(rows) if size is None else rows
+        self.bytes += estimate_bytes(rows) if size is None else size
+
+    def finish(self, status, result_rows=None):
+        record = {'time': datetime.datetime.now().isoformat(timespec='seconds'), **self.info, 'status': status,
+                  'total_ms': round((time.perf_counter() - self.started) * 1000, 1),
+                  'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+                  'rows': self.rows, 'bytes': self.bytes}
+        if result_rows is not None:
+            record['result_rows'] = result_rows
+        return record
+
+def append_history(record):
+    try:
+        with open(HISTORY_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    except Exception:
+        pass
+
+def server_limit_errors():
+    """Ошибки, после которых группировку на сервере заменяет подсчёт на клиенте"""
+    import psycopg2.errors
+    return (
+        psycopg2.extensions.QueryCanceledError,
+        psycopg2.errors.OutOfMemory,
+        psycopg2.errors.DiskFull,
+        psycopg2.errors.ConfigurationLimitExceeded,
+    )
+
+# Мониторинг: опрашиваются только строки новее последней увиденной
+LIVE_POLL_MIN_SEC = 2
+LIVE_POLL_MAX_SEC = 30
+LIVE_DATE_FIELD = 'dtime_ins'  # время вставки растёт вместе с работой линии
+
+def next_poll_interval(interval, new_rows):
+    """Пока линия простаивает, опрос всё реже; с появлением строк — снова часто"""
+    if new_rows:
+        return LIVE_POLL_MIN_SEC
+    return min(interval * 2, LIVE_POLL_MAX_SEC)
+
+def row_key(row):
+    return tuple(str(value) for value in row)
+
+def advance_watermark(watermark, seen, rows, index):
+    """Новые строки опроса и обновлённые (watermark, seen).
+
+    watermark — наибольшее увиденное dtime_ins (столбец index), seen — ключи
+    строк с этим значением: опрос идёт с dtime_ins >= watermark, и строки
+    с самим watermark приходят снова.
+    """
+    new = [row for row in rows if row[index] is None or row[index] != watermark or row_key(row) not in seen]
+    stamped = [row[index] for row in new if row[index] is not None]
+    if stamped:
+        top = max(stamped)
+        if watermark is None or top > watermark:
+            watermark, seen = top, set()
+        seen = seen | {row_key(row) for row in new if row[index] == watermark}
+    return new, watermark, seen
+
+# Проверка на всех линиях
+MULTI_LINE_WORKERS = 4
+MULTI_LINE_TIMEOUT_SEC = 15
+
+def count_on_line(line_name, line, gtin, date_from, date_to, date_field, gtin_match, timeout=MULTI_LINE_TIMEOUT_SEC):
+    """Количество записей на одной линии; ошибки не выбрасываются, а попадают в итог"""
+    summary = {'line': line_name, 'count': None, 'status': 'error', 'latency': None, 'error': None}
+    started = time.monotonic()
+    try:
+        with get_pool(line_name, line).connection() as conn:
+            cur = conn.cursor()
+            # Действует до конца транзакции, пул откатит её при возврате соединения
+            cur.execute('SET LOCAL statement_timeout = %s', (int(timeout * 1000),))
+            # "Авто" — по индексам этой линии; структуру, которой ещё нет в кэше, читаем здесь же
+            schema = get_schema(line_name)
+            if gtin_match == GTIN_MATCH_AUTO and schema is None:
+                schema = fetch_schema(cur)
+                set_schema(line_name, schema)
+            gtin_match = resolve_gtin_match(gtin_match, schema)
+            sql, params = build_count_query(gtin, date_from, date_to, date_field, gtin_match)
+            cur.execute(sql, params)
+            summary['count'] = cur.fetchone()[0]
+            cur.close()
+        summary['status'] = 'ok' if summary['count'] else 'empty'
+    except Exception as e:
+        summary['error'] = str(e).strip()
+    summary['latency'] = time.monotonic() - started
+    return summary
+
+class CopyProgressWriter:
+    """Файл для cursor.copy_expert: пишет данные и примерно считает строки для хода выгрузки.
+
+    Строки считаются по переводам строк, поэтому значение с переводом строки
+    внутри даёт лишнюю; итог выгрузки берётся из cursor.rowcount.
+    """
+    def __init__(self, f, on_progress):
+        self.f = f
+        self.on_progress = on_progress
+        self.rows = 0
+        self.bytes = 0
+        self.last_report = 0.0
+
+    def write(self, data):
+        self.f.write(data)
+        self.rows += data.count(b'\n')
+        self.bytes += len(data)
+        # Не чаще 5 раз в секунду, чтобы не заваливать интерфейс сигналами
+        now = time.monotonic()
+        if now - self.last_report > 0.2:
+            self.last_report = now
+            self.on_progress(self.rows)
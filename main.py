@@ -1,59 +1,85 @@
+import time
+STARTED = time.perf_counter()  # точка отсчёта для замера запуска (bench_startup.py)
 import sys
 import json
 import os
-import csv
+import datetime
+import tempfile
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QLineEdit, QPushButton, QVBoxLayout, QHBoxLayout,
-    QMessageBox, QComboBox, QDateEdit, QInputDialog, QTabWidget, QListWidget, QListWidgetItem, QTableWidget, QTableWidgetItem, QFileDialog, QDialog, QCompleter, QAction, QTextEdit, QScrollArea, QListView, QAbstractScrollArea
+    QMessageBox, QComboBox, QDateEdit, QInputDialog, QTabWidget, QListWidget, QListWidgetItem, QTableWidget, QTableWidgetItem, QFileDialog, QDialog, QCompleter, QTextEdit, QScrollArea, QListView
 )
-from PyQt5.QtCore import QDate, QThread, pyqtSignal, QStringListModel, Qt, QEvent, QTimer
-from PyQt5.QtGui import QPixmap, QIcon, QMovie, QColor
-from PyQt5.QtSvg import QSvgWidget
-from PyQt5 import QtSvg
-import psycopg2
-import requests
-import subprocess
-import time
-import shutil
-
-PROFILES_FILE = 'profiles.json'
-PRODUCTS_FILE = 'products.json'
-
-def resource_path(relative_path):
-    if hasattr(sys, '_MEIPASS'):
-        return os.path.join(sys._MEIPASS, relative_path)
-    return os.path.join(os.path.abspath("."), relative_path)
-
-# Загрузка линий из файла (ранее профилей)
-def load_lines():
-    try:
-        with open(PROFILES_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-def save_lines(lines):
-    with open(PROFILES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(lines, f, ensure_ascii=False, indent=2)
-
-# Загрузка продуктов из файла
-def load_products():
-    try:
-        with open(PRODUCTS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-# Сохранение продуктов в файл
-def save_products(products):
-    with open(PRODUCTS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(products, f, ensure_ascii=False, indent=2)
+from PyQt5.QtCore import QDate, QThread, pyqtSignal, Qt, QEvent, QTimer
+from PyQt5.QtGui import QPixmap, QIcon, QColor, QPainter
+# psycopg2, requests, QtSvg и прочее, что не нужно первому экрану,
+# импортируются там, где используются, — так окно появляется быстрее
+import threading
+import contextlib
+from core import (  # настройки, запросы, пулы и замеры — общие с cli.py
+    CHECK_MODES, CHECK_MODE_ALL, CHECK_MODE_PREVIEW, CONNECT_TIMEOUT_SEC, DUPLICATE_COLUMNS, GTIN_MATCH_CONTAINS,
+    GTIN_MATCH_MODES, GTIN_MATCH_PREFIX, HISTOGRAM_BUCKETS, KEEPALIVE_PARAMS, LINE_EXTRA_FIELDS,
+    LINE_NUMERIC_FIELDS, LIVE_DATE_FIELD, LIVE_POLL_MIN_SEC, MULTI_LINE_TIMEOUT_SEC, MULTI_LINE_WORKERS,
+    PHASE_TITLES, PREFLIGHT_MAX_ROWS, PREVIEW_LIMIT, PRODUCTS_FILE, PROFILES_FILE, REQUIRED_COLUMNS, RESULT_CACHE,
+    STREAM_BATCH_MAX, STREAM_BATCH_MIN, STREAM_BATCH_START, STREAM_MAX_PENDING, CacheEntry, CopyProgressWriter,
+    PhaseTimer, ProductIndex, advance_watermark, append_history, build_batch_count_query, build_check_query,
+    build_check_where, build_count_query, build_duplicates_query, build_histogram_query, close_all_pools,
+    close_pool, close_quietly, close_store, count_on_line, csv_header, csv_line, date_range_bounds,
+    evict_idle_connections, fetch_primary_key, fetch_relation_rows, fetch_schema, fill_histogram_gaps,
+    find_duplicates, get_pool, get_schema, get_store, group_by_gtin, gtin_aliases, gtin_key, invalidate_schema,
+    is_csv_quoted_column, line_conn_params, load_lines, load_products, next_poll_interval, normalize_gtin,
+    parse_products_file, plan_summary, plan_uses_index, quote_column, read_json, refresh_entry, resolve_gtin_match,
+    resource_path, server_limit_errors, set_schema, tune_itersize, write_json
+)
+
+# Сколько подсказок показывать в списке; число совпадений считается по всем
+SEARCH_POPUP_LIMIT = 100
+
+class ProductCompleterModel(QtCore.QAbstractListModel):
+    """Подсказки поиска продукта: совпадения из ProductIndex, самые подходящие первыми"""
+    def __init__(self, products=None, parent=None):
+        super().__init__(parent)
+        self.product_index = ProductIndex(products or {})
+        self.products = dict(products or {})
+        self.query = ''
+        self.names = []
+        self.match_count = 0
+
+    def set_products(self, products):
+        self.products = dict(products)
+        self.product_index = ProductIndex(self.products)
+        # Совпадения пересчитаются при следующем вводе
+        self.set_query('', force=True)
+
+    def set_query(self, query, force=False):
+        if query == self.query and not force:
+            return
+        self.beginResetModel()
+        self.query = query
+        self.names = self.product_index.search(query, SEARCH_POPUP_LIMIT) if query else []
+        self.match_count = len(self.product_index.last_matches) if query else 0
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        name = self.names[index.row()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return name
+        if role == Qt.ToolTipRole:
+            return f'GTIN: {self.products[name]}'
+        return None
 
 class ProductSearchLineEdit(QLineEdit):
     def __init__(self, products, parent=None):
         super().__init__(parent)
-        self.completer = QCompleter(products, self)
+        # Список подсказок уже отфильтрован и упорядочен моделью, QCompleter его не перебирает
+        self.model = ProductCompleterModel(products, self)
+        self.completer = QCompleter(self.model, self)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         popup = QListView()
         popup.setMouseTracking(True)
         popup.setEditTriggers(QListView.NoEditTriggers)
@@ -98,8 +124,6 @@ class ProductSearchLineEdit(QLineEdit):
             "}"
         )
         self.completer.setPopup(popup)
-        self.completer.setCaseSensitivity(Qt.CaseInsensitive)
-        self.completer.setFilterMode(Qt.MatchContains)
         self.setCompleter(self.completer)
 
         # Обработка mouseMoveEvent для подсветки
@@ -167,8 +191,13 @@ class ProductSearchLineEdit(QLineEdit):
         return super().eventFilter(obj, event)
 
     def set_products(self, products):
-        model = QStringListModel(products)
-        self.completer.setModel(model)
+        """products — словарь название → GTIN"""
+        self.model.set_products(products)
+
+    def best_match(self, text):
+        """Самый подходящий продукт для text или None"""
+        self.model.set_query(text)
+        return self.model.names[0] if self.model.names else None
     
     def get_text(self):
         return self.text()
@@ -181,6 +210,8 @@ class ProductSearchLineEdit(QLineEdit):
         # Проверяем, что текст действительно изменился
         if text != self._last_text:
             self._last_text = text
+            # До того как QLineEdit покажет подсказки, модель уже содержит совпадения
+            self.model.set_query(text)
             self.update_popup_height()
     
     def initialize_popup_height(self):
@@ -202,19 +233,9 @@ class ProductSearchLineEdit(QLineEdit):
         if not popup.isVisible() or self._popup_interacting or self._popup_height_locked:
             return
             
-        model = self.completer.model()
-        if not model:
-            return
-            
-        # Подсчитываем количество совпадений
-        search_text = self.text().lower()
-        match_count = 0
-        
-        for i in range(model.rowCount()):
-            item_text = model.data(model.index(i, 0), Qt.DisplayRole).lower()
-            if search_text in item_text:
-                match_count += 1
-        
+        # Количество совпадений уже посчитано индексом при поиске
+        match_count = self.model.match_count
+
         # Вычисляем высоту
         item_height = 48  # Высота одного элемента (padding 12px + margin 2px + min-height 24px + spacing)
         max_items = 12    # Максимальное количество элементов для отображения
@@ -260,21 +281,19 @@ class ProductSearchLineEdit(QLineEdit):
 
 class DBWorker(QThread):
     result_ready = pyqtSignal(object, object, object, object)  # rows, colnames, error, status
-    def __init__(self, conn_params, gtin, date_from, date_to):
+    def __init__(self, conn_params, gtin, date_from, date_to, gtin_match=GTIN_MATCH_PREFIX):
         super().__init__()
         self.conn_params = conn_params
         self.gtin = gtin
         self.date_from = date_from
         self.date_to = date_to
+        self.gtin_match = gtin_match
     def run(self):
         try:
+            import psycopg2
             conn = psycopg2.connect(**self.conn_params)
             cur = conn.cursor()
-            sql = "SELECT * FROM codes WHERE code LIKE %s AND dtime_ins::date >= %s"
-            params = [f"%{self.gtin}%", self.date_from]
-            if self.date_to:
-                sql += " AND dtime_ins::date <= %s"
-                params.append(self.date_to)
+            sql, params = build_check_query(self.gtin, self.date_from, self.date_to, 'dtime_ins', self.gtin_match)
             cur.execute(sql, params)
             rows = cur.fetchall()
             colnames = [desc[0] for desc in cur.description]
@@ -284,35 +303,992 @@ class DBWorker(QThread):
         except Exception as e:
             self.result_ready.emit(None, None, str(e), 'error')
 
-class DBWorkerWithDateField(QThread):
+class CancellableWorker(QThread):
+    """Поток с запросом к БД, который можно прервать на сервере через connection.cancel()"""
+    def __init__(self):
+        super().__init__()
+        self.conn = None
+        self.conn_lock = threading.Lock()
+        self.cancelled = False
+        self.timer = PhaseTimer()
+
+    @contextlib.contextmanager
+    def connection(self, pool):
+        started = time.perf_counter()
+        with pool.connection() as conn:
+            self.timer.add('connect', time.perf_counter() - started)
+            with self.conn_lock:
+                if self.cancelled:
+                    import psycopg2
+                    raise psycopg2.extensions.QueryCanceledError('canceling statement due to user request')
+                self.conn = conn
+            try:
+                yield conn
+            finally:
+                # Соединение уходит обратно в пул — отменять на нём больше нечего
+                with self.conn_lock:
+                    self.conn = None
+
+    def cancel(self):
+        with self.conn_lock:
+            self.cancelled = True
+            self.requestInterruption()
+            if self.conn is not None and not self.conn.closed:
+                self.conn.cancel()
+
+    def error_status(self):
+        return 'cancelled' if self.cancelled else 'error'
+
+class DBWorkerWithDateField(CancellableWorker):
     result_ready = pyqtSignal(object, object, object, object)  # rows, colnames, error, status
-    def __init__(self, conn_params, gtin, date_from, date_to, date_field):
+    # Потоковый режим: пакеты строк по мере получения и итог
+    batch_ready = pyqtSignal(object, object)  # rows, colnames
+    stream_finished = pyqtSignal(object, object, object)  # total, error, status
+    # Режимы "количество" и "количество + первые строки"
+    count_ready = pyqtSignal(object, object, object, object, object)  # total, rows, colnames, error, status
+    def __init__(self, pool, gtin, date_from, date_to, date_field, gtin_match=GTIN_MATCH_PREFIX,
+                 stream=False, itersize=0, mode=CHECK_MODE_ALL, preview_limit=PREVIEW_LIMIT, cache=None, columns=None):
         super().__init__()
-        self.conn_params = conn_params
+        self.pool = pool
         self.gtin = gtin
         self.date_from = date_from
         self.date_to = date_to
         self.date_field = date_field
+        self.gtin_match = gtin_match
+        self.stream = stream
+        self.itersize = itersize  # 0 — подбирать автоматически
+        self.pending = threading.Semaphore(STREAM_MAX_PENDING)
+        self.mode = mode
+        self.preview_limit = preview_limit
+        self.cache = cache
+        self.columns = columns
+        self.fetched = None  # сколько строк реально пришло с сервера
+        self.timer.info.update(line=pool.name, gtin=gtin, date_from=date_from, date_to=date_to,
+                               date_field=date_field, gtin_match=gtin_match, mode=mode, stream=stream,
+                               cache=cache is not None, columns=columns)
     def run(self):
+        if self.mode != CHECK_MODE_ALL:
+            self.run_count()
+            return
         try:
-            conn = psycopg2.connect(**self.conn_params)
+            sql, params = build_check_query(self.gtin, self.date_from, self.date_to, self.date_field, self.gtin_match,
+                                            columns=self.columns)
+            with self.connection(self.pool) as conn:
+                if self.stream:
+                    total = self.fetch_stream(conn, sql, params)
+                elif self.cache is not None and self.date_to:
+                    rows, colnames = self.fetch_cached(conn)
+                else:
+                    cur = conn.cursor()
+                    with self.timer.phase('execute'):
+                        cur.execute(sql, params)
+                    with self.timer.phase('fetch'):
+                        rows = cur.fetchall()
+                    self.timer.count(rows)
+                    colnames = [desc[0] for desc in cur.description]
+                    cur.close()
+                    self.fetched = len(rows)
+            if self.stream:
+                self.stream_finished.emit(total, None, self.error_status() if self.cancelled else 'ok')
+            else:
+                self.result_ready.emit(rows, colnames, None, 'ok')
+        except Exception as e:
+            if self.stream:
+                self.stream_finished.emit(None, str(e), self.error_status())
+            else:
+                self.result_ready.emit(None, None, str(e), self.error_status())
+
+    def fetch_cached(self, conn):
+        """Строки из кэша; с сервера догружаются только недостающие дни и строки новее кэша (refresh_entry)"""
+        # Продукты с одним GTIN (псевдонимы) делят одну запись кэша
+        key = (self.pool.name, gtin_key(self.gtin, self.gtin_match), self.date_field, self.gtin_match, tuple(self.columns or ()))
+        start, end = date_range_bounds(self.date_from, self.date_to)
+        entry = self.cache.get(key)
+        # Кэш не пересекается с запрошенным диапазоном и не примыкает к нему — читаем заново
+        if entry is not None and (start > entry.end or end < entry.start):
+            entry = None
+        cur = conn.cursor()
+        if entry is None:
+            rows, colnames = self.fetch_range(cur, start, end)
+            self.fetched = len(rows)
+            entry = CacheEntry(colnames, rows, start, end, colnames.index(self.date_field))
+        else:
+            entry, self.fetched = refresh_entry(entry, start, end,
+                                                lambda start, end, since: self.fetch_range(cur, start, end, since)[0])
+        cur.close()
+        self.cache.put(key, entry)
+        return entry.rows_between(start, end), entry.colnames
+
+    def fetch_range(self, cur, start, end, since=None):
+        """Строки за полуинтервал дат [start; end)"""
+        sql, params = build_check_query(self.gtin, start, end - datetime.timedelta(days=1), self.date_field,
+                                        self.gtin_match, since=since, columns=self.columns)
+        with self.timer.phase('execute'):
+            cur.execute(sql, params)
+        with self.timer.phase('fetch'):
+            rows = cur.fetchall()
+        self.timer.count(rows)
+        return rows, [desc[0] for desc in cur.description]
+
+    def run_count(self):
+        """Количество строк считает сервер; с клиента забираются только первые строки"""
+        try:
+            rows, colnames, total = [], [], None
+            with self.connection(self.pool) as conn:
+                cur = conn.cursor()
+                if self.mode == CHECK_MODE_PREVIEW:
+                    sql, params = build_check_query(self.gtin, self.date_from, self.date_to, self.date_field,
+                                                    self.gtin_match, limit=self.preview_limit, columns=self.columns)
+                    with self.timer.phase('execute'):
+                        cur.execute(sql, params)
+                    with self.timer.phase('fetch'):
+                        rows = cur.fetchall()
+                    self.timer.count(rows)
+                    colnames = [desc[0] for desc in cur.description]
+                    # Все строки уже получены — COUNT(*) не нужен
+                    if len(rows) < self.preview_limit:
+                        total = len(rows)
+                if total is None:
+                    sql, params = build_count_query(self.gtin, self.date_from, self.date_to, self.date_field,
+                                                    self.gtin_match)
+                    with self.timer.phase('execute'):
+                        cur.execute(sql, params)
+                    total = cur.fetchone()[0]
+                cur.close()
+            self.count_ready.emit(total, rows, colnames, None, 'ok')
+        except Exception as e:
+            self.count_ready.emit(None, None, None, str(e), self.error_status())
+
+    def fetch_stream(self, conn, sql, params):
+        """Чтение через серверный курсор: в памяти потока не больше STREAM_MAX_PENDING пакетов"""
+        cur = conn.cursor(name='checkdb_stream')
+        itersize = self.itersize or STREAM_BATCH_START
+        cur.itersize = itersize
+        with self.timer.phase('execute'):
+            cur.execute(sql, params)
+        total = 0
+        while not self.isInterruptionRequested():
+            started = time.monotonic()
+            with self.timer.phase('fetch'):
+                rows = cur.fetchmany(itersize)
+            if not rows:
+                break
+            total += len(rows)
+            self.timer.count(rows)
+            # Ждём, пока интерфейс разберёт уже отправленные пакеты
+            with self.timer.phase('wait'):
+                while not self.pending.acquire(timeout=0.5):
+                    if self.isInterruptionRequested():
+                        break
+            if self.isInterruptionRequested():
+                break
+            self.batch_ready.emit(rows, [desc[0] for desc in cur.description])
+            if not self.itersize:
+                itersize = tune_itersize(itersize, time.monotonic() - started)
+        cur.close()
+        return total
+
+    def batch_done(self):
+        """Вызывается интерфейсом после обработки очередного пакета"""
+        self.pending.release()
+
+class ExplainWorker(CancellableWorker):
+    result_ready = pyqtSignal(object, object, object)  # explain, error, status
+    def __init__(self, pool, sql, params, analyze=False):
+        super().__init__()
+        self.pool = pool
+        self.sql = sql
+        self.params = params
+        self.analyze = analyze  # ANALYZE действительно выполняет запрос
+        self.relation_rows = {}  # размеры таблиц, которые план читает целиком
+    def run(self):
+        try:
+            options = 'ANALYZE, BUFFERS, FORMAT JSON' if self.analyze else 'FORMAT JSON'
+            with self.connection(self.pool) as conn:
+                cur = conn.cursor()
+                cur.execute(f'EXPLAIN ({options}) ' + self.sql, self.params)
+                explain = cur.fetchone()[0][0]
+                self.relation_rows = fetch_relation_rows(cur, explain['Plan'])
+                cur.close()
+            self.result_ready.emit(explain, None, 'ok')
+        except Exception as e:
+            self.result_ready.emit(None, str(e), self.error_status())
+
+class BatchCountWorker(CancellableWorker):
+    result_ready = pyqtSignal(object, object, object)  # counts, error, status
+    def __init__(self, pool, gtins, date_from, date_to, date_field, gtin_match=GTIN_MATCH_PREFIX):
+        super().__init__()
+        self.pool = pool
+        self.gtins = gtins
+        self.date_from = date_from
+        self.date_to = date_to
+        self.date_field = date_field
+        self.gtin_match = gtin_match
+    def run(self):
+        try:
+            sql, params = build_batch_count_query(self.gtins, self.date_from, self.date_to, self.date_field,
+                                                  self.gtin_match)
+            with self.connection(self.pool) as conn:
+                cur = conn.cursor()
+                cur.execute(sql, params)
+                counts = dict(cur.fetchall())
+                cur.close()
+            self.result_ready.emit(counts, None, 'ok')
+        except Exception as e:
+            self.result_ready.emit(None, str(e), self.error_status())
+
+class SchemaWorker(QThread):
+    """Фоновое чтение структуры таблицы codes линии в кэш"""
+    result_ready = pyqtSignal(object, object, object, object)  # line_name, schema, error, status
+    def __init__(self, line_name, line):
+        super().__init__()
+        self.line_name = line_name
+        self.line = line
+    def run(self):
+        try:
+            with get_pool(self.line_name, self.line).connection() as conn:
+                cur = conn.cursor()
+                schema = fetch_schema(cur)
+                cur.close()
+            set_schema(self.line_name, schema)
+            self.result_ready.emit(self.line_name, schema, None, 'ok')
+        except Exception as e:
+            self.result_ready.emit(self.line_name, None, str(e), 'error')
+
+class FullRowWorker(QThread):
+    """Полная строка по первичному ключу — когда в таблице показаны не все столбцы"""
+    result_ready = pyqtSignal(object, object, object, object)  # row, colnames, error, status
+    def __init__(self, pool, values, primary_key=None):
+        super().__init__()
+        self.pool = pool
+        self.values = values  # столбец -> значение из показанной строки
+        self.primary_key = primary_key
+    def run(self):
+        try:
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                primary_key = self.primary_key or fetch_primary_key(cur)
+                if not primary_key or any(name not in self.values for name in primary_key):
+                    raise ValueError('У таблицы codes нет первичного ключа среди показанных столбцов')
+                where = ' AND '.join(f"{quote_column(name)} = %s" for name in primary_key)
+                cur.execute(f"SELECT * FROM codes WHERE {where}", [self.values[name] for name in primary_key])
+                row = cur.fetchone()
+                colnames = [desc[0] for desc in cur.description]
+                cur.close()
+            if row is None:
+                raise ValueError('Строка не найдена — возможно, она уже удалена')
+            self.result_ready.emit(row, colnames, None, 'ok')
+        except Exception as e:
+            self.result_ready.emit(None, None, str(e), 'error')
+
+class HistogramWorker(CancellableWorker):
+    result_ready = pyqtSignal(object, object, object)  # buckets, error, status
+    def __init__(self, pool, gtin, date_from, date_to, date_field, gtin_match=GTIN_MATCH_PREFIX, bucket='hour'):
+        super().__init__()
+        self.pool = pool
+        self.gtin = gtin
+        self.date_from = date_from
+        self.date_to = date_to
+        self.date_field = date_field
+        self.gtin_match = gtin_match
+        self.bucket = bucket
+    def run(self):
+        try:
+            sql, params = build_histogram_query(self.gtin, self.date_from, self.date_to, self.date_field,
+                                                self.gtin_match, self.bucket)
+            with self.connection(self.pool) as conn:
+                cur = conn.cursor()
+                cur.execute(sql, params)
+                buckets = cur.fetchall()
+                cur.close()
+            self.result_ready.emit(buckets, None, 'ok')
+        except Exception as e:
+            self.result_ready.emit(None, str(e), self.error_status())
+
+class DuplicatesWorker(CancellableWorker):
+    result_ready = pyqtSignal(object, object, object, object)  # rows, method, error, status
+    def __init__(self, pool, gtin, date_from, date_to, date_field, gtin_match=GTIN_MATCH_PREFIX):
+        super().__init__()
+        self.pool = pool
+        self.gtin = gtin
+        self.date_from = date_from
+        self.date_to = date_to
+        self.date_field = date_field
+        self.gtin_match = gtin_match
+    def run(self):
+        try:
+            try:
+                rows, method = self.find_on_server(), 'server'
+            except server_limit_errors():
+                # Сервер не уложился в таймаут или лимиты памяти — считаем сами по потоку кодов
+                if self.cancelled:
+                    raise
+                rows, method = self.find_on_client(), 'client'
+            self.result_ready.emit(rows, method, None, 'ok')
+        except Exception as e:
+            self.result_ready.emit(None, None, str(e), self.error_status())
+
+    def find_on_server(self):
+        sql, params = build_duplicates_query(self.gtin, self.date_from, self.date_to, self.date_field,
+                                             self.gtin_match)
+        with self.connection(self.pool) as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            cur.close()
+        return rows
+
+    def find_on_client(self):
+        where, params = build_check_where(self.gtin, self.date_from, self.date_to, self.date_field, self.gtin_match)
+        with self.connection(self.pool) as conn:
+            cur = conn.cursor(name='checkdb_duplicates')
+            cur.execute(f"SELECT code, {self.date_field} FROM codes WHERE {where}", params)
+            rows = find_duplicates(self.batches(cur))
+            cur.close()
+        return rows
+
+    def batches(self, cur):
+        while not self.isInterruptionRequested():
+            rows = cur.fetchmany(STREAM_BATCH_MAX)
+            if not rows:
+                return
+            yield rows
+        import psycopg2
+        raise psycopg2.extensions.QueryCanceledError('canceling statement due to user request')
+
+class LiveWorker(CancellableWorker):
+    rows_ready = pyqtSignal(object, object)  # rows, colnames
+    poll_done = pyqtSignal(object, object)  # new_rows, next_interval
+    stopped = pyqtSignal(object, object)  # error, status
+    def __init__(self, pool, gtin, date_from, date_to=None, date_field=LIVE_DATE_FIELD, gtin_match=GTIN_MATCH_PREFIX,
+                 channel=None, columns=None, shown_rows=None, shown_colnames=None):
+        super().__init__()
+        self.pool = pool
+        self.gtin = gtin
+        self.date_from = date_from
+        self.date_to = date_to
+        self.date_field = date_field
+        self.gtin_match = gtin_match
+        self.channel = channel
+        self.columns = columns
+        self.watermark = None  # наибольшее увиденное значение dtime_ins
+        self.seen = set()  # строки, у которых dtime_ins равно watermark
+        # Результат той же проверки уже на экране — опрос продолжается с его последней строки
+        if shown_rows:
+            _, self.watermark, self.seen = advance_watermark(
+                None, set(), shown_rows, shown_colnames.index(LIVE_DATE_FIELD))
+    def run(self):
+        listen_conn = None
+        interval = LIVE_POLL_MIN_SEC
+        try:
+            if self.channel:
+                listen_conn = self.listen()
+            if self.watermark is None:
+                self.load_initial()
+            while not self.isInterruptionRequested():
+                new_rows = self.poll()
+                interval = next_poll_interval(interval, new_rows)
+                self.poll_done.emit(new_rows, interval)
+                self.wait_next(listen_conn, interval)
+            self.stopped.emit(None, 'ok')
+        except Exception as e:
+            self.stopped.emit(str(e), self.error_status())
+        finally:
+            if listen_conn is not None:
+                close_quietly(listen_conn)
+
+    def query(self):
+        return build_check_query(self.gtin, self.date_from, self.date_to, self.date_field, self.gtin_match,
+                                 since=self.watermark, columns=self.columns)
+
+    def load_initial(self):
+        """Первая загрузка без результата на экране: серверным курсором, пакетами"""
+        sql, params = self.query()
+        with self.connection(self.pool) as conn:
+            cur = conn.cursor(name='checkdb_live')
+            cur.execute(sql, params)
+            while not self.isInterruptionRequested():
+                rows = cur.fetchmany(STREAM_BATCH_START)
+                if not rows:
+                    break
+                colnames = [desc[0] for desc in cur.description]
+                self.emit_new(rows, colnames)
+            cur.close()
+
+    def poll(self):
+        """Забирает строки с dtime_ins не раньше watermark; уже показанные отбрасывает"""
+        sql, params = self.query()
+        with self.connection(self.pool) as conn:
             cur = conn.cursor()
-            sql = f"SELECT * FROM codes WHERE code LIKE %s AND {self.date_field}::date >= %s"
-            params = [f"%{self.gtin}%", self.date_from]
-            if self.date_to:
-                sql += f" AND {self.date_field}::date <= %s"
-                params.append(self.date_to)
             cur.execute(sql, params)
             rows = cur.fetchall()
             colnames = [desc[0] for desc in cur.description]
             cur.close()
-            conn.close()
-            self.result_ready.emit(rows, colnames, None, 'ok')
+        return self.emit_new(rows, colnames)
+
+    def emit_new(self, rows, colnames):
+        new, self.watermark, self.seen = advance_watermark(self.watermark, self.seen, rows,
+                                                           colnames.index(LIVE_DATE_FIELD))
+        if new:
+            self.rows_ready.emit(new, colnames)
+        return len(new)
+
+    def listen(self):
+        """Отдельное соединение для LISTEN: уведомление триггера будит опрос раньше срока"""
+        import psycopg2.sql
+        conn = psycopg2.connect(**self.pool.conn_params, **KEEPALIVE_PARAMS, connect_timeout=CONNECT_TIMEOUT_SEC)
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(psycopg2.sql.SQL('LISTEN {}').format(psycopg2.sql.Identifier(self.channel)))
+        cur.close()
+        return conn
+
+    def wait_next(self, listen_conn, interval):
+        import select
+        deadline = time.monotonic() + interval
+        while not self.isInterruptionRequested():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            if listen_conn is None:
+                time.sleep(min(left, 0.5))
+                continue
+            if select.select([listen_conn], [], [], min(left, 0.5))[0]:
+                listen_conn.poll()
+                if listen_conn.notifies:
+                    listen_conn.notifies.clear()
+                    return
+
+class MultiLineWorker(QThread):
+    """Проверка продукта на всех линиях параллельно, итог по каждой линии по мере готовности"""
+    line_done = pyqtSignal(object)  # итог по линии: line, count, status, latency, error
+    def __init__(self, lines, gtin, date_from, date_to, date_field, gtin_match,
+                 max_workers=MULTI_LINE_WORKERS, timeout=MULTI_LINE_TIMEOUT_SEC):
+        super().__init__()
+        self.lines = dict(lines)
+        self.gtin = gtin
+        self.date_from = date_from
+        self.date_to = date_to
+        self.date_field = date_field
+        self.gtin_match = gtin_match
+        self.max_workers = max_workers
+        self.timeout = timeout
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor, wait as wait_futures, FIRST_COMPLETED
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = {
+            executor.submit(count_on_line, name, line, self.gtin, self.date_from, self.date_to,
+                            self.date_field, self.gtin_match, self.timeout): name
+            for name, line in self.lines.items()
+        }
+        # Линии ждут своей очереди в пуле потоков, поэтому общий срок — с запасом на очередь
+        rounds = -(-len(pending) // self.max_workers)
+        deadline = time.monotonic() + rounds * (self.timeout + CONNECT_TIMEOUT_SEC) + 1
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait_futures(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                self.line_done.emit(future.result())
+        # Не дождались — линия недоступна, остальные результаты уже отданы
+        for future, name in pending.items():
+            future.cancel()
+            self.line_done.emit({'line': name, 'count': None, 'status': 'timeout', 'latency': None,
+                                 'error': 'Превышено время ожидания'})
+        executor.shutdown(wait=False)
+
+class CopyExportWorker(CancellableWorker):
+    """Выгрузка результата проверки в CSV средствами COPY, минуя таблицу в интерфейсе"""
+    progress = pyqtSignal(int, int)  # выгружено строк, оценка числа строк
+    result_ready = pyqtSignal(object, object, object)  # rows, error, status
+    def __init__(self, pool, gtin, date_from, date_to, date_field, gtin_match, path, columns=None):
+        super().__init__()
+        self.pool = pool
+        self.gtin = gtin
+        self.date_from = date_from
+        self.date_to = date_to
+        self.date_field = date_field
+        self.gtin_match = gtin_match
+        self.path = path
+        self.columns = columns
+        self.timer.info.update(kind='export_copy', line=pool.name, gtin=gtin, date_from=date_from, date_to=date_to,
+                               date_field=date_field, gtin_match=gtin_match, columns=columns)
+    def run(self):
+        tmp_path = None
+        try:
+            with self.connection(self.pool) as conn:
+                cur = conn.cursor()
+                # Выгрузка долгая по природе и прерывается кнопкой "Отмена", таймаут линии к ней не применяем
+                cur.execute('SET LOCAL statement_timeout = 0')
+                sql, params = build_check_query(self.gtin, self.date_from, self.date_to, self.date_field, self.gtin_match,
+                                                columns=self.columns)
+                # Для полосы прогресса хватает оценки планировщика: COUNT(*) прочитал бы диапазон второй раз
+                with self.timer.phase('execute'):
+                    cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                estimate = int(cur.fetchone()[0][0]['Plan']['Plan Rows'])
+                # Имена столбцов без чтения строк
+                cur.execute(sql + ' LIMIT 0', params)
+                colnames = [desc[0] for desc in cur.description]
+                import psycopg2.extensions
+                quoted = [psycopg2.extensions.quote_ident(name, cur) for name in colnames if is_csv_quoted_column(name)]
+                options = "FORMAT csv, ENCODING 'UTF8'"
+                if quoted:
+                    options += f", FORCE_QUOTE ({', '.join(quoted)})"
+                copy_sql = f"COPY ({cur.mogrify(sql, params).decode()}) TO STDOUT WITH ({options})"
+                # Пишем во временный файл рядом и подменяем им целевой только после успешной выгрузки:
+                # при ошибке или отмене прежний файл пользователя остаётся нетронутым
+                fd, tmp_path = tempfile.mkstemp(prefix='.checkdb-', suffix='.csv',
+                                                dir=os.path.dirname(os.path.abspath(self.path)))
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(csv_header(colnames).encode('utf-8'))
+                    writer = CopyProgressWriter(f, lambda rows: self.progress.emit(rows, estimate))
+                    with self.timer.phase('export'):
+                        cur.copy_expert(copy_sql, writer)
+                    # Переводы строк внутри значений завышают счёт writer; точное число строк — от сервера
+                    rows = cur.rowcount
+                    self.timer.count(rows, writer.bytes)
+                os.replace(tmp_path, self.path)
+                tmp_path = None
+                cur.close()
+            self.progress.emit(rows, rows)
+            self.result_ready.emit(rows, None, 'ok')
         except Exception as e:
-            self.result_ready.emit(None, None, str(e), 'error')
+            # Недописанный временный файл не оставляем
+            if tmp_path is not None:
+                os.remove(tmp_path)
+            self.result_ready.emit(None, str(e), self.error_status())
+
+class MultiLineDialog(QDialog):
+    """Итоги проверки продукта по всем линиям"""
+    STATUS_TEXT = {
+        'ok': ('OK', '#43A047'),
+        'empty': ('НЕТ ЗАПИСЕЙ', '#E53935'),
+        'error': ('ОШИБКА', '#E53935'),
+        'timeout': ('НЕТ ОТВЕТА', '#FF8C42'),
+    }
+
+    def __init__(self, main_tab, line_names, product_name):
+        super().__init__(main_tab)
+        self.main_tab = main_tab
+        self.setWindowTitle(f'Проверка на всех линиях — {product_name}')
+        self.resize(900, 500)
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(len(line_names), 5)
+        self.table.setHorizontalHeaderLabels(['Линия', 'Статус', 'Найдено', 'Время, с', 'Ошибка'])
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.rows = {}
+        for i, name in enumerate(line_names):
+            self.rows[name] = i
+            self.table.setItem(i, 0, QTableWidgetItem(name))
+            self.table.setItem(i, 1, QTableWidgetItem('ожидание...'))
+        self.table.cellDoubleClicked.connect(self.open_line)
+        layout.addWidget(self.table)
+        hint = QLabel('Двойной щелчок по линии — показать найденные записи')
+        layout.addWidget(hint)
+        btn_close = QPushButton('Закрыть')
+        btn_close.clicked.connect(self.accept)
+        layout.addWidget(btn_close)
+
+    def on_line_done(self, summary):
+        i = self.rows[summary['line']]
+        text, color = self.STATUS_TEXT[summary['status']]
+        status_item = QTableWidgetItem(text)
+        status_item.setForeground(QColor(color))
+        self.table.setItem(i, 1, status_item)
+        count = summary['count']
+        self.table.setItem(i, 2, QTableWidgetItem('' if count is None else str(count)))
+        latency = summary['latency']
+        self.table.setItem(i, 3, QTableWidgetItem('' if latency is None else f'{latency:.2f}'))
+        self.table.setItem(i, 4, QTableWidgetItem(summary['error'] or ''))
+        self.table.resizeColumnsToContents()
+
+    def open_line(self, row, column):
+        self.main_tab.check_on_line(self.table.item(row, 0).text())
+        self.accept()
+
+class ProductPickDialog(QDialog):
+    """Выбор нескольких продуктов для проверки одним запросом"""
+    def __init__(self, parent, product_names, checked=()):
+        super().__init__(parent)
+        self.setWindowTitle('Выбор продуктов')
+        self.resize(500, 600)
+        layout = QVBoxLayout(self)
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText('Поиск...')
+        self.search_edit.textChanged.connect(self.filter_items)
+        layout.addWidget(self.search_edit)
+        self.list = QListWidget()
+        for name in product_names:
+            item = QListWidgetItem(name)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if name in checked else Qt.Unchecked)
+            self.list.addItem(item)
+        layout.addWidget(self.list)
+        btn_row = QHBoxLayout()
+        btn_ok = QPushButton('Проверить выбранные')
+        btn_ok.clicked.connect(self.accept)
+        btn_row.addWidget(btn_ok)
+        btn_cancel = QPushButton('Отмена')
+        btn_cancel.setProperty('red', True)
+        btn_cancel.clicked.connect(self.reject)
+        btn_row.addWidget(btn_cancel)
+        layout.addLayout(btn_row)
+
+    def filter_items(self, text):
+        text = text.lower()
+        for i in range(self.list.count()):
+            item = self.list.item(i)
+            item.setHidden(text not in item.text().lower())
+
+    def selected_names(self):
+        return [self.list.item(i).text() for i in range(self.list.count())
+                if self.list.item(i).checkState() == Qt.Checked]
+
+class BatchResultDialog(QDialog):
+    """Количество записей по каждому GTIN выбранных продуктов; у GTIN — все продукты с ним"""
+    def __init__(self, main_tab, groups, counts, line_name, gtin_names):
+        super().__init__(main_tab)
+        self.main_tab = main_tab
+        self.setWindowTitle(f'Проверка продуктов — {line_name}')
+        self.resize(800, 500)
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(len(groups), 3)
+        self.table.setHorizontalHeaderLabels(['Продукт', 'GTIN', 'Найдено'])
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        for i, (gtin, names) in enumerate(groups):
+            count = counts.get(gtin, 0)
+            name_item = QTableWidgetItem(', '.join(gtin_names.get(gtin, names)))
+            # Двойной щелчок открывает первый из выбранных продуктов
+            name_item.setData(Qt.UserRole, names[0])
+            self.table.setItem(i, 0, name_item)
+            self.table.setItem(i, 1, QTableWidgetItem(gtin))
+            count_item = QTableWidgetItem(str(count))
+            count_item.setForeground(QColor('#43A047' if count else '#E53935'))
+            self.table.setItem(i, 2, count_item)
+        self.table.resizeColumnsToContents()
+        self.table.cellDoubleClicked.connect(self.open_product)
+        layout.addWidget(self.table)
+        hint = QLabel('Двойной щелчок по продукту — показать найденные записи')
+        layout.addWidget(hint)
+        btn_close = QPushButton('Закрыть')
+        btn_close.clicked.connect(self.accept)
+        layout.addWidget(btn_close)
+
+    def open_product(self, row, column):
+        self.main_tab.check_product(self.table.item(row, 0).data(Qt.UserRole))
+        self.accept()
+
+class ColumnsDialog(QDialog):
+    """Выбор столбцов, которые проверка забирает с сервера"""
+    def __init__(self, parent, columns, selected, required, line_name):
+        super().__init__(parent)
+        self.setWindowTitle(f'Столбцы — {line_name}')
+        self.resize(450, 600)
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel('Неотмеченные столбцы не загружаются с сервера.\n'
+                                'Полную строку можно открыть двойным щелчком по ней.'))
+        self.list = QListWidget()
+        for name, type_name in columns:
+            item = QListWidgetItem(f'{name}  ({type_name})')
+            item.setData(Qt.UserRole, name)
+            if name in required:
+                # Обязательные столбцы всегда загружаются
+                item.setFlags(item.flags() & ~Qt.ItemIsEnabled)
+                item.setCheckState(Qt.Checked)
+            else:
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(Qt.Checked if not selected or name in selected else Qt.Unchecked)
+            self.list.addItem(item)
+        layout.addWidget(self.list)
+        btn_row = QHBoxLayout()
+        btn_all = QPushButton('Все')
+        btn_all.setProperty('orange', True)
+        btn_all.clicked.connect(self.check_all)
+        btn_row.addWidget(btn_all)
+        btn_ok = QPushButton('Сохранить')
+        btn_ok.clicked.connect(self.accept)
+        btn_row.addWidget(btn_ok)
+        btn_cancel = QPushButton('Отмена')
+        btn_cancel.setProperty('red', True)
+        btn_cancel.clicked.connect(self.reject)
+        btn_row.addWidget(btn_cancel)
+        layout.addLayout(btn_row)
+
+    def check_all(self):
+        for i in range(self.list.count()):
+            self.list.item(i).setCheckState(Qt.Checked)
+
+    def selected_columns(self):
+        """Отмеченные столбцы или None, если отмечены все"""
+        items = [self.list.item(i) for i in range(self.list.count())]
+        selected = [item.data(Qt.UserRole) for item in items if item.checkState() == Qt.Checked]
+        return None if len(selected) == len(items) else selected
+
+class RowDialog(QDialog):
+    """Все поля одной строки результата"""
+    def __init__(self, parent, row, colnames):
+        super().__init__(parent)
+        self.setWindowTitle('Запись')
+        self.resize(700, 500)
+        layout = QVBoxLayout(self)
+        table = QTableWidget(len(colnames), 2)
+        table.setHorizontalHeaderLabels(['Поле', 'Значение'])
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.horizontalHeader().setStretchLastSection(True)
+        for i, (name, value) in enumerate(zip(colnames, row)):
+            table.setItem(i, 0, QTableWidgetItem(name))
+            table.setItem(i, 1, QTableWidgetItem('' if value is None else str(value)))
+        table.resizeColumnToContents(0)
+        layout.addWidget(table)
+        btn_close = QPushButton('Закрыть')
+        btn_close.clicked.connect(self.accept)
+        layout.addWidget(btn_close)
+
+class PlanDialog(QDialog):
+    """План запроса проверки; по кнопке — EXPLAIN ANALYZE с фактическими строками и временем"""
+    def __init__(self, parent, pool, sql, params):
+        super().__init__(parent)
+        self.pool = pool
+        self.sql = sql
+        self.params = params
+        self.worker = None
+        self.setWindowTitle(f'План запроса — {pool.name}')
+        self.resize(900, 500)
+        layout = QVBoxLayout(self)
+        self.summary_label = QLabel()
+        self.summary_label.setWordWrap(True)
+        layout.addWidget(self.summary_label)
+        self.tree = QtWidgets.QTreeWidget()
+        self.tree.setHeaderLabels(['Узел', 'Оценка строк', 'Факт. строк', 'Время, мс', 'Стоимость'])
+        layout.addWidget(self.tree, 1)
+        btn_row = QHBoxLayout()
+        self.analyze_btn = QPushButton('EXPLAIN ANALYZE (выполнит запрос)')
+        self.analyze_btn.setProperty('orange', True)
+        self.analyze_btn.clicked.connect(lambda: self.load(analyze=True))
+        btn_row.addWidget(self.analyze_btn)
+        btn_close = QPushButton('Закрыть')
+        btn_close.clicked.connect(self.accept)
+        btn_row.addWidget(btn_close)
+        layout.addLayout(btn_row)
+        self.load()
+
+    def load(self, analyze=False):
+        self.stop()
+        self.summary_label.setText('Выполняется EXPLAIN ANALYZE...' if analyze else 'Загрузка плана...')
+        self.analyze_btn.setEnabled(False)
+        self.worker = ExplainWorker(self.pool, self.sql, self.params, analyze)
+        self.worker.result_ready.connect(self.on_result)
+        self.worker.start()
+
+    def stop(self):
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.result_ready.disconnect()
+            self.worker.cancel()
+
+    def on_result(self, explain, error, status):
+        self.analyze_btn.setEnabled(True)
+        if status != 'ok':
+            self.summary_label.setText(f'<span style="color:#E53935">{error}</span>')
+            return
+        plan = explain['Plan']
+        summary = plan_summary(plan, self.worker.relation_rows)
+        rows_read = '?' if summary['rows_read'] is None else f"≈{summary['rows_read']}"
+        if plan_uses_index(plan):
+            verdict = 'Индекс используется.'
+        else:
+            verdict = 'Индекс НЕ используется — будет прочитана вся таблица.'
+        text = (f"{verdict} Чтение: {', '.join(summary['scans'])}.<br>"
+                f"Оценка строк в результате: {summary['rows']}, строк к чтению: {rows_read}, "
+                f"стоимость: {summary['cost']}")
+        if 'Execution Time' in explain:
+            text += (f"<br>Планирование: {explain['Planning Time']:.1f} мс, "
+                     f"выполнение: {explain['Execution Time']:.1f} мс")
+        self.summary_label.setText(text)
+        self.tree.clear()
+        self.add_node(self.tree.invisibleRootItem(), plan)
+        self.tree.expandAll()
+        for column in range(self.tree.columnCount()):
+            self.tree.resizeColumnToContents(column)
+
+    def add_node(self, parent_item, node):
+        title = node['Node Type']
+        if node.get('Index Name'):
+            title += f" ({node['Index Name']})"
+        actual_rows = node.get('Actual Rows')
+        loops = node.get('Actual Loops', 1)
+        actual_time = node.get('Actual Total Time')
+        item = QtWidgets.QTreeWidgetItem([
+            title,
+            str(node['Plan Rows']),
+            '' if actual_rows is None else str(actual_rows * loops),
+            '' if actual_time is None else f'{actual_time * loops:.1f}',
+            str(node['Total Cost']),
+        ])
+        # Условия узла — во всплывающей подсказке, чтобы не растягивать столбец
+        conditions = [node[key] for key in ('Index Cond', 'Recheck Cond', 'Filter') if node.get(key)]
+        if conditions:
+            item.setToolTip(0, '\n'.join(conditions))
+        parent_item.addChild(item)
+        for child in node.get('Plans', []):
+            self.add_node(item, child)
+
+    def done(self, result):
+        self.stop()
+        super().done(result)
+
+class HistogramWidget(QWidget):
+    """Столбчатая диаграмма: число строк по интервалам времени"""
+    MARGIN_LEFT = 60
+    MARGIN_RIGHT = 15
+    MARGIN_TOP = 15
+    MARGIN_BOTTOM = 45
+    BAR_COLOR = QColor('#1E88E5')
+    HOVER_COLOR = QColor('#FF8C42')
 
-class LoadingDialog(QDialog):
     def __init__(self, parent=None):
+        super().__init__(parent)
+        self.buckets = []
+        self.label_format = '%d.%m %H:00'
+        self.hover = -1
+        self.setMouseTracking(True)
+        self.setMinimumHeight(300)
+
+    def set_buckets(self, buckets, label_format):
+        self.buckets = buckets
+        self.label_format = label_format
+        self.hover = -1
+        self.update()
+
+    def plot_rect(self):
+        return QtCore.QRectF(self.MARGIN_LEFT, self.MARGIN_TOP,
+                             max(1, self.width() - self.MARGIN_LEFT - self.MARGIN_RIGHT),
+                             max(1, self.height() - self.MARGIN_TOP - self.MARGIN_BOTTOM))
+
+    def bar_at(self, x):
+        rect = self.plot_rect()
+        if not self.buckets or not rect.left() <= x < rect.right():
+            return -1
+        return int((x - rect.left()) / rect.width() * len(self.buckets))
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('white'))
+        rect = self.plot_rect()
+        painter.setPen(QColor('#9E9E9E'))
+        painter.drawLine(rect.bottomLeft(), rect.bottomRight())
+        painter.drawLine(rect.bottomLeft(), rect.topLeft())
+        if not self.buckets:
+            painter.drawText(rect, Qt.AlignCenter, 'Нет данных')
+            return
+        top = max(count for _, count in self.buckets) or 1
+        bar_width = rect.width() / len(self.buckets)
+        # Шкала количества: 0, половина и максимум
+        for value in (0, top // 2, top):
+            y = rect.bottom() - value / top * rect.height()
+            painter.drawText(QtCore.QRectF(0, y - 10, self.MARGIN_LEFT - 6, 20), Qt.AlignRight | Qt.AlignVCenter,
+                             str(value))
+        for i, (moment, count) in enumerate(self.buckets):
+            height = count / top * rect.height()
+            bar = QtCore.QRectF(rect.left() + i * bar_width, rect.bottom() - height,
+                                bar_width - 1 if bar_width >= 3 else bar_width, height)
+            painter.fillRect(bar, self.HOVER_COLOR if i == self.hover else self.BAR_COLOR)
+        # Подписи времени — не чаще, чем помещаются
+        painter.setPen(QColor('#424242'))
+        label_width = painter.fontMetrics().horizontalAdvance(
+            self.buckets[0][0].strftime(self.label_format)) + 10
+        every = max(1, int(label_width // bar_width) + 1)
+        for i in range(0, len(self.buckets), every):
+            x = rect.left() + i * bar_width
+            if x + label_width > self.width():
+                break
+            painter.drawText(QtCore.QRectF(x, rect.bottom() + 4, label_width, 20), Qt.AlignLeft,
+                             self.buckets[i][0].strftime(self.label_format))
+
+    def mouseMoveEvent(self, event):
+        i = self.bar_at(event.pos().x())
+        if i != self.hover:
+            self.hover = i
+            self.update()
+        if i >= 0:
+            moment, count = self.buckets[i]
+            QtWidgets.QToolTip.showText(event.globalPos(), f'{moment.strftime(self.label_format)}: {count}', self)
+        else:
+            QtWidgets.QToolTip.hideText()
+
+    def leaveEvent(self, event):
+        self.hover = -1
+        self.update()
+
+class HistogramDialog(QDialog):
+    """Выработка по интервалам времени для продукта на линии"""
+    def __init__(self, parent, pool, gtin, date_from, date_to, date_field, gtin_match, title):
+        super().__init__(parent)
+        self.pool = pool
+        self.args = (gtin, date_from, date_to, date_field, gtin_match)
+        self.worker = None
+        self.setWindowTitle(f'Гистограмма — {title}')
+        self.resize(1000, 500)
+        layout = QVBoxLayout(self)
+        top_row = QHBoxLayout()
+        top_row.addWidget(QLabel('Интервал:'))
+        self.bucket_combo = QComboBox()
+        for bucket, text, step, label_format in HISTOGRAM_BUCKETS:
+            self.bucket_combo.addItem(text, bucket)
+        self.bucket_combo.setCurrentIndex(1)
+        self.bucket_combo.currentIndexChanged.connect(self.load)
+        top_row.addWidget(self.bucket_combo)
+        self.summary_label = QLabel()
+        top_row.addWidget(self.summary_label, 1)
+        layout.addLayout(top_row)
+        self.chart = HistogramWidget()
+        layout.addWidget(self.chart, 1)
+        btn_close = QPushButton('Закрыть')
+        btn_close.clicked.connect(self.accept)
+        layout.addWidget(btn_close)
+        self.load()
+
+    def load(self):
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.result_ready.disconnect()
+            self.worker.cancel()
+        self.summary_label.setText('Загрузка...')
+        self.worker = HistogramWorker(self.pool, *self.args, bucket=self.bucket_combo.currentData())
+        self.worker.result_ready.connect(self.on_result)
+        self.worker.start()
+
+    def on_result(self, buckets, error, status):
+        if status == 'cancelled':
+            return
+        if status == 'error':
+            self.summary_label.setText('')
+            QMessageBox.critical(self, 'Ошибка подключения', error)
+            return
+        bucket, text, step, label_format = HISTOGRAM_BUCKETS[self.bucket_combo.currentIndex()]
+        buckets = fill_histogram_gaps(buckets, step)
+        total = sum(count for _, count in buckets)
+        if buckets:
+            peak = max(buckets, key=lambda item: item[1])
+            self.summary_label.setText(f'Всего: {total}, интервалов: {len(buckets)}, '
+                                       f'максимум: {peak[1]} ({peak[0].strftime(label_format)}), '
+                                       f'в среднем: {total / len(buckets):.1f}')
+        else:
+            self.summary_label.setText('Всего: 0')
+        self.chart.set_buckets(buckets, label_format)
+
+    def done(self, result):
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.result_ready.disconnect()
+            self.worker.cancel()
+        super().done(result)
+
+class LoadingDialog(QDialog):
+    def __init__(self, parent=None, on_cancel=None):
         super().__init__(parent)
         self.setModal(True)
         self.setWindowTitle('Загрузка...')
@@ -328,6 +1304,7 @@ class LoadingDialog(QDialog):
           </circle>
         </svg>
         '''
+        from PyQt5.QtSvg import QSvgWidget
         svg_widget = QSvgWidget()
         svg_widget.load(bytearray(svg_data, encoding='utf-8'))
         svg_widget.setFixedSize(64, 64)
@@ -335,6 +1312,14 @@ class LoadingDialog(QDialog):
         label = QLabel('Пожалуйста, подождите...')
         label.setAlignment(QtCore.Qt.AlignCenter)
         layout.addWidget(label)
+        # Кнопка отмены прерывает запрос на сервере
+        if on_cancel is not None:
+            self.setFixedSize(340, 230)
+            self.cancel_btn = QPushButton('Отмена')
+            self.cancel_btn.setProperty('red', True)
+            self.cancel_btn.clicked.connect(on_cancel)
+            self.cancel_btn.clicked.connect(lambda: self.cancel_btn.setEnabled(False))
+            layout.addWidget(self.cancel_btn)
         self.setLayout(layout)
         self.setWindowFlags((self.windowFlags() | QtCore.Qt.CustomizeWindowHint) & ~QtCore.Qt.WindowCloseButtonHint & ~QtCore.Qt.WindowContextHelpButtonHint)
 
@@ -354,6 +1339,163 @@ class CompleterHoverDelegate(QtWidgets.QStyledItemDelegate):
         else:
             super().paint(painter, option, index)
 
+# Ширина столбцов считается по выборке строк, а не по всему результату
+COLUMN_WIDTH_SAMPLE = 200
+COLUMN_MAX_WIDTH = 600
+
+def sort_key(value):
+    # None — в конце списка при сортировке по возрастанию
+    return (value is None, value if value is not None else 0)
+
+class ResultTableModel(QtCore.QAbstractTableModel):
+    """Модель результата проверки поверх списка строк из БД.
+
+    Строки хранятся как пришли от psycopg2, текст ячейки формируется
+    только для видимых ячеек в data(). Сортировка и фильтр хранятся в самой
+    модели, поэтому общие для всех представлений (основная таблица и
+    развёрнутое окно).
+    """
+    filter_changed = pyqtSignal(str)
+    sort_changed = pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.visible = self.rows  # строки после фильтра и сортировки
+        self.colnames = []
+        self.filter_text = ''
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+
+    def set_result(self, rows, colnames):
+        self.beginResetModel()
+        self.rows = list(rows)
+        self.visible = self.rows
+        self.colnames = list(colnames)
+        self.filter_text = ''
+        self.sort_column = -1
+        self.endResetModel()
+        self.filter_changed.emit('')
+        self.sort_changed.emit(-1, self.sort_order)
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        if self.sort_column >= 0:
+            self.rows.extend(rows)
+            self.apply_view()
+            return
+        if self.visible is not self.rows:
+            self.rows.extend(rows)
+            rows = [row for row in rows if self.row_matches(row)]
+            if not rows:
+                return
+        start = len(self.visible)
+        self.beginInsertRows(QtCore.QModelIndex(), start, start + len(rows) - 1)
+        self.visible.extend(rows)
+        self.endInsertRows()
+
+    def clear(self):
+        self.set_result([], [])
+
+    def row_matches(self, row):
+        needle = self.filter_text.casefold()
+        return any(needle in str(value).casefold() for value in row if value is not None)
+
+    def apply_view(self):
+        """Пересчитывает видимые строки по текущим фильтру и сортировке"""
+        self.beginResetModel()
+        rows = self.rows
+        if self.filter_text:
+            rows = [row for row in rows if self.row_matches(row)]
+        if self.sort_column >= 0:
+            column = self.sort_column
+            reverse = self.sort_order == Qt.DescendingOrder
+            try:
+                rows = sorted(rows, key=lambda row: sort_key(row[column]), reverse=reverse)
+            except TypeError:
+                # Разнотипные значения в столбце сравниваем как строки
+                rows = sorted(rows, key=lambda row: sort_key(None if row[column] is None else str(row[column])),
+                              reverse=reverse)
+        self.visible = rows
+        self.endResetModel()
+
+    def set_filter(self, text):
+        if text == self.filter_text:
+            return
+        self.filter_text = text
+        self.apply_view()
+        self.filter_changed.emit(text)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if column == self.sort_column and order == self.sort_order:
+            return
+        self.sort_column = column
+        self.sort_order = order
+        self.apply_view()
+        self.sort_changed.emit(column, order)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.visible)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.colnames)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self.visible[index.row()][index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.colnames[section] if section < len(self.colnames) else None
+        return section + 1
+
+class ResultTableView(QtWidgets.QTableView):
+    """Представление результата; индикатор сортировки следует за моделью"""
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        # Без этого включение сортировки сразу отсортирует по первому столбцу
+        self.horizontalHeader().setSortIndicator(model.sort_column, model.sort_order)
+        self.setSortingEnabled(True)
+        model.sort_changed.connect(self.on_sort_changed)
+
+    def on_sort_changed(self, column, order):
+        self.horizontalHeader().setSortIndicator(column, order)
+
+class ResultFilterEdit(QLineEdit):
+    """Строка фильтра результата; текст общий для всех представлений модели"""
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.setPlaceholderText('Фильтр по всем столбцам...')
+        self.setText(model.filter_text)
+        # Фильтр применяется после паузы в наборе текста
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.timeout.connect(lambda: self.model.set_filter(self.text()))
+        self.textEdited.connect(lambda text: self._filter_timer.start(300))
+        model.filter_changed.connect(self.on_filter_changed)
+
+    def on_filter_changed(self, text):
+        if text != self.text():
+            self.setText(text)
+
+def fit_columns_to_sample(view, sample=COLUMN_WIDTH_SAMPLE):
+    """Ширина столбцов по заголовку и первым sample строкам модели"""
+    model = view.model()
+    metrics = view.fontMetrics()
+    header_metrics = view.horizontalHeader().fontMetrics()
+    rows = min(model.rowCount(), sample)
+    for col in range(model.columnCount()):
+        width = header_metrics.horizontalAdvance(str(model.headerData(col, Qt.Horizontal)))
+        for row in range(rows):
+            width = max(width, metrics.horizontalAdvance(model.data(model.index(row, col))))
+        view.setColumnWidth(col, min(width + 24, COLUMN_MAX_WIDTH))
+
 class MainTab(QWidget):
     def __init__(self, parent):
         super().__init__()
@@ -365,7 +1507,7 @@ class MainTab(QWidget):
         # Поиск по продуктам
         search_layout = QHBoxLayout()
         # Используем новый ProductSearchLineEdit с пустым списком продуктов (будет обновлен позже)
-        self.product_search = ProductSearchLineEdit([], self)
+        self.product_search = ProductSearchLineEdit({}, self)
         self.product_search.setPlaceholderText('Поиск продукта...')
         self.product_search.setFixedHeight(52)
         self.product_search.setFixedWidth(400)
@@ -393,7 +1535,18 @@ class MainTab(QWidget):
         self.line_combo.currentTextChanged.connect(self.on_line_select)
         line_layout.addWidget(QLabel('Линия:'))
         line_layout.addWidget(self.line_combo)
+        self.schema_btn = QPushButton('⟳')
+        self.schema_btn.setToolTip('Перечитать структуру таблицы codes на линии')
+        self.schema_btn.setFixedWidth(40)
+        self.schema_btn.clicked.connect(lambda: self.load_schema(self.line_combo.currentText(), force=True))
+        line_layout.addWidget(self.schema_btn)
         layout.addLayout(line_layout)
+        # Что известно о таблице codes выбранной линии
+        self.schema_label = QLabel()
+        self.schema_label.setWordWrap(True)
+        self.schema_label.setVisible(False)
+        layout.addWidget(self.schema_label)
+        self.schema_workers = {}
         # Продукты (с аннотацией GTIN)
         prod_layout = QHBoxLayout()
         self.product_combo = QComboBox()
@@ -411,6 +1564,46 @@ class MainTab(QWidget):
         self.date_field_combo.addItem('Дата производства (production_date)')
         date_field_layout.addWidget(self.date_field_combo)
         layout.addLayout(date_field_layout)
+        # Способ поиска GTIN в коде
+        gtin_match_layout = QHBoxLayout()
+        gtin_match_layout.addWidget(QLabel('Поиск GTIN:'))
+        self.gtin_match_combo = QComboBox()
+        for mode, title in GTIN_MATCH_MODES:
+            self.gtin_match_combo.addItem(title, mode)
+        gtin_match_layout.addWidget(self.gtin_match_combo)
+        layout.addLayout(gtin_match_layout)
+        # Режим проверки
+        mode_layout = QHBoxLayout()
+        mode_layout.addWidget(QLabel('Режим:'))
+        self.mode_combo = QComboBox()
+        for mode, title in CHECK_MODES:
+            self.mode_combo.addItem(title, mode)
+        mode_layout.addWidget(self.mode_combo)
+        mode_layout.addWidget(QLabel('Строк:'))
+        self.preview_spin = QtWidgets.QSpinBox()
+        self.preview_spin.setRange(1, 10000)
+        self.preview_spin.setValue(PREVIEW_LIMIT)
+        mode_layout.addWidget(self.preview_spin)
+        layout.addLayout(mode_layout)
+        # Потоковая загрузка больших результатов
+        stream_layout = QHBoxLayout()
+        self.stream_check = QtWidgets.QCheckBox('Потоковая загрузка (строки появляются по мере получения)')
+        stream_layout.addWidget(self.stream_check)
+        stream_layout.addWidget(QLabel('Пакет:'))
+        self.itersize_spin = QtWidgets.QSpinBox()
+        self.itersize_spin.setRange(0, STREAM_BATCH_MAX)
+        self.itersize_spin.setSingleStep(STREAM_BATCH_MIN)
+        self.itersize_spin.setSpecialValueText('авто')
+        stream_layout.addWidget(self.itersize_spin)
+        layout.addLayout(stream_layout)
+        # Повторная проверка догружает с сервера только то, чего нет в кэше
+        self.cache_check = QtWidgets.QCheckBox('Кэшировать результаты (повторная проверка догружает только новые строки)')
+        self.cache_check.setChecked(True)
+        layout.addWidget(self.cache_check)
+        # Оценка запроса перед запуском: тяжёлую проверку нужно подтвердить
+        self.preflight_check = QtWidgets.QCheckBox('Оценивать запрос перед проверкой (EXPLAIN)')
+        self.preflight_check.setChecked(True)
+        layout.addWidget(self.preflight_check)
         # Дата с/по
         date_row = QHBoxLayout()
         date_row.addWidget(QLabel('Дата с:'))
@@ -426,25 +1619,91 @@ class MainTab(QWidget):
         date_row.addWidget(self.date_to)
         layout.addLayout(date_row)
         # Кнопка проверки
+        check_row = QHBoxLayout()
         self.check_btn = QPushButton('Проверить')
         self.check_btn.clicked.connect(self.check_codes)
-        layout.addWidget(self.check_btn)
+        check_row.addWidget(self.check_btn, 3)
+        # Проверка плана запроса: используется ли индекс
+        self.plan_btn = QPushButton('План запроса')
+        self.plan_btn.setProperty('orange', True)
+        self.plan_btn.clicked.connect(self.show_query_plan)
+        check_row.addWidget(self.plan_btn, 1)
+        # Выгрузка в CSV прямо из БД, без загрузки строк в таблицу
+        self.copy_export_btn = QPushButton('CSV из БД')
+        self.copy_export_btn.setProperty('orange', True)
+        self.copy_export_btn.clicked.connect(self.export_from_db)
+        check_row.addWidget(self.copy_export_btn, 1)
+        # Тот же продукт на всех линиях сразу
+        self.all_lines_btn = QPushButton('Все линии')
+        self.all_lines_btn.setProperty('orange', True)
+        self.all_lines_btn.clicked.connect(self.check_all_lines)
+        check_row.addWidget(self.all_lines_btn, 1)
+        layout.addLayout(check_row)
+        tools_row = QHBoxLayout()
+        # Несколько продуктов одним запросом
+        self.batch_btn = QPushButton('Несколько продуктов')
+        self.batch_btn.setProperty('orange', True)
+        self.batch_btn.clicked.connect(self.check_products)
+        tools_row.addWidget(self.batch_btn, 1)
+        # Какие столбцы забирать с сервера (хранится в линии)
+        self.columns_btn = QPushButton('Столбцы')
+        self.columns_btn.setProperty('orange', True)
+        self.columns_btn.clicked.connect(self.choose_columns)
+        tools_row.addWidget(self.columns_btn, 1)
+        # Повторяющиеся коды за период
+        self.duplicates_btn = QPushButton('Дубликаты')
+        self.duplicates_btn.setProperty('orange', True)
+        self.duplicates_btn.clicked.connect(self.find_duplicate_codes)
+        tools_row.addWidget(self.duplicates_btn, 1)
+        # Выработка по часам / дням без загрузки строк
+        self.histogram_btn = QPushButton('Гистограмма')
+        self.histogram_btn.setProperty('orange', True)
+        self.histogram_btn.clicked.connect(self.show_histogram)
+        tools_row.addWidget(self.histogram_btn, 1)
+        # Мониторинг: новые строки догружаются по мере работы линии
+        self.live_btn = QPushButton('Мониторинг')
+        self.live_btn.setProperty('orange', True)
+        self.live_btn.setCheckable(True)
+        self.live_btn.toggled.connect(self.on_live_toggled)
+        tools_row.addWidget(self.live_btn, 1)
+        layout.addLayout(tools_row)
         # Таблица для результатов
-        self.result_table = QTableWidget()
-        self.result_table.setColumnCount(0)
-        self.result_table.setRowCount(0)
-        self.result_table.setVisible(False)
-        self.result_table.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
-        self.table_scroll = QScrollArea()
-        self.table_scroll.setWidgetResizable(True)
-        self.table_scroll.setWidget(self.result_table)
-        self.table_scroll.setVisible(False)
-        layout.addWidget(self.table_scroll)
+        self.result_model = ResultTableModel(self)
+        self.result_table = ResultTableView(self.result_model)
+        self.result_table.setMinimumHeight(300)
+        self.result_table.doubleClicked.connect(self.open_row)
+        # Фильтр над таблицей
+        self.filter_edit = ResultFilterEdit(self.result_model)
+        self.filter_count_label = QLabel()
+        self.result_model.modelReset.connect(self.update_filter_count)
+        self.result_model.rowsInserted.connect(self.update_filter_count)
+        filter_row = QHBoxLayout()
+        filter_row.addWidget(self.filter_edit)
+        filter_row.addWidget(self.filter_count_label)
+        self.table_panel = QWidget()
+        table_layout = QVBoxLayout(self.table_panel)
+        table_layout.setContentsMargins(0, 0, 0, 0)
+        table_layout.addLayout(filter_row)
+        table_layout.addWidget(self.result_table)
+        self.table_panel.setVisible(False)
+        layout.addWidget(self.table_panel)
         # Кнопка "Развернуть таблицу"
         self.expand_btn = QPushButton('Развернуть таблицу')
         self.expand_btn.setVisible(False)
         self.expand_btn.clicked.connect(self.show_big_table)
         layout.addWidget(self.expand_btn)
+        # Остановка потоковой загрузки после появления первых строк
+        self.stop_btn = QPushButton('Остановить загрузку')
+        self.stop_btn.setProperty('red', True)
+        self.stop_btn.setVisible(False)
+        self.stop_btn.clicked.connect(self.cancel_check)
+        layout.addWidget(self.stop_btn)
+        # Загрузка всех строк после проверки в режиме "количество"
+        self.load_all_btn = QPushButton('Загрузить все строки')
+        self.load_all_btn.setProperty('orange', True)
+        self.load_all_btn.setVisible(False)
+        self.load_all_btn.clicked.connect(self.load_all_rows)
+        layout.addWidget(self.load_all_btn)
         # Кнопка выгрузки в CSV
         self.export_btn = QPushButton('Выгрузить в CSV')
         self.export_btn.setVisible(False)
@@ -465,6 +1724,16 @@ class MainTab(QWidget):
         self.count_label.setFont(font_count)
         self.count_label.setAlignment(QtCore.Qt.AlignCenter)
         layout.addWidget(self.count_label)
+        # Другие продукты с тем же GTIN — результат относится и к ним
+        self.aliases_label = QLabel()
+        self.aliases_label.setVisible(False)
+        self.aliases_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.aliases_label.setWordWrap(True)
+        self.aliases_label.setStyleSheet('color: #9E9E9E; font-size: 14px;')
+        layout.addWidget(self.aliases_label)
+        self.shown_gtin = None  # GTIN показанного результата
+        self.shown_check = None  # check_key полного результата на экране, None — на экране не он
+        self.shown_match = None  # и способ поиска GTIN, которым он получен
         # Крупный статус результата
         self.status_label = QLabel()
         self.status_label.setVisible(False)
@@ -474,21 +1743,65 @@ class MainTab(QWidget):
         font.setBold(True)
         self.status_label.setFont(font)
         layout.addWidget(self.status_label)
+        # Сворачиваемая панель с замерами последней проверки
+        self.perf_btn = QPushButton('Производительность ▾')
+        self.perf_btn.setCheckable(True)
+        self.perf_btn.setVisible(False)
+        self.perf_btn.toggled.connect(self.toggle_perf_panel)
+        layout.addWidget(self.perf_btn)
+        self.perf_label = QLabel()
+        self.perf_label.setVisible(False)
+        layout.addWidget(self.perf_label)
         self.setLayout(layout)
 
+    def stop_stream(self):
+        """Прерывает потоковую загрузку, если она ещё идёт"""
+        worker = getattr(self, 'worker', None)
+        if worker is not None and worker.stream and worker.isRunning():
+            worker.batch_ready.disconnect()
+            worker.stream_finished.disconnect()
+            worker.cancel()
+        self.stop_btn.setVisible(False)
+
+    def cancel_check(self):
+        self.worker.cancel()
+
     def clear_results(self):
-        self.result_table.setVisible(False)
-        self.table_scroll.setVisible(False)
+        self.stop_stream()
+        self.stop_live()
+        self.shown_check = None
+        self.table_panel.setVisible(False)
+        self.load_all_btn.setVisible(False)
         self.export_btn.setVisible(False)
         self.clear_btn.setVisible(False)
         self.expand_btn.setVisible(False)
         self.count_label.setVisible(False)
         self.status_label.setVisible(False)
+        self.hide_aliases()
 
     def on_product_changed(self, name):
+        # Продукт с тем же GTIN — результат на экране относится и к нему, проверять заново незачем
+        gtin = self.parent.products.get(name)
+        if gtin is not None and self.shown_gtin == gtin_key(gtin, self.shown_match):
+            return
         # Автоматическая очистка результатов при смене продукта
         self.clear_results()
 
+    def show_aliases(self):
+        """Подпись со всеми продуктами, у которых тот же GTIN, что у проверенного"""
+        gtin = self.parent.products.get(self.product_combo.currentText())
+        self.shown_match = self.gtin_match_combo.currentData()
+        self.shown_gtin = gtin_key(gtin, self.shown_match) if gtin is not None else None
+        names = [] if gtin is None else self.parent.gtin_names.get(normalize_gtin(gtin), [])
+        # В режиме contains продукты с разной записью GTIN находят разные строки
+        names = [name for name in names if gtin_key(self.parent.products[name], self.shown_match) == self.shown_gtin]
+        self.aliases_label.setText(f"GTIN {self.shown_gtin}: {', '.join(names)}")
+        self.aliases_label.setVisible(len(names) > 1)
+
+    def hide_aliases(self):
+        self.shown_gtin = None
+        self.aliases_label.setVisible(False)
+
     def on_line_select(self, name):
         if name in self.parent.lines:
             self.parent.current_line = name
@@ -496,129 +1809,678 @@ class MainTab(QWidget):
             self.parent.current_line = None
         # Автоматическая очистка результатов при смене линии
         self.clear_results()
+        self.load_schema(name)
 
-    def check_codes(self):
+    def load_schema(self, line_name, force=False):
+        """Структура таблицы линии читается в фоне один раз, дальше берётся из кэша"""
+        if line_name not in self.parent.lines:
+            self.schema_label.setVisible(False)
+            return
+        if force:
+            invalidate_schema(line_name)
+        schema = get_schema(line_name)
+        if schema is not None:
+            self.show_schema(schema)
+            return
+        worker = self.schema_workers.get(line_name)
+        if worker is not None and worker.isRunning():
+            return
+        self.schema_label.setText('Чтение структуры таблицы codes...')
+        self.schema_label.setVisible(True)
+        worker = SchemaWorker(line_name, self.parent.lines[line_name])
+        worker.result_ready.connect(self.on_schema_ready)
+        self.schema_workers[line_name] = worker
+        worker.start()
+
+    def on_schema_ready(self, line_name, schema, error, status):
+        if line_name != self.line_combo.currentText():
+            return
+        if status == 'error':
+            self.schema_label.setText(f'<span style="color:#E53935">Структура таблицы не прочитана: {error}</span>')
+            return
+        self.show_schema(schema)
+
+    def show_schema(self, schema):
+        if not schema.exists:
+            self.schema_label.setText('<span style="color:#E53935">На линии нет таблицы codes</span>')
+        else:
+            rows = '?' if schema.reltuples is None else f'{schema.reltuples:,}'.replace(',', ' ')
+            match_titles = dict(GTIN_MATCH_MODES)
+            self.schema_label.setText(
+                f"Таблица codes: ≈{rows} строк, индексов: {len(schema.indexes)}. "
+                f"Авто-поиск GTIN: {match_titles[schema.best_gtin_match()]}")
+        self.schema_label.setVisible(True)
+
+    def get_check_args(self):
+        """Параметры проверки из формы или None, если форма заполнена неверно"""
         line_name = self.line_combo.currentText()
         if line_name not in self.parent.lines:
             QMessageBox.critical(self, 'Ошибка', 'Выберите линию!')
-            return
+            return None
         product_name = self.product_combo.currentText()
         if product_name not in self.parent.products:
             QMessageBox.critical(self, 'Ошибка', 'Выберите продукт!')
-            return
+            return None
         line = self.parent.lines[line_name]
         gtin = self.parent.products[product_name]
+        args = self.get_filter_args()
+        # Заведомо невыполнимую проверку не отправляем на сервер
+        schema = get_schema(line_name)
+        error = schema.validate(args[2], line.get('columns')) if schema is not None else None
+        if error:
+            QMessageBox.critical(self, 'Ошибка', error)
+            return None
+        return (get_pool(line_name, line), gtin) + args
+
+    def get_filter_args(self, resolve_auto=True):
+        """Диапазон дат, поле даты и способ поиска GTIN из формы.
+
+        resolve_auto=False оставляет режим "авто" как есть — для проверки на нескольких линиях,
+        где способ поиска выбирается по индексам каждой линии, а не выбранной в форме.
+        """
         date_from = self.date_from.date().toString('yyyy-MM-dd')
         date_to = self.date_to.date().toString('yyyy-MM-dd') if self.date_to.date() else None
         # Выбор поля даты
         date_field = 'dtime_ins'
         if self.date_field_combo.currentIndex() == 1:
             date_field = 'production_date'
-        conn_params = {
-            'host': line['ip'],
-            'port': line['port'],
-            'user': line['user'],
-            'password': line['password'],
-            'dbname': line['dbname']
-        }
+        gtin_match = self.gtin_match_combo.currentData()
+        if resolve_auto:
+            gtin_match = resolve_gtin_match(gtin_match, get_schema(self.line_combo.currentText()))
+        return date_from, date_to, date_field, gtin_match
+
+    def check_codes(self):
+        args = self.get_check_args()
+        if not args:
+            return
+        if self.preflight_check.isChecked():
+            self.preflight(args, self.mode_combo.currentData())
+            return
+        self.run_check(args, self.mode_combo.currentData())
+
+    def load_all_rows(self):
+        # Те же параметры, что у последней проверки, но со всеми строками
+        self.run_check(self.last_check_args, CHECK_MODE_ALL)
+
+    def run_check(self, args, mode):
+        pool, gtin, date_from, date_to, date_field, gtin_match = args
+        self.last_check_args = args
+        self.stop_stream()
+        self.stop_live()
+        self.shown_check = None
         # Показываем окно загрузки
-        self.loading = LoadingDialog(self)
+        self.loading = LoadingDialog(self, on_cancel=self.cancel_check)
         self.loading.show()
         # Запускаем поток
-        self.worker = DBWorkerWithDateField(conn_params, gtin, date_from, date_to, date_field)
-        self.worker.result_ready.connect(self.on_db_result)
+        stream = self.stream_check.isChecked() and mode == CHECK_MODE_ALL
+        cache = RESULT_CACHE if self.cache_check.isChecked() else None
+        self.result_pool = pool
+        self.result_columns = self.line_columns()
+        self.worker = DBWorkerWithDateField(pool, gtin, date_from, date_to, date_field, gtin_match,
+                                            stream, self.itersize_spin.value(), mode, self.preview_spin.value(),
+                                            cache, self.result_columns)
+        if mode != CHECK_MODE_ALL:
+            self.worker.count_ready.connect(self.on_count_result)
+        elif stream:
+            self.result_model.clear()
+            self.worker.batch_ready.connect(self.on_db_batch)
+            self.worker.stream_finished.connect(self.on_stream_finished)
+        else:
+            self.worker.result_ready.connect(self.on_db_result)
         self.worker.start()
 
     def on_db_result(self, rows, colnames, error, status):
         self.loading.close()
+        with self.worker.timer.phase('render'):
+            self.show_db_result(rows, colnames, error, status)
+        self.record_timing(self.worker.timer, status, len(rows) if rows else 0)
+
+    def show_db_result(self, rows, colnames, error, status):
+        if status == 'cancelled':
+            self.show_cancelled()
+            return
         if status == 'error':
-            self.result_table.setVisible(False)
-            self.table_scroll.setVisible(False)
-            self.export_btn.setVisible(False)
-            self.clear_btn.setVisible(False)
-            self.expand_btn.setVisible(False)
-            self.count_label.setVisible(False)
-            self.status_label.setText('<span style="color:#E53935">ОШИБКА</span>')
-            self.status_label.setVisible(True)
-            QMessageBox.critical(self, 'Ошибка подключения', error)
+            self.show_error(error)
             return
         if not rows:
-            self.result_table.setVisible(False)
-            self.table_scroll.setVisible(False)
-            self.export_btn.setVisible(False)
-            self.clear_btn.setVisible(True)
-            self.expand_btn.setVisible(False)
-            self.count_label.setVisible(True)
-            self.count_label.setText('Найдено строк: 0')
-            self.status_label.setText('<span style="color:#E53935">НЕТ ЗАПИСЕЙ</span>')
-            self.status_label.setVisible(True)
-            return
-        self.result_table.setVisible(True)
-        self.table_scroll.setVisible(True)
+            self.show_no_rows()
+            return
+        self.show_rows_found(len(rows))
+        if self.worker.fetched is not None and self.worker.fetched < len(rows):
+            self.count_label.setText(f'Найдено строк: {len(rows)} (с сервера: {self.worker.fetched}, остальные из кэша)')
+        self.result_model.set_result(rows, colnames)
+        fit_columns_to_sample(self.result_table)
+        self.shown_check = self.check_key(self.last_check_args)
+
+    def on_count_result(self, total, rows, colnames, error, status):
+        self.loading.close()
+        with self.worker.timer.phase('render'):
+            self.show_count_result(total, rows, colnames, error, status)
+        self.record_timing(self.worker.timer, status, total)
+
+    def show_count_result(self, total, rows, colnames, error, status):
+        if status == 'cancelled':
+            self.show_cancelled()
+            return
+        if status == 'error':
+            self.show_error(error)
+            return
+        if not total:
+            self.show_no_rows()
+            return
+        self.show_rows_found(total)
+        # Полного результата нет — выгружать и разворачивать нечего
+        self.export_btn.setVisible(False)
+        self.expand_btn.setVisible(bool(rows))
+        self.table_panel.setVisible(bool(rows))
+        if rows:
+            self.result_model.set_result(rows, colnames)
+            fit_columns_to_sample(self.result_table)
+        if len(rows) < total:
+            if rows:
+                self.count_label.setText(f'Найдено строк: {total} (показаны первые {len(rows)})')
+            self.load_all_btn.setVisible(True)
+        else:
+            self.export_btn.setVisible(True)
+            self.shown_check = self.check_key(self.last_check_args)
+
+    def on_db_batch(self, rows, colnames):
+        # Окно загрузки убираем с первым пакетом — дальше строки видны в таблице
+        self.loading.close()
+        with self.worker.timer.phase('render'):
+            if self.result_model.columnCount() == 0:
+                self.result_model.set_result(rows, colnames)
+                fit_columns_to_sample(self.result_table)
+            else:
+                self.result_model.append_rows(rows)
+        self.table_panel.setVisible(True)
+        self.stop_btn.setVisible(True)
+        self.count_label.setVisible(True)
+        self.count_label.setText(f'Загружено строк: {self.result_model.rowCount()}...')
+        self.sender().batch_done()
+
+    def on_stream_finished(self, total, error, status):
+        self.loading.close()
+        self.stop_btn.setVisible(False)
+        self.record_timing(self.worker.timer, status, len(self.result_model.rows))
+        if status == 'cancelled':
+            # Уже полученные строки оставляем на экране
+            loaded = self.result_model.rowCount()
+            if not loaded:
+                self.show_cancelled()
+                return
+            self.show_rows_found(loaded)
+            self.count_label.setText(f'Загружено строк: {loaded} (загрузка остановлена)')
+            return
+        if status == 'error':
+            self.show_error(error)
+            return
+        if not total:
+            self.show_no_rows()
+            return
+        self.show_rows_found(total)
+        self.shown_check = self.check_key(self.last_check_args)
+
+    def check_key(self, args):
+        """Что именно проверялось: строки на экране годятся для мониторинга только той же проверки"""
+        pool, gtin, date_from, date_to, date_field, gtin_match = args
+        return (pool.name, gtin_key(gtin, gtin_match), date_from, date_to, date_field, gtin_match,
+                tuple(self.line_columns() or ()))
+
+    def record_timing(self, timer, status, result_rows=None):
+        """Замер завершённой проверки: в историю и в панель производительности"""
+        record = timer.finish(status, result_rows)
+        append_history(record)
+        lines = [f"{PHASE_TITLES.get(name, name)}: {ms:.1f} мс" for name, ms in record['phases_ms'].items()]
+        lines.append(f"Всего: {record['total_ms']:.1f} мс")
+        rows_title = 'Строк выгружено' if record['kind'].startswith('export') else 'Строк с сервера'
+        lines.append(f"{rows_title}: {record['rows']}, ≈{record['bytes'] / 1024:.1f} КБ")
+        self.perf_label.setText('\n'.join(lines))
+        self.perf_btn.setVisible(True)
+
+    def toggle_perf_panel(self, checked):
+        self.perf_label.setVisible(checked)
+        self.perf_btn.setText('Производительность ▴' if checked else 'Производительность ▾')
+
+    def show_error(self, error):
+        # Возможно, изменилась структура таблицы — перечитаем её в фоне
+        self.load_schema(self.line_combo.currentText(), force=True)
+        self.table_panel.setVisible(False)
+        self.load_all_btn.setVisible(False)
+        self.export_btn.setVisible(False)
+        self.clear_btn.setVisible(False)
+        self.expand_btn.setVisible(False)
+        self.count_label.setVisible(False)
+        self.hide_aliases()
+        self.status_label.setText('<span style="color:#E53935">ОШИБКА</span>')
+        self.status_label.setVisible(True)
+        QMessageBox.critical(self, 'Ошибка подключения', error)
+
+    def show_cancelled(self):
+        self.table_panel.setVisible(False)
+        self.load_all_btn.setVisible(False)
+        self.export_btn.setVisible(False)
+        self.clear_btn.setVisible(True)
+        self.expand_btn.setVisible(False)
+        self.count_label.setVisible(False)
+        self.hide_aliases()
+        self.status_label.setText('<span style="color:#9E9E9E">ОТМЕНЕНО</span>')
+        self.status_label.setVisible(True)
+
+    def show_no_rows(self):
+        self.table_panel.setVisible(False)
+        self.load_all_btn.setVisible(False)
+        self.export_btn.setVisible(False)
+        self.clear_btn.setVisible(True)
+        self.expand_btn.setVisible(False)
+        self.count_label.setVisible(True)
+        self.count_label.setText('Найдено строк: 0')
+        self.show_aliases()
+        self.status_label.setText('<span style="color:#E53935">НЕТ ЗАПИСЕЙ</span>')
+        self.status_label.setVisible(True)
+
+    def show_rows_found(self, count):
+        self.table_panel.setVisible(True)
+        self.load_all_btn.setVisible(False)
         self.export_btn.setVisible(True)
         self.clear_btn.setVisible(True)
         self.expand_btn.setVisible(True)
         self.count_label.setVisible(True)
-        self.count_label.setText(f'Найдено строк: {len(rows)}')
+        self.count_label.setText(f'Найдено строк: {count}')
+        self.show_aliases()
         self.status_label.setText('<span style="color:#43A047">OK</span>')
         self.status_label.setVisible(True)
-        self.result_table.setColumnCount(len(colnames))
-        self.result_table.setRowCount(len(rows))
-        self.result_table.setHorizontalHeaderLabels(colnames)
-        for i, row in enumerate(rows):
-            for j, val in enumerate(row):
-                self.result_table.setItem(i, j, QTableWidgetItem(str(val)))
-        self.result_table.resizeColumnsToContents()
+
+    def show_query_plan(self):
+        args = self.get_check_args()
+        if not args:
+            return
+        pool, gtin, date_from, date_to, date_field, gtin_match = args
+        sql, params = self.check_query(args, self.mode_combo.currentData())
+        self.plan_dialog = PlanDialog(self, pool, sql, params)
+        self.plan_dialog.show()
+
+    def check_query(self, args, mode):
+        """Самый тяжёлый запрос, который отправит проверка в этом режиме"""
+        pool, gtin, date_from, date_to, date_field, gtin_match = args
+        if mode == CHECK_MODE_ALL:
+            return build_check_query(gtin, date_from, date_to, date_field, gtin_match, columns=self.line_columns())
+        return build_count_query(gtin, date_from, date_to, date_field, gtin_match)
+
+    def preflight(self, args, mode):
+        """EXPLAIN того же запроса, что отправит проверка; тяжёлую проверку нужно подтвердить"""
+        sql, params = self.check_query(args, mode)
+        self.preflight_args = (args, mode)
+        self.loading = LoadingDialog(self)
+        self.loading.show()
+        self.preflight_worker = ExplainWorker(args[0], sql, params)
+        self.preflight_worker.result_ready.connect(self.on_preflight_result)
+        self.preflight_worker.start()
+
+    def on_preflight_result(self, explain, error, status):
+        self.loading.close()
+        if status == 'error':
+            self.show_error(error)
+            return
+        args, mode = self.preflight_args
+        line_name = args[0].name
+        summary = plan_summary(explain['Plan'], self.preflight_worker.relation_rows)
+        threshold = int(self.parent.lines.get(line_name, {}).get('preflight_rows') or PREFLIGHT_MAX_ROWS)
+        # Таблица читается целиком, а её размер неизвестен — считаем проверку тяжёлой
+        if summary['rows_read'] is None or summary['rows_read'] > threshold:
+            if summary['rows_read'] is None:
+                estimate = "прочитает таблицу целиком, размер таблицы неизвестен (она ещё не анализировалась)"
+            else:
+                estimate = f"прочитает ≈{summary['rows_read']} строк"
+            answer = QMessageBox.question(
+                self, 'Тяжёлая проверка',
+                f"По оценке сервера проверка {estimate} "
+                f"(порог линии: {threshold}).\n\n"
+                f"Чтение: {', '.join(summary['scans'])}\n"
+                f"Строк в результате: ≈{summary['rows']}\n"
+                f"Стоимость: {summary['cost']}\n\n"
+                f"Запустить проверку?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if answer != QMessageBox.Yes:
+                return
+        self.run_check(args, mode)
 
     def export_to_csv(self):
-        if self.result_table.rowCount() == 0:
+        if self.result_model.rowCount() == 0:
             QMessageBox.warning(self, 'Выгрузка', 'Нет данных для выгрузки!')
             return
         path, _ = QFileDialog.getSaveFileName(self, 'Сохранить как CSV', '', 'CSV Files (*.csv)')
         if not path:
             return
+        colnames = self.result_model.colnames
+        timer = PhaseTimer('export_csv', line=self.line_combo.currentText(), columns=colnames)
         try:
-            with open(path, 'w', newline='', encoding='utf-8') as f:
-                # Заголовки вручную, чтобы всегда были в кавычках
-                headers = [f'"{self.result_table.horizontalHeaderItem(i).text()}"' for i in range(self.result_table.columnCount())]
-                f.write(','.join(headers) + '\n')
+            with timer.phase('export'), open(path, 'w', newline='', encoding='utf-8') as f:
+                f.write(csv_header(colnames))
                 # Индексы столбцов, которые всегда должны быть в кавычках
-                special_cols = []
-                for i in range(self.result_table.columnCount()):
-                    col_name = self.result_table.horizontalHeaderItem(i).text().strip().lower().replace('_', '')
-                    if col_name in ('code', 'grcode', 'sscc'):
-                        special_cols.append(i)
-                for row in range(self.result_table.rowCount()):
-                    rowdata = []
-                    for col in range(self.result_table.columnCount()):
-                        item = self.result_table.item(row, col)
-                        val = item.text() if item and item.text() else ''
-                        if val == 'None':
-                            val = ''
-                        # Для нужных столбцов — всегда в кавычках и с экранированием
-                        if col in special_cols and val != '':
-                            val = '"' + val.replace('"', '""') + '"'
-                        rowdata.append(val)
-                    f.write(','.join(rowdata) + '\n')
+                special_cols = [i for i, name in enumerate(colnames) if is_csv_quoted_column(name)]
+                for row in self.result_model.rows:
+                    f.write(csv_line(row, special_cols))
+            timer.count(len(self.result_model.rows), os.path.getsize(path))
+            self.record_timing(timer, 'ok')
             QMessageBox.information(self, 'Выгрузка завершена', f'Данные успешно сохранены в {path}')
+        except Exception as e:
+            self.record_timing(timer, 'error')
+            QMessageBox.critical(self, 'Ошибка', f'Ошибка при сохранении: {e}')
+
+    def on_live_toggled(self, checked):
+        if checked:
+            self.start_live()
+        else:
+            self.stop_live()
+
+    def start_live(self):
+        args = self.get_check_args()
+        if not args:
+            self.set_live_checked(False)
+            return
+        pool, gtin, date_from, date_to, date_field, gtin_match = args
+        self.stop_stream()
+        self.live_key = self.check_key(args)
+        shown_rows = shown_colnames = None
+        if self.live_key == self.shown_check and self.result_model.rows:
+            # На экране полный результат той же проверки — дописываем к нему только новые строки
+            shown_rows, shown_colnames = self.result_model.rows, self.result_model.colnames
+        else:
+            self.result_model.clear()
+            self.shown_check = None
+        channel = self.parent.lines[self.line_combo.currentText()].get('notify_channel')
+        self.result_pool = pool
+        self.result_columns = self.line_columns()
+        self.live_worker = LiveWorker(pool, gtin, date_from, date_to, date_field, gtin_match, channel,
+                                      self.result_columns, shown_rows, shown_colnames)
+        self.live_worker.rows_ready.connect(self.on_live_rows)
+        self.live_worker.poll_done.connect(self.on_live_poll)
+        self.live_worker.stopped.connect(self.on_live_stopped)
+        self.live_worker.start()
+        self.status_label.setText('<span style="color:#1E88E5">МОНИТОРИНГ</span>')
+        self.status_label.setVisible(True)
+
+    def stop_live(self):
+        worker = getattr(self, 'live_worker', None)
+        if worker is not None and worker.isRunning():
+            worker.rows_ready.disconnect()
+            worker.poll_done.disconnect()
+            worker.stopped.disconnect()
+            worker.cancel()
+            if self.result_model.rows:
+                self.count_label.setText(f'Найдено строк: {len(self.result_model.rows)} (мониторинг остановлен)')
+                self.status_label.setText('<span style="color:#43A047">OK</span>')
+        self.set_live_checked(False)
+
+    def set_live_checked(self, checked):
+        self.live_btn.blockSignals(True)
+        self.live_btn.setChecked(checked)
+        self.live_btn.blockSignals(False)
+
+    def on_live_rows(self, rows, colnames):
+        if self.result_model.columnCount() == 0:
+            self.result_model.set_result(rows, colnames)
+            fit_columns_to_sample(self.result_table)
+        else:
+            self.result_model.append_rows(rows)
+        self.show_rows_found(len(self.result_model.rows))
+        self.status_label.setText('<span style="color:#1E88E5">МОНИТОРИНГ</span>')
+
+    def on_live_poll(self, new_rows, interval):
+        # Первая загрузка закончилась — на экране полный результат, мониторинг можно продолжить с него
+        self.shown_check = self.live_key
+        self.count_label.setVisible(True)
+        self.count_label.setText(f'Найдено строк: {len(self.result_model.rows)} '
+                                 f'(новых: {new_rows}, следующий опрос через {interval} с)')
+
+    def on_live_stopped(self, error, status):
+        self.set_live_checked(False)
+        if status == 'error':
+            self.show_error(error)
+
+    def check_products(self):
+        line_name = self.line_combo.currentText()
+        if line_name not in self.parent.lines:
+            QMessageBox.critical(self, 'Ошибка', 'Выберите линию!')
+            return
+        dialog = ProductPickDialog(self, list(self.parent.products), [self.product_combo.currentText()])
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        names = dialog.selected_names()
+        if not names:
+            QMessageBox.critical(self, 'Ошибка', 'Выберите хотя бы один продукт!')
+            return
+        # Продукты с одним GTIN проверяются одним условием
+        date_from, date_to, date_field, gtin_match = self.get_filter_args()
+        self.batch_groups = group_by_gtin(names, self.parent.products, gtin_match)
+        self.batch_line = line_name
+        self.batch_match = gtin_match
+        gtins = [gtin for gtin, _ in self.batch_groups]
+        pool = get_pool(line_name, self.parent.lines[line_name])
+        self.batch_worker = BatchCountWorker(pool, gtins, date_from, date_to, date_field, gtin_match)
+        self.loading = LoadingDialog(self, on_cancel=self.batch_worker.cancel)
+        self.loading.show()
+        self.batch_worker.result_ready.connect(self.on_batch_result)
+        self.batch_worker.start()
+
+    def on_batch_result(self, counts, error, status):
+        self.loading.close()
+        if status == 'cancelled':
+            return
+        if status == 'error':
+            QMessageBox.critical(self, 'Ошибка подключения', error)
+            return
+        # В режиме contains группы — GTIN как записан, справочник по 14-значному GTIN к ним не подходит
+        gtin_names = {} if self.batch_match == GTIN_MATCH_CONTAINS else self.parent.gtin_names
+        self.batch_dialog = BatchResultDialog(self, self.batch_groups, counts, self.batch_line, gtin_names)
+        self.batch_dialog.show()
+
+    def check_product(self, product_name):
+        """Обычная проверка выбранного продукта (из итогов по нескольким продуктам)"""
+        self.line_combo.setCurrentText(self.batch_line)
+        self.select_product(product_name)
+        self.check_codes()
+
+    def line_columns(self):
+        """Столбцы, выбранные для текущей линии, или None — все"""
+        line = self.parent.lines.get(self.line_combo.currentText(), {})
+        return line.get('columns') or None
+
+    def choose_columns(self):
+        line_name = self.line_combo.currentText()
+        if line_name not in self.parent.lines:
+            QMessageBox.critical(self, 'Ошибка', 'Выберите линию!')
+            return
+        schema = get_schema(line_name)
+        if schema is not None:
+            self.edit_columns(line_name, schema)
+            return
+        self.loading = LoadingDialog(self)
+        self.loading.show()
+        self.columns_worker = SchemaWorker(line_name, self.parent.lines[line_name])
+        self.columns_worker.result_ready.connect(self.on_columns_schema)
+        self.columns_worker.start()
+
+    def on_columns_schema(self, line_name, schema, error, status):
+        self.loading.close()
+        if status == 'error':
+            QMessageBox.critical(self, 'Ошибка подключения', error)
+            return
+        self.show_schema(schema)
+        self.edit_columns(line_name, schema)
+
+    def edit_columns(self, line_name, schema):
+        if not schema.exists:
+            QMessageBox.critical(self, 'Ошибка', 'На линии нет таблицы codes')
+            return
+        line = self.parent.lines[line_name]
+        required = set(REQUIRED_COLUMNS) | set(schema.primary_key)
+        dialog = ColumnsDialog(self, schema.columns, line.get('columns'), required, line_name)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        selected = dialog.selected_columns()
+        line = dict(line)
+        if selected:
+            line['columns'] = selected
+        else:
+            line.pop('columns', None)
+        try:
+            get_store().put_line(line_name, line)
         except Exception as e:
             QMessageBox.critical(self, 'Ошибка', f'Ошибка при сохранении: {e}')
+            return
+        self.parent.lines[line_name] = line
+        self.clear_results()
+
+    def open_row(self, index):
+        model = self.result_model
+        if model.colnames == DUPLICATE_COLUMNS:
+            return
+        row = model.visible[index.row()]
+        if not getattr(self, 'result_columns', None):
+            # Загружены все столбцы — строка уже целиком в таблице
+            RowDialog(self, row, model.colnames).exec_()
+            return
+        schema = get_schema(self.result_pool.name)
+        self.row_worker = FullRowWorker(self.result_pool, dict(zip(model.colnames, row)),
+                                        schema.primary_key if schema is not None else None)
+        self.row_worker.result_ready.connect(self.on_full_row)
+        self.row_worker.start()
+
+    def on_full_row(self, row, colnames, error, status):
+        if status == 'error':
+            QMessageBox.critical(self, 'Ошибка', error)
+            return
+        RowDialog(self, row, colnames).exec_()
+
+    def find_duplicate_codes(self):
+        args = self.get_check_args()
+        if not args:
+            return
+        self.stop_stream()
+        self.stop_live()
+        self.duplicates_worker = DuplicatesWorker(*args)
+        self.loading = LoadingDialog(self, on_cancel=self.duplicates_worker.cancel)
+        self.loading.show()
+        self.duplicates_worker.result_ready.connect(self.on_duplicates_result)
+        self.duplicates_worker.start()
+
+    def on_duplicates_result(self, rows, method, error, status):
+        self.loading.close()
+        if status == 'cancelled':
+            self.show_cancelled()
+            return
+        if status == 'error':
+            self.show_error(error)
+            return
+        self.shown_check = None
+        self.result_model.set_result(rows, DUPLICATE_COLUMNS)
+        self.table_panel.setVisible(bool(rows))
+        self.load_all_btn.setVisible(False)
+        self.export_btn.setVisible(bool(rows))
+        self.expand_btn.setVisible(bool(rows))
+        self.clear_btn.setVisible(True)
+        where = 'на сервере' if method == 'server' else 'на клиенте'
+        self.count_label.setText(f'Повторяющихся кодов: {len(rows)} (подсчёт {where})')
+        self.count_label.setVisible(True)
+        if rows:
+            fit_columns_to_sample(self.result_table)
+            self.status_label.setText('<span style="color:#E53935">ЕСТЬ ДУБЛИ</span>')
+        else:
+            self.status_label.setText('<span style="color:#43A047">ДУБЛЕЙ НЕТ</span>')
+        self.status_label.setVisible(True)
+
+    def show_histogram(self):
+        args = self.get_check_args()
+        if not args:
+            return
+        title = f'{self.product_combo.currentText()}, {self.line_combo.currentText()}'
+        self.histogram_dialog = HistogramDialog(self, *args, title)
+        self.histogram_dialog.show()
+
+    def check_all_lines(self):
+        product_name = self.product_combo.currentText()
+        if product_name not in self.parent.products:
+            QMessageBox.critical(self, 'Ошибка', 'Выберите продукт!')
+            return
+        if not self.parent.lines:
+            QMessageBox.critical(self, 'Ошибка', 'Добавьте линии на вкладке "Линии"!')
+            return
+        gtin = self.parent.products[product_name]
+        # Способ поиска в режиме "авто" выбирается для каждой линии по её индексам (count_on_line)
+        date_from, date_to, date_field, gtin_match = self.get_filter_args(resolve_auto=False)
+        # Итог относится ко всем продуктам с этим GTIN
+        product_names = ', '.join(self.parent.gtin_names.get(normalize_gtin(gtin), [product_name]))
+        self.multi_dialog = MultiLineDialog(self, list(self.parent.lines), product_names)
+        self.multi_worker = MultiLineWorker(self.parent.lines, gtin, date_from, date_to, date_field, gtin_match)
+        self.multi_worker.line_done.connect(self.multi_dialog.on_line_done)
+        self.multi_worker.start()
+        self.multi_dialog.show()
+
+    def check_on_line(self, line_name):
+        """Обычная проверка на выбранной линии (из итогов по всем линиям)"""
+        self.line_combo.setCurrentText(line_name)
+        self.check_codes()
+
+    def export_from_db(self):
+        args = self.get_check_args()
+        if not args:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, 'Сохранить как CSV', '', 'CSV Files (*.csv)')
+        if not path:
+            return
+        pool, gtin, date_from, date_to, date_field, gtin_match = args
+        self.export_progress = QtWidgets.QProgressDialog('Выгрузка в CSV...', 'Отмена', 0, 0, self)
+        self.export_progress.setWindowTitle('Выгрузка')
+        self.export_progress.setWindowModality(Qt.WindowModal)
+        self.export_progress.setMinimumDuration(0)
+        self.export_progress.show()
+        self.export_worker = CopyExportWorker(pool, gtin, date_from, date_to, date_field, gtin_match, path,
+                                              self.line_columns())
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.result_ready.connect(self.on_export_finished)
+        self.export_progress.canceled.connect(self.export_worker.cancel)
+        self.export_worker.start()
+
+    def on_export_progress(self, rows, estimate):
+        # Итог известен только по оценке планировщика; когда строк больше оценки — бегущая полоса
+        if estimate and rows <= estimate:
+            self.export_progress.setMaximum(estimate)
+            self.export_progress.setValue(rows)
+            self.export_progress.setLabelText(f'Выгружено строк: {rows} из ~{estimate}')
+        else:
+            self.export_progress.setMaximum(0)
+            self.export_progress.setLabelText(f'Выгружено строк: {rows}')
+
+    def on_export_finished(self, rows, error, status):
+        self.export_progress.close()
+        self.record_timing(self.export_worker.timer, status)
+        if status == 'cancelled':
+            return
+        if status == 'error':
+            QMessageBox.critical(self, 'Ошибка', f'Ошибка при выгрузке: {error}')
+            return
+        QMessageBox.information(self, 'Выгрузка завершена',
+                                f'Выгружено строк: {rows}\nДанные успешно сохранены в {self.export_worker.path}')
 
     def on_search_text(self, text):
-        # Автоматически подсвечивать первый совпадающий продукт
-        idx = self.product_combo.findText(text, QtCore.Qt.MatchStartsWith)
-        if idx != -1:
-            self.product_combo.setCurrentIndex(idx)
+        # Автоматически подсвечивать лучший продукт, название которого начинается с text
+        name = self.product_search.best_match(text)
+        if name is None or not name.casefold().startswith(text.casefold()):
+            return
+        self.select_product(name)
 
     def on_search_select(self):
-        text = self.product_search.text()
-        idx = self.product_combo.findText(text, QtCore.Qt.MatchExactly)
-        if idx != -1:
-            self.product_combo.setCurrentIndex(idx)
+        self.select_product(self.product_search.text())
 
     def on_completer_activated(self, text):
-        idx = self.product_combo.findText(text, QtCore.Qt.MatchExactly)
-        if idx != -1:
+        self.select_product(text)
+
+    def select_product(self, name):
+        # Позиция в списке — из словаря, а не перебором findText
+        idx = self.product_rows.get(name)
+        if idx is not None:
             self.product_combo.setCurrentIndex(idx)
 
     def update_products(self):
@@ -627,13 +2489,15 @@ class MainTab(QWidget):
         self.product_combo.clear()
         # Для автодополнения
         names = list(self.parent.products.keys())
-        self.product_search.set_products(names)
+        self.parent.gtin_names = gtin_aliases(self.parent.products)
+        self.product_search.set_products(self.parent.products)
         for name in names:
             gtin = self.parent.products[name]
             self.product_combo.addItem(f'{name}', gtin)
+        self.product_rows = {name: i for i, name in enumerate(names)}
         # Восстановить выбор, если он есть
-        idx = self.product_combo.findText(current)
-        if idx != -1:
+        idx = self.product_rows.get(current)
+        if idx is not None:
             self.product_combo.setCurrentIndex(idx)
         self.product_combo.blockSignals(False)
 
@@ -648,27 +2512,26 @@ class MainTab(QWidget):
             self.line_combo.setCurrentIndex(idx)
         self.line_combo.blockSignals(False)
 
+    def update_filter_count(self, *args):
+        model = self.result_model
+        if model.filter_text:
+            self.filter_count_label.setText(f'Показано: {model.rowCount()} из {len(model.rows)}')
+        else:
+            self.filter_count_label.clear()
+
     def show_big_table(self):
         dlg = QDialog(self)
+        # Окно с представлением удаляется при закрытии, а не копится у родителя
+        dlg.setAttribute(Qt.WA_DeleteOnClose)
         dlg.setWindowTitle('Таблица проверки — развернуто')
         dlg.resize(1200, 700)
         layout = QVBoxLayout(dlg)
-        table = QTableWidget()
-        # Копируем структуру и данные
-        table.setColumnCount(self.result_table.columnCount())
-        table.setRowCount(self.result_table.rowCount())
-        table.setHorizontalHeaderLabels([self.result_table.horizontalHeaderItem(i).text() for i in range(self.result_table.columnCount())])
-        for i in range(self.result_table.rowCount()):
-            for j in range(self.result_table.columnCount()):
-                src_item = self.result_table.item(i, j)
-                if src_item:
-                    table.setItem(i, j, QTableWidgetItem(src_item.text()))
-        table.resizeColumnsToContents()
-        table.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        scroll.setWidget(table)
-        layout.addWidget(scroll)
+        # Второе представление той же модели: строки, сортировка и фильтр общие
+        layout.addWidget(ResultFilterEdit(self.result_model))
+        table = ResultTableView(self.result_model)
+        for col in range(self.result_model.columnCount()):
+            table.setColumnWidth(col, self.result_table.columnWidth(col))
+        layout.addWidget(table)
         btn_close = QPushButton('Закрыть')
         btn_close.clicked.connect(dlg.accept)
         layout.addWidget(btn_close)
@@ -744,10 +2607,13 @@ class ProductsTab(QWidget):
         del_btn.clicked.connect(self.del_product)
         import_btn = QPushButton('Импорт из файла')
         import_btn.clicked.connect(self.import_from_file)
+        export_btn = QPushButton('Экспорт в файл')
+        export_btn.clicked.connect(self.export_to_file)
         btns.addWidget(add_btn)
         btns.addWidget(save_btn)
         btns.addWidget(del_btn)
         btns.addWidget(import_btn)
+        btns.addWidget(export_btn)
         form_layout.addLayout(btns)
         form_layout.addStretch()
         main_layout.addLayout(form_layout, 3)
@@ -781,11 +2647,16 @@ class ProductsTab(QWidget):
         if not name or not gtin:
             QMessageBox.warning(self, 'Ошибка', 'Заполните все поля!')
             return
+        try:
+            # Пишется одна запись; при переименовании старое имя удаляется в той же транзакции
+            get_store().put_product(name, gtin, self.selected_name)
+        except Exception as e:
+            QMessageBox.critical(self, 'Ошибка', f'Ошибка при сохранении: {e}')
+            return
         # Если редактируем — удалить старое имя, если оно изменилось
         if self.selected_name and self.selected_name != name:
             del self.parent.products[self.selected_name]
         self.parent.products[name] = gtin
-        save_products(self.parent.products)
         self.update_list()
         self.parent.tabs.widget(0).update_products()
         # Выделить сохранённый
@@ -796,8 +2667,12 @@ class ProductsTab(QWidget):
     def del_product(self):
         if not self.selected_name:
             return
+        try:
+            get_store().delete_product(self.selected_name)
+        except Exception as e:
+            QMessageBox.critical(self, 'Ошибка', f'Ошибка при удалении: {e}')
+            return
         del self.parent.products[self.selected_name]
-        save_products(self.parent.products)
         self.update_list()
         self.parent.tabs.widget(0).update_products()
         self.selected_name = None
@@ -805,27 +2680,33 @@ class ProductsTab(QWidget):
         self.gtin_edit.clear()
 
     def import_from_file(self):
-        import json
         path, _ = QFileDialog.getOpenFileName(self, 'Выберите файл продуктов', '', 'JSON Files (*.json)')
         if not path:
             return
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            count = 0
-            for item in data:
-                name = item.get('Name')
-                gtin = item.get('Gtin')
-                if name and gtin:
-                    self.parent.products[name] = gtin
-                    count += 1
-            save_products(self.parent.products)
+            products = parse_products_file(read_json(path))
+            # Весь файл одной транзакцией: при ошибке не импортируется ничего
+            get_store().put_products(products)
+            get_store().mark_json_current(path)
+            self.parent.products.update(products)
             self.update_list()
             self.parent.tabs.widget(0).update_products()
-            QMessageBox.information(self, 'Импорт завершён', f'Импортировано продуктов: {count}')
+            QMessageBox.information(self, 'Импорт завершён', f'Импортировано продуктов: {len(products)}')
         except Exception as e:
             QMessageBox.critical(self, 'Ошибка импорта', str(e))
 
+    def export_to_file(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Экспорт продуктов', PRODUCTS_FILE, 'JSON Files (*.json)')
+        if not path:
+            return
+        try:
+            write_json(path, self.parent.products)
+            # Выгрузка в исходный файл — не повод предлагать его повторный импорт
+            get_store().mark_json_current(path)
+            QMessageBox.information(self, 'Экспорт завершён', f'Продуктов: {len(self.parent.products)}\nФайл: {path}')
+        except Exception as e:
+            QMessageBox.critical(self, 'Ошибка экспорта', str(e))
+
 class LinesTab(QWidget):
     def __init__(self, parent):
         super().__init__()
@@ -859,6 +2740,16 @@ class LinesTab(QWidget):
             row.addWidget(edit)
             self.inputs[field] = edit
             form_layout.addLayout(row)
+        # Необязательные параметры линии
+        self.extra_inputs = {}
+        for key, title, hint in LINE_EXTRA_FIELDS:
+            row = QHBoxLayout()
+            row.addWidget(QLabel(title + ':'))
+            edit = QLineEdit()
+            edit.setPlaceholderText(hint)
+            row.addWidget(edit)
+            self.extra_inputs[key] = edit
+            form_layout.addLayout(row)
         btns = QHBoxLayout()
         add_btn = QPushButton('Добавить')
         add_btn.clicked.connect(self.add_line)
@@ -868,10 +2759,13 @@ class LinesTab(QWidget):
         del_btn.clicked.connect(self.del_line)
         import_btn = QPushButton('Импорт из файла')
         import_btn.clicked.connect(self.import_from_appsettings)
+        export_btn = QPushButton('Экспорт в файл')
+        export_btn.clicked.connect(self.export_to_file)
         btns.addWidget(add_btn)
         btns.addWidget(save_btn)
         btns.addWidget(del_btn)
         btns.addWidget(import_btn)
+        btns.addWidget(export_btn)
         form_layout.addLayout(btns)
         form_layout.addStretch()
         main_layout.addLayout(form_layout, 3)
@@ -893,15 +2787,21 @@ class LinesTab(QWidget):
             self.inputs['Логин'].setText(line['user'])
             self.inputs['Пароль'].setText(line['password'])
             self.inputs['База данных'].setText(line['dbname'])
+            for key, edit in self.extra_inputs.items():
+                edit.setText(str(line.get(key, '')))
         else:
             self.selected_name = None
             self.line_name_edit.clear()
             for edit in self.inputs.values():
                 edit.clear()
+            for edit in self.extra_inputs.values():
+                edit.clear()
 
     def add_line(self):
         for edit in self.inputs.values():
             edit.clear()
+        for edit in self.extra_inputs.values():
+            edit.clear()
         self.line_name_edit.clear()
         self.list.clearSelection()
         self.selected_name = None
@@ -912,20 +2812,43 @@ class LinesTab(QWidget):
         if not all(data.values()) or not name:
             QMessageBox.warning(self, 'Ошибка', 'Заполните все поля и имя линии!')
             return
-        # Если редактируем и имя изменилось — переименовать ключ
-        if self.selected_name and self.selected_name != name:
-            if name in self.parent.lines:
-                QMessageBox.warning(self, 'Ошибка', f'Линия с именем "{name}" уже существует!')
+        extra = {key: edit.text().strip() for key, edit in self.extra_inputs.items()}
+        for key, title, hint in LINE_EXTRA_FIELDS:
+            if key in LINE_NUMERIC_FIELDS and extra[key] and not extra[key].isdigit():
+                QMessageBox.warning(self, 'Ошибка', f'{title}: укажите целое число секунд!')
                 return
-            self.parent.lines[name] = self.parent.lines.pop(self.selected_name)
-        self.parent.lines[name] = {
+        renamed = bool(self.selected_name) and self.selected_name != name
+        if renamed and name in self.parent.lines:
+            QMessageBox.warning(self, 'Ошибка', f'Линия с именем "{name}" уже существует!')
+            return
+        # Дополнительные настройки линии сохраняются при редактировании (и при переименовании)
+        previous = self.parent.lines.get(self.selected_name if renamed else name)
+        line = dict(previous or {})
+        line.update({
             'ip': data['IP адрес'],
             'port': data['Порт'],
             'user': data['Логин'],
             'password': data['Пароль'],
             'dbname': data['База данных']
-        }
-        save_lines(self.parent.lines)
+        })
+        for key, value in extra.items():
+            if value:
+                line[key] = value
+            else:
+                line.pop(key, None)
+        try:
+            # Сначала база: если запись не удалась, линии в памяти остаются как в базе
+            get_store().put_line(name, line, self.selected_name)
+        except Exception as e:
+            QMessageBox.critical(self, 'Ошибка', f'Ошибка при сохранении: {e}')
+            return
+        if renamed:
+            del self.parent.lines[self.selected_name]
+            close_pool(self.selected_name)
+        # Соединения со старыми параметрами больше не нужны
+        elif previous is not None and line_conn_params(previous) != line_conn_params(line):
+            close_pool(name)
+        self.parent.lines[name] = line
         self.update_list()
         self.parent.tabs.widget(0).update_lines()
         # Выделить сохранённую
@@ -942,8 +2865,9 @@ class LinesTab(QWidget):
         if reply != QMessageBox.Yes:
             return
         try:
+            get_store().delete_line(self.selected_name)
             del self.parent.lines[self.selected_name]
-            save_lines(self.parent.lines)
+            close_pool(self.selected_name)
             self.update_list()
             self.parent.tabs.widget(0).update_lines()
             main_tab = self.parent.tabs.widget(0)
@@ -960,8 +2884,11 @@ class LinesTab(QWidget):
         if not file_path:
             return
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = read_json(file_path)
+            if 'DataBase' not in data:
+                self.import_lines_file(data)
+                get_store().mark_json_current(file_path)
+                return
             pg = data['DataBase']['PostgreSql']
             line = {
                 'ip': pg['Server'],
@@ -977,14 +2904,41 @@ class LinesTab(QWidget):
                 reply = QMessageBox.question(self, 'Линия уже существует', f'Линия "{name}" уже есть. Обновить?', QMessageBox.Yes | QMessageBox.No)
                 if reply != QMessageBox.Yes:
                     return
+            get_store().put_line(name, line)
             self.parent.lines[name] = line
-            save_lines(self.parent.lines)
+            close_pool(name)
             self.update_list()
             self.parent.tabs.widget(0).update_lines()
             QMessageBox.information(self, 'Импорт завершён', f'Линия "{name}" импортирована!')
         except Exception as e:
             QMessageBox.critical(self, 'Ошибка импорта', str(e))
 
+    def import_lines_file(self, data):
+        """Импорт линий из файла в формате profiles.json (имя → параметры) одной транзакцией"""
+        lines = {name: line for name, line in data.items() if isinstance(line, dict) and 'ip' in line}
+        if not lines:
+            QMessageBox.warning(self, 'Импорт', 'В файле нет линий: ожидается appsettings.json или profiles.json')
+            return
+        get_store().put_lines(lines)
+        for name in lines:
+            close_pool(name)
+        self.parent.lines.update(lines)
+        self.update_list()
+        self.parent.tabs.widget(0).update_lines()
+        QMessageBox.information(self, 'Импорт завершён', f'Импортировано линий: {len(lines)}')
+
+    def export_to_file(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Экспорт линий', PROFILES_FILE, 'JSON Files (*.json)')
+        if not path:
+            return
+        try:
+            write_json(path, self.parent.lines)
+            # Выгрузка в исходный файл — не повод предлагать его повторный импорт
+            get_store().mark_json_current(path)
+            QMessageBox.information(self, 'Экспорт завершён', f'Линий: {len(self.parent.lines)}\nФайл: {path}')
+        except Exception as e:
+            QMessageBox.critical(self, 'Ошибка экспорта', str(e))
+
 class InfoTab(QWidget):
     def __init__(self, parent):
         super().__init__()
@@ -1068,15 +3022,29 @@ class HelpTab(QWidget):
                 <b>Пошаговая инструкция:</b>
                 <ol>
                     <li><b>Выберите продукт</b> через строку поиска или выпадающий список.<br>
-                        <span style="color:#FF5B00;">Совет:</span> используйте быстрый поиск по первым буквам.</li>
+                        <span style="color:#FF5B00;">Совет:</span> в строке поиска можно набрать любую часть названия или GTIN — подсказки идут от самых подходящих: сначала совпадения с началом названия, затем с началом слова.</li>
                     <li><b>Выберите линию</b> из выпадающего списка.<br>
                         <span style="color:#FF5B00;">Если линий нет</span> — добавьте их на вкладке "Линии".</li>
                     <li><b>Настройте фильтр по дате</b> ("Дата с" и "Дата по") и выберите поле для фильтрации ("Дата записи в БД" или "Дата производства").</li>
-                    <li><b>Нажмите кнопку "Проверить"</b> и дождитесь завершения поиска.</li>
+                    <li><b>Выберите способ поиска GTIN:</b> "Начало кода" и "Позиция" работают быстро по индексу, "Вхождение в любом месте" — для кодов нестандартного формата (медленно на больших таблицах). "Авто" выбирает способ по индексам таблицы на линии. Под выбором линии видно, сколько в таблице примерно строк и какой способ выбран; кнопка ⟳ перечитывает структуру таблицы, если её меняли.</li>
+                    <li><b>Выберите режим:</b> "Количество + первые строки" (по умолчанию) и "Только количество" отвечают за доли секунды — сервер сам считает строки. Все строки можно догрузить кнопкой <b>"Загрузить все строки"</b> или сразу выбрать режим "Все строки".</li>
+                    <li><b>Нажмите кнопку "Проверить"</b> и дождитесь завершения поиска (кнопка "Отмена" в окне ожидания прерывает запрос на сервере). Кнопка <b>"План запроса"</b> покажет, использует ли БД индекс для такой проверки, а "EXPLAIN ANALYZE" в её окне выполнит запрос и покажет фактическое время каждого шага.</li>
+                    <li>При включённой <b>"Оценке запроса перед проверкой"</b> сервер сначала оценивает, сколько строк придётся прочитать. Если больше порога линии (по умолчанию 1 000 000, меняется на вкладке "Линии"), проверку нужно подтвердить.</li>
+                    <li><b>Кнопка "Все линии"</b> проверяет выбранный продукт сразу на всех линиях: для каждой линии показываются статус, количество записей и время ответа. Недоступная линия не задерживает остальные. Двойной щелчок по линии откроет её записи.</li>
+                    <li><b>"Производительность"</b> под результатом показывает, сколько времени заняли подключение, выполнение запроса, получение строк и отображение последней проверки. Все замеры дописываются в файл <code>history.jsonl</code> рядом с программой — по нему можно сравнивать линии и замечать замедления.</li>
+                    <li><b>Кнопка "Несколько продуктов"</b> — отметьте нужные продукты, и количество записей по каждому будет посчитано одним запросом к выбранной линии. Продукты с одинаковым GTIN считаются один раз и показываются одной строкой со всеми их названиями. Двойной щелчок по продукту откроет его записи.</li>
+                    <li><b>Кнопка "Столбцы"</b> позволяет оставить в результатах только нужные столбцы — остальные (например, большие сырые данные сканера) не загружаются с сервера, и проверка идёт быстрее. Выбор сохраняется для каждой линии. Двойной щелчок по строке результата покажет её целиком.</li>
+                    <li><b>Кнопка "Дубликаты"</b> ищет коды, которые записаны в базу больше одного раза за выбранный период: для каждого показывается число повторов и время первой и последней записи. Если сервер не успевает посчитать за отведённый таймаут, коды считаются на компьютере.</li>
+                    <li><b>Кнопка "Гистограмма"</b> показывает, сколько кодов было за каждую минуту, час, день или неделю выбранного периода (по выбранному полю даты). Считает сервер, строки не загружаются, поэтому даже месяц данных строится быстро.</li>
+                    <li><b>Кнопка "Мониторинг"</b> подгружает только новые строки (по времени вставки <code>dtime_ins</code>) с учётом дат и поля даты из формы. Если в таблице уже результат той же проверки (линия, продукт, даты), новые строки дописываются к нему; иначе сначала загружаются все записи за период. Пока линия стоит, опросы становятся реже (до раза в 30 секунд). Повторное нажатие останавливает мониторинг.</li>
                     <li><b>Результаты:</b>
                         <ul>
                             <li>Появится таблица с найденными записями и их количеством.</li>
                             <li>Статус <span style="color:#43A047;">OK</span> — записи найдены, <span style="color:#E53935;">НЕТ ЗАПИСЕЙ</span> — ничего не найдено.</li>
+                            <li>Если у продукта есть другие названия с тем же GTIN, они перечислены под количеством: результат относится ко всем ним. При выборе такого названия результат остаётся на экране.</li>
+                            <li>При включённой <b>"Потоковой загрузке"</b> строки появляются в таблице частями, не дожидаясь конца запроса. Размер пакета подбирается автоматически или задаётся вручную.</li>
+                            <li>При включённом <b>"Кэшировать результаты"</b> повторная проверка того же продукта на той же линии берёт строки из памяти и догружает с сервера только новые строки и недостающие дни. Прошедшие дни считаются неизменными, сегодняшние данные перечитываются полностью не реже раза в 10 минут.</li>
+                            <li>Таблицу можно отсортировать щелчком по заголовку столбца и отфильтровать строкой над ней. Окно "Развернуть таблицу" показывает ту же таблицу с той же сортировкой и фильтром.</li>
                             <li>Для очистки результатов используйте кнопку <b>"Очистить результаты"</b> (или смените продукт/линию — очистка произойдет автоматически).</li>
                         </ul>
                     </li>
@@ -1095,6 +3063,7 @@ class HelpTab(QWidget):
                     <li>Нажмите <b>"Выгрузить в CSV"</b> под таблицей результатов.</li>
                     <li>Выберите путь и имя файла.</li>
                 </ol>
+                <b>Большие выгрузки:</b> кнопка <b>"CSV из БД"</b> рядом с "Проверить" выгружает те же записи (линия, продукт, даты) прямо из базы в файл, не загружая их в таблицу. Ход выгрузки показывается в отдельном окне.<br>
                 <b>Формат CSV:</b>
                 <ul>
                     <li>Заголовки <b>всегда</b> в двойных кавычках: <code>"id","dtime_ins","code",...</code></li>
@@ -1123,7 +3092,9 @@ class HelpTab(QWidget):
                     <li>Заполните название и GTIN.</li>
                     <li>Сохраните изменения.</li>
                 </ol>
-                <b>Импорт:</b> Поддерживается импорт из JSON-файла с массивом объектов <code>[{"Name": ..., "Gtin": ...}]</code>.
+                <b>Импорт:</b> Поддерживается импорт из JSON-файла с массивом объектов <code>[{"Name": ..., "Gtin": ...}]</code> или из <code>products.json</code>. Файл импортируется целиком или, при ошибке, не импортируется совсем.<br>
+                <b>products.json рядом с программой</b> переносится в базу <code>checkdb.db</code> при первом запуске; дальше программа работает с базой. Если файл потом изменить вручную, при следующем запуске программа предложит импортировать его снова.<br>
+                <b>Экспорт:</b> кнопка "Экспорт в файл" сохраняет справочник в формате <code>products.json</code>.
             </div>
             '''
         )
@@ -1139,7 +3110,11 @@ class HelpTab(QWidget):
                     <li>Заполните параметры подключения (IP, порт, логин, пароль, БД).</li>
                     <li>Сохраните изменения.</li>
                 </ol>
-                <b>Импорт:</b> Поддерживается импорт из <code>appsettings.json</code> (формат 1С или .NET).</div>
+                <b>Часовой пояс</b> (необязательно) — например <code>Asia/Yekaterinburg</code>: границы дат при проверке считаются по времени линии.<br>
+                <b>Канал NOTIFY</b> (необязательно) — если триггер на таблице <code>codes</code> делает <code>NOTIFY</code> в этот канал, мониторинг получает новые строки сразу, а не по таймеру.<br>
+                <b>Таймаут запроса / блокировки</b> (необязательно, в секундах) — сервер сам прервёт проверку, которая длится дольше, и не даст ей долго ждать блокировок.<br>
+                <b>Импорт:</b> Поддерживается импорт из <code>appsettings.json</code> (формат 1С или .NET) и всех линий сразу из <code>profiles.json</code>. Как и <code>products.json</code>, файл <code>profiles.json</code> рядом с программой переносится в базу при первом запуске, а после ручной правки программа при запуске предложит импортировать его снова.<br>
+                <b>Экспорт:</b> кнопка "Экспорт в файл" сохраняет линии в формате <code>profiles.json</code>.</div>
             '''
         )
         help_layout.addWidget(lines_section)
@@ -1150,7 +3125,7 @@ class HelpTab(QWidget):
             <div style="color: #F1F1F1; font-size: 16px; line-height: 1.7;">
                 <ul>
                     <li><b>Очистка результатов:</b> используйте кнопку "Очистить результаты" или просто смените продукт/линию.</li>
-                    <li><b>Быстрый поиск:</b> используйте строку поиска для автодополнения по названию.</li>
+                    <li><b>Быстрый поиск:</b> используйте строку поиска для автодополнения по части названия или GTIN.</li>
                     <li><b>Проблемы с подключением:</b> проверьте параметры линии, доступность сервера и таблицу <code>codes</code> в БД.</li>
                     <li><b>Пустые значения в CSV:</b> это нормально, если данных нет или они были None.</li>
                     <li><b>Экспорт больших таблиц:</b> Excel может не сразу корректно открыть файл — используйте "Данные → Из текста/CSV".</li>
@@ -1282,6 +3257,7 @@ class UpdateTab(QWidget):
     def check_for_update_and_run(self):
         api_url = "https://api.github.com/repos/Andrejj12380/CheckDB/releases/latest"
         try:
+            import requests
             r = requests.get(api_url)
             latest = r.json()
             if "assets" not in latest or not latest["assets"]:
@@ -1330,6 +3306,7 @@ class UpdateTab(QWidget):
         base_dir = os.path.dirname(old_exe)
         updater_path = os.path.join(base_dir, "updater.exe")
         try:
+            import subprocess
             subprocess.Popen([updater_path, old_exe, new_exe_path])
         except Exception as e:
             self.status_label.setText(f'Ошибка запуска updater: {e}')
@@ -1337,6 +3314,23 @@ class UpdateTab(QWidget):
             return
         QtCore.QCoreApplication.quit()
 
+class LazyTab(QWidget):
+    """Заглушка вкладки: сама вкладка создаётся при первом открытии"""
+    def __init__(self, parent, tab_class):
+        super().__init__()
+        self.parent = parent
+        self.tab_class = tab_class
+        self.tab = None
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+    def create(self):
+        if self.tab is None:
+            self.tab = self.tab_class(self.parent)
+            self.layout().addWidget(self.tab)
+        return self.tab
+
 class DBChecker(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -1346,8 +3340,49 @@ class DBChecker(QMainWindow):
         self.setWindowIcon(QIcon(resource_path('flash.ico')))
         self.lines = load_lines()
         self.products = load_products()
+        self.gtin_names = gtin_aliases(self.products)  # GTIN → все продукты с ним
         self.current_line = None
         self.init_ui()
+        # Периодически закрываем простаивающие соединения с линиями
+        self.pool_timer = QTimer(self)
+        self.pool_timer.timeout.connect(evict_idle_connections)
+        self.pool_timer.start(60 * 1000)
+        # Вопрос о повторном импорте — после появления окна, чтобы не задерживать запуск
+        QTimer.singleShot(0, self.offer_json_reimport)
+
+    def offer_json_reimport(self):
+        """JSON-файлы переносятся в базу один раз; если их потом правили руками, предлагаем импорт снова"""
+        try:
+            store = get_store()
+            changed = store.changed_json()
+        except Exception:
+            return
+        for path in changed:
+            answer = QMessageBox.question(
+                self, 'Файл изменён',
+                f'Файл {path} изменён после переноса в базу программы, и эти правки пока не видны.\n'
+                'Импортировать его снова? Записи с теми же названиями будут заменены.',
+                QMessageBox.Yes | QMessageBox.No)
+            try:
+                if answer != QMessageBox.Yes:
+                    # Не спрашиваем снова, пока файл не изменится ещё раз
+                    store.mark_json_current(path)
+                elif not store.reimport_json(path):
+                    QMessageBox.warning(self, 'Импорт', f'Не удалось прочитать {path}')
+            except Exception as e:
+                QMessageBox.critical(self, 'Ошибка импорта', str(e))
+        if changed:
+            self.lines = load_lines()
+            self.products = load_products()
+            for name in self.lines:
+                close_pool(name)
+            self.main_tab.update_lines()
+            self.main_tab.update_products()
+
+    def closeEvent(self, event):
+        close_all_pools()
+        close_store()
+        super().closeEvent(event)
 
     def set_industrial_style(self):
         self.setStyleSheet('''
@@ -1615,15 +3650,16 @@ class DBChecker(QMainWindow):
         top_row = QHBoxLayout()
         self.tabs = QTabWidget()
         self.main_tab = MainTab(self)
-        self.products_tab = ProductsTab(self)
-        self.lines_tab = LinesTab(self)
-        self.help_tab = HelpTab(self)
-        self.update_tab = UpdateTab(self)
+        # Остальные вкладки (особенно справка) строятся при первом открытии, чтобы не задерживать запуск
+        self.products_page = LazyTab(self, ProductsTab)
+        self.lines_page = LazyTab(self, LinesTab)
+        self.help_page = LazyTab(self, HelpTab)
+        self.update_page = LazyTab(self, UpdateTab)
         self.tabs.addTab(self.main_tab, 'Главная')
-        self.tabs.addTab(self.products_tab, 'Продукты')
-        self.tabs.addTab(self.lines_tab, 'Линии')
-        self.tabs.addTab(self.help_tab, 'Справка')
-        self.tabs.addTab(self.update_tab, 'Обновление')
+        self.tabs.addTab(self.products_page, 'Продукты')
+        self.tabs.addTab(self.lines_page, 'Линии')
+        self.tabs.addTab(self.help_page, 'Справка')
+        self.tabs.addTab(self.update_page, 'Обновление')
         self.tabs.currentChanged.connect(self.on_tab_change)
         top_row.addWidget(self.tabs)
         main_layout.addLayout(top_row)
@@ -1631,7 +3667,28 @@ class DBChecker(QMainWindow):
         main_widget.setLayout(main_layout)
         self.setCentralWidget(main_widget)
 
+    @property
+    def products_tab(self):
+        return self.products_page.create()
+
+    @property
+    def lines_tab(self):
+        return self.lines_page.create()
+
+    @property
+    def help_tab(self):
+        return self.help_page.create()
+
+    @property
+    def update_tab(self):
+        return self.update_page.create()
+
     def on_tab_change(self, idx):
+        page = self.tabs.widget(idx)
+        if isinstance(page, LazyTab) and page.tab is None:
+            # Только что созданная вкладка уже заполнена актуальными данными
+            page.create()
+            return
         if idx == 0:
             self.main_tab.update_lines()
             self.main_tab.update_products()
@@ -1641,6 +3698,7 @@ class DBChecker(QMainWindow):
             self.lines_tab.update_list()
 
     def check_for_update_and_run(self):
+        import requests
         api_url = "https://api.github.com/repos/Andrejj12380/CheckDB/releases/latest"
         r = requests.get(api_url)
         latest = r.json()
@@ -1672,12 +3730,48 @@ class DBChecker(QMainWindow):
             base_dir = os.path.abspath(os.path.dirname(__file__))
 
         updater_path = os.path.join(base_dir, "updater.exe")
+        import subprocess
         subprocess.Popen([updater_path, sys.executable, new_exe_path])
         sys.exit(0)
 
+class StartupProbe(QtCore.QObject):
+    """Замер запуска для bench_startup.py: после первой отрисовки окна пишет времена этапов в файл и закрывает программу.
+
+    Файл, а не stdout — у собранного CheckDB.exe нет консоли.
+    """
+    def __init__(self, app, imported, path):
+        super().__init__()
+        self.app = app
+        self.path = path
+        self.marks = {'import_ms': imported}
+        self.painted = False
+
+    def mark(self, name):
+        self.marks[name] = round((time.perf_counter() - STARTED) * 1000, 1)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and not self.painted:
+            self.painted = True
+            self.mark('first_paint_ms')
+            # Выходим на следующей итерации цикла событий, когда кадр уже дорисован
+            QTimer.singleShot(0, self.report)
+        return False
+
+    def report(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.marks, f)
+        self.app.quit()
+
 if __name__ == '__main__':
+    imported = round((time.perf_counter() - STARTED) * 1000, 1)
     app = QApplication(sys.argv)
+    probe = None
+    if os.environ.get('CHECKDB_STARTUP_BENCH'):
+        probe = StartupProbe(app, imported, os.environ['CHECKDB_STARTUP_BENCH'])
     win = DBChecker()
+    if probe is not None:
+        probe.mark('window_ms')
+        win.installEventFilter(probe)
     win.show()
     sys.exit(app.exec_())
 
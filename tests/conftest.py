@@ -0,0 +1,5 @@
+# Тесты проверяют core.py — он без Qt, поэтому окно для них не нужно
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,79 @@
+import datetime
+
+from core import CacheEntry, refresh_entry, row_day
+
+D = datetime.date
+T = datetime.datetime
+COLNAMES = ['code', 'dtime_ins', 'production_date']
+INS, PROD = 1, 2
+
+
+class Table:
+    """Таблица codes в памяти: fetch_range отвечает так же, как build_check_query с since"""
+    def __init__(self, rows, date_index):
+        self.rows = list(rows)
+        self.date_index = date_index
+        self.fetches = []
+
+    def fetch_range(self, start, end, since):
+        self.fetches.append((start, end, since))
+        return [row for row in self.rows
+                if row[self.date_index] is not None and start <= row_day(row[self.date_index]) < end
+                and (since is None or (row[INS] is not None and row[INS] >= since))]
+
+    def read(self, start, end):
+        return sorted(self.fetch_range(start, end, None))
+
+
+def cached(table, start, end):
+    return CacheEntry(COLNAMES, table.fetch_range(start, end, None), start, end, table.date_index)
+
+
+def test_widening_forward_keeps_rows_inserted_before_a_straggler():
+    # Кэш — производство за 1 мая; строка за 1 мая вставлена поздно, 2 мая в 18:00
+    table = Table([
+        ('a', T(2024, 5, 1, 9), D(2024, 5, 1)),
+        ('straggler', T(2024, 5, 2, 18), D(2024, 5, 1)),
+        ('b', T(2024, 5, 2, 8), D(2024, 5, 2)),
+        ('c', T(2024, 5, 2, 17), D(2024, 5, 2)),
+    ], PROD)
+    entry = cached(table, D(2024, 5, 1), D(2024, 5, 2))
+    entry, fetched = refresh_entry(entry, D(2024, 5, 1), D(2024, 5, 3), table.fetch_range)
+    # Новый день читается целиком, без границы по dtime_ins
+    assert (D(2024, 5, 2), D(2024, 5, 3), None) in table.fetches
+    assert sorted(entry.rows) == table.read(D(2024, 5, 1), D(2024, 5, 3))
+    assert (entry.start, entry.end) == (D(2024, 5, 1), D(2024, 5, 3))
+
+
+def test_late_row_with_old_production_date_is_picked_up():
+    table = Table([('a', T(2024, 5, 1, 9), D(2024, 5, 1)), ('b', T(2024, 5, 1, 10), D(2024, 5, 1))], PROD)
+    entry = cached(table, D(2024, 5, 1), D(2024, 5, 2))
+    table.rows.append(('late', T(2024, 5, 3, 12), D(2024, 5, 1)))
+    entry, fetched = refresh_entry(entry, D(2024, 5, 1), D(2024, 5, 2), table.fetch_range)
+    assert sorted(entry.rows) == table.read(D(2024, 5, 1), D(2024, 5, 2))
+    # Перечитаны только строки не старше последней в кэше
+    assert fetched == 2
+
+
+def test_widening_backward_and_forward():
+    table = Table([(f'r{day}', T(2024, 5, day, 12), D(2024, 5, day)) for day in range(1, 8)], PROD)
+    entry = cached(table, D(2024, 5, 3), D(2024, 5, 5))
+    entry, _ = refresh_entry(entry, D(2024, 5, 1), D(2024, 5, 8), table.fetch_range)
+    assert sorted(entry.rows) == table.read(D(2024, 5, 1), D(2024, 5, 8))
+
+
+def test_without_insert_time_the_window_is_reread_not_appended():
+    table = Table([('a', None, D(2024, 5, 1)), ('b', None, D(2024, 5, 1))], PROD)
+    entry = cached(table, D(2024, 5, 1), D(2024, 5, 2))
+    entry, _ = refresh_entry(entry, D(2024, 5, 1), D(2024, 5, 2), table.fetch_range)
+    assert sorted(entry.rows, key=str) == sorted(table.rows, key=str)
+
+
+def test_past_insert_range_is_not_reread():
+    table = Table([(f'r{day}', T(2020, 1, day, 12), D(2020, 1, day)) for day in range(1, 5)], INS)
+    entry = cached(table, D(2020, 1, 1), D(2020, 1, 3))
+    table.fetches.clear()
+    entry, fetched = refresh_entry(entry, D(2020, 1, 1), D(2020, 1, 5), table.fetch_range)
+    assert table.fetches == [(D(2020, 1, 3), D(2020, 1, 5), None)]
+    assert fetched == 2
+    assert sorted(entry.rows) == table.read(D(2020, 1, 1), D(2020, 1, 5))
@@ -0,0 +1,78 @@
+import contextlib
+
+import core
+from core import GTIN_MATCH_AUTO, GTIN_MATCH_CONTAINS, TableSchema, advance_watermark, count_on_line
+
+POSITION_INDEX = ('i', 'CREATE INDEX i ON codes USING btree (substr(code, 3, 14))')
+PREFIX_INDEX = ('i', 'CREATE INDEX i ON codes USING btree (code text_pattern_ops)')
+
+
+class FakeCursor:
+    """Курсор, который запоминает запросы и на любой отвечает числом 7"""
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+
+    def fetchone(self):
+        return (7,)
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, log):
+        self.log = log
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return FakeCursor(self.log)
+
+
+def run_on_lines(monkeypatch, schemas, gtin_match):
+    logs = {name: [] for name in schemas}
+    monkeypatch.setattr(core, 'get_pool', lambda name, line: FakePool(logs[name]))
+    monkeypatch.setattr(core, 'SCHEMAS', dict(schemas))
+    results = {name: count_on_line(name, {}, '4607186140139', '2024-05-01', None, 'dtime_ins', gtin_match)
+               for name in schemas}
+    return results, {name: log[-1] for name, log in logs.items()}
+
+
+def test_auto_is_resolved_per_line(monkeypatch):
+    schemas = {
+        'prefix': TableSchema(True, indexes=[PREFIX_INDEX]),
+        'position': TableSchema(True, indexes=[POSITION_INDEX]),
+    }
+    results, queries = run_on_lines(monkeypatch, schemas, GTIN_MATCH_AUTO)
+    assert all(result['count'] == 7 and result['status'] == 'ok' for result in results.values())
+    assert 'code LIKE %s' in queries['prefix']
+    assert 'substr(code, 3, 14) = %s' in queries['position']
+
+
+def test_auto_reads_missing_schema(monkeypatch):
+    monkeypatch.setattr(core, 'fetch_schema', lambda cur: TableSchema(True, indexes=[POSITION_INDEX]))
+    _, queries = run_on_lines(monkeypatch, {'new': None}, GTIN_MATCH_AUTO)
+    assert 'substr(code, 3, 14) = %s' in queries['new']
+    assert core.SCHEMAS['new'].exists
+
+
+def test_explicit_mode_is_kept(monkeypatch):
+    schemas = {'position': TableSchema(True, indexes=[POSITION_INDEX])}
+    _, queries = run_on_lines(monkeypatch, schemas, GTIN_MATCH_CONTAINS)
+    assert 'code LIKE %s' in queries['position']
+
+
+def test_watermark_skips_rows_already_seen():
+    first = [('a', 1), ('b', 2), ('c', 2), ('n', None)]
+    new, watermark, seen = advance_watermark(None, set(), first, 1)
+    assert new == first and watermark == 2
+    # Следующий опрос с dtime_ins >= 2 приносит b и c снова — они не новые
+    new, watermark, seen = advance_watermark(watermark, seen, [('b', 2), ('c', 2), ('d', 2), ('e', 3)], 1)
+    assert new == [('d', 2), ('e', 3)] and watermark == 3 and seen == {('e', '3')}
+    new, _, _ = advance_watermark(watermark, seen, [('e', 3)], 1)
+    assert new == []
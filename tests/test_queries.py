@@ -0,0 +1,98 @@
+import datetime
+
+from core import (
+    GTIN_MATCH_AUTO, GTIN_MATCH_CONTAINS, GTIN_MATCH_POSITION, GTIN_MATCH_PREFIX, TableSchema,
+    build_batch_count_query, build_check_query, build_check_where, build_count_query, build_gtin_condition,
+    date_range_bounds, group_by_gtin, gtin_key, normalize_gtin, resolve_gtin_match,
+)
+
+D = datetime.date
+
+
+def test_normalize_gtin_pads_to_14_digits():
+    assert normalize_gtin('4607186140139') == '04607186140139'
+    assert normalize_gtin(' 04607186140139 ') == '04607186140139'
+    assert normalize_gtin('abc') == 'abc'
+
+
+def test_prefix_is_the_default_gtin_match():
+    # По умолчанию — начало кода (01)+GTIN, а не вхождение в любом месте
+    assert build_gtin_condition('4607186140139') == ("code LIKE %s", ['0104607186140139%'])
+    assert build_gtin_condition('4607186140139', GTIN_MATCH_AUTO) == ("code LIKE %s", ['0104607186140139%'])
+
+
+def test_prefix_escapes_like_wildcards():
+    assert build_gtin_condition('1_2%', GTIN_MATCH_PREFIX)[1] == ['011\\_2\\%%']
+
+
+def test_position_compares_the_gtin_slice():
+    assert build_gtin_condition('4607186140139', GTIN_MATCH_POSITION) == (
+        "substr(code, 3, 14) = %s", ['04607186140139'])
+
+
+def test_contains_searches_the_value_as_written():
+    assert build_gtin_condition('123', GTIN_MATCH_CONTAINS) == ("code LIKE %s", ['%123%'])
+
+
+def test_date_range_is_half_open():
+    assert date_range_bounds('2024-05-01', '2024-05-31') == (D(2024, 5, 1), D(2024, 6, 1))
+    assert date_range_bounds(D(2024, 5, 1), None) == (D(2024, 5, 1), None)
+
+
+def test_check_where_compares_the_column_without_casts():
+    where, params = build_check_where('4607186140139', '2024-05-01', '2024-05-01', 'production_date')
+    assert where == "code LIKE %s AND production_date >= %s AND production_date < %s"
+    assert params == ['0104607186140139%', D(2024, 5, 1), D(2024, 5, 2)]
+
+
+def test_check_where_without_end_date():
+    where, params = build_check_where('1', '2024-05-01', None)
+    assert where == "code LIKE %s AND dtime_ins >= %s"
+    assert params == ['0100000000000001%', D(2024, 5, 1)]
+
+
+def test_since_always_bounds_insert_time():
+    moment = datetime.datetime(2024, 5, 2, 18, 0)
+    where, params = build_check_where('1', '2024-05-01', '2024-05-01', 'production_date', since=moment)
+    assert where.endswith("AND dtime_ins >= %s")
+    assert params[-1] == moment
+
+
+def test_check_query_columns_and_limit():
+    sql, params = build_check_query('1', '2024-05-01', None, columns=['code', 'we"ird'], limit=100)
+    assert sql == 'SELECT "code", "we""ird" FROM codes WHERE code LIKE %s AND dtime_ins >= %s LIMIT %s'
+    assert params[-1] == 100
+
+
+def test_count_query():
+    sql, params = build_count_query('1', '2024-05-01', '2024-05-02')
+    assert sql == "SELECT count(*) FROM codes WHERE code LIKE %s AND dtime_ins >= %s AND dtime_ins < %s"
+    assert params == ['0100000000000001%', D(2024, 5, 1), D(2024, 5, 3)]
+
+
+def test_batch_count_query_labels_each_gtin():
+    sql, params = build_batch_count_query(['1', '2'], '2024-05-01', None)
+    assert sql == ("SELECT CASE WHEN code LIKE %s THEN %s WHEN code LIKE %s THEN %s END AS gtin, count(*) "
+                   "FROM codes WHERE (code LIKE %s OR code LIKE %s) AND dtime_ins >= %s GROUP BY 1")
+    assert params == ['0100000000000001%', '00000000000001', '0100000000000002%', '00000000000002',
+                      '0100000000000001%', '0100000000000002%', D(2024, 5, 1)]
+
+
+def test_resolve_auto_by_line_indexes():
+    prefix = TableSchema(True, indexes=[('i', 'CREATE INDEX i ON codes USING btree (code text_pattern_ops)')])
+    position = TableSchema(True, indexes=[('i', 'CREATE INDEX i ON codes USING btree (substr(code, 3, 14))')])
+    assert resolve_gtin_match(GTIN_MATCH_AUTO, prefix) == GTIN_MATCH_PREFIX
+    assert resolve_gtin_match(GTIN_MATCH_AUTO, position) == GTIN_MATCH_POSITION
+    assert resolve_gtin_match(GTIN_MATCH_AUTO, None) == GTIN_MATCH_PREFIX
+    assert resolve_gtin_match(GTIN_MATCH_CONTAINS, position) == GTIN_MATCH_CONTAINS
+
+
+def test_gtin_key_depends_on_match_mode():
+    assert gtin_key('123') == '00000000000123'
+    assert gtin_key('123', GTIN_MATCH_CONTAINS) == '123'
+
+
+def test_group_by_gtin_joins_aliases():
+    products = {'a': '123', 'b': '00000000000123', 'c': '456'}
+    assert group_by_gtin(['c', 'a', 'b'], products) == [('00000000000456', ['c']), ('00000000000123', ['a', 'b'])]
+    assert group_by_gtin(['a', 'b'], products, GTIN_MATCH_CONTAINS) == [('123', ['a']), ('00000000000123', ['b'])]
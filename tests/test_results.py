@@ -0,0 +1,96 @@
+import datetime
+
+from core import (
+    CacheEntry, ProductIndex, ResultCache, csv_header, csv_line, find_duplicates, plan_summary,
+)
+
+D = datetime.date
+T = datetime.datetime
+COLNAMES = ['code', 'dtime_ins', 'production_date']
+
+
+def test_find_duplicates_in_memory():
+    batches = [[('a', T(2024, 5, 1, 10)), ('b', T(2024, 5, 1, 11))], [('a', T(2024, 5, 1, 9)), (None, T(2024, 5, 1))]]
+    assert find_duplicates(batches) == [('a', 2, T(2024, 5, 1, 9), T(2024, 5, 1, 10))]
+
+
+def test_find_duplicates_spills_to_files():
+    # max_codes=2: после третьего разного кода счёт продолжается во временных файлах
+    rows = [(code, T(2024, 5, 1, hour)) for hour, code in enumerate('abcabdaeb')]
+    result = find_duplicates([rows[:4], rows[4:]], max_codes=2, partitions=3)
+    assert result == [
+        ('a', 3, T(2024, 5, 1, 0), T(2024, 5, 1, 6)),
+        ('b', 3, T(2024, 5, 1, 1), T(2024, 5, 1, 8)),
+    ]
+
+
+def test_product_index_search_ranks_name_starts_first():
+    index = ProductIndex({'Лимонад вода': '1', 'Вода 5л': '2', 'Минеральная вода': '3', 'Сок': '04607186140139'})
+    index.build()
+    assert index.search('вода') == ['Вода 5л', 'Лимонад вода', 'Минеральная вода']
+    assert index.search('вода', limit=1) == ['Вода 5л']
+    assert index.search('4607186') == ['Сок']
+
+
+def test_product_index_matches_with_and_without_ngrams():
+    products = {f'продукт {i}': f'{i:014d}' for i in range(50)}
+    plain = ProductIndex(products)
+    plain.build_in_background = lambda: None  # без фонового индекса — перебором
+    indexed = ProductIndex(products)
+    indexed.build()
+    for query in ('пр', 'продукт 1', 'УКТ 4', '00000000000049', 'нет такого'):
+        assert plain.matches(query) == indexed.matches(query)
+    # Удлинение запроса уточняет прежние совпадения, сокращение — ищет заново
+    assert indexed.count('продукт 1') == 11
+    assert indexed.count('продукт 12') == 1
+    assert indexed.count('продукт') == 50
+
+
+def test_plan_summary_counts_whole_table_for_seq_scan():
+    plan = {'Node Type': 'Seq Scan', 'Relation Name': 'codes', 'Plan Rows': 10, 'Total Cost': 5.0}
+    assert plan_summary(plan, {'codes': 1000})['rows_read'] == 1000
+    # Размер таблицы неизвестен — оценку фильтра за размер чтения не выдаём
+    assert plan_summary(plan, {'codes': None})['rows_read'] is None
+    assert plan_summary(plan)['rows_read'] is None
+
+
+def test_plan_summary_index_scan():
+    plan = {'Node Type': 'Limit', 'Plan Rows': 5, 'Total Cost': 9.5, 'Plans': [
+        {'Node Type': 'Index Scan', 'Index Name': 'codes_code_idx', 'Relation Name': 'codes',
+         'Plan Rows': 40, 'Total Cost': 9.0}]}
+    assert plan_summary(plan) == {'rows': 5, 'rows_read': 40, 'cost': 9.5, 'scans': ['Index Scan (codes_code_idx)']}
+
+
+def test_cache_entry_rows_between():
+    rows = [('a', T(2024, 5, 1, 10), D(2024, 5, 1)), ('b', T(2024, 5, 2, 10), D(2024, 5, 2)), ('c', None, None)]
+    entry = CacheEntry(COLNAMES, rows, D(2024, 5, 1), D(2024, 5, 3), COLNAMES.index('production_date'))
+    assert entry.rows_between(D(2024, 5, 1), D(2024, 5, 3)) == rows
+    assert entry.rows_between(D(2024, 5, 2), D(2024, 5, 3)) == [rows[1]]
+    assert entry.high_water() == T(2024, 5, 2, 10)
+
+
+def test_cache_entry_immutability():
+    old_start, old_end = D(2020, 1, 1), D(2020, 1, 2)
+    by_insert = CacheEntry(COLNAMES, [], old_start, old_end, COLNAMES.index('dtime_ins'))
+    by_production = CacheEntry(COLNAMES, [], old_start, old_end, COLNAMES.index('production_date'))
+    assert by_insert.is_immutable()
+    # За прошлые дни производства строки могут добавиться в любой момент
+    assert not by_production.is_immutable()
+
+
+def test_result_cache_evicts_least_recently_used_by_rows():
+    cache = ResultCache(max_rows=4)
+    entry = lambda n: CacheEntry(COLNAMES, [('x', None, None)] * n, D(2020, 1, 1), D(2020, 1, 2), 1)
+    cache.put('a', entry(2))
+    cache.put('b', entry(2))
+    assert cache.get('a') is not None  # 'a' теперь использовался недавно
+    cache.put('c', entry(1))
+    assert cache.get('b') is None
+    assert cache.rows_total == 3
+    cache.put('big', entry(5))  # больше всего кэша — не хранится
+    assert cache.get('big') is None
+
+
+def test_csv_header_and_line():
+    assert csv_header(['code', 'a"b']) == '"code","a""b"\n'
+    assert csv_line(['01"x', None, 5], [0]) == '"01""x",,5\n'
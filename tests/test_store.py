@@ -0,0 +1,95 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from core import META_UPSERT, PRODUCTS_FILE, PROFILES_FILE, LocalStore
+
+LINE = {'ip': '10.0.0.1', 'port': '5432', 'user': 'u', 'password': 'p', 'dbname': 'db'}
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    # JSON-файлы ищутся в текущей папке, как рядом с программой
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def write(path, data, mtime=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_migrate_json_imports_once(folder):
+    write(PRODUCTS_FILE, {'Вода': '04607186140139'})
+    store = LocalStore(str(folder / 'store.db'))
+    assert store.products() == {'Вода': '04607186140139'}
+    # Файла линий не было — перенос не отмечен, и он придёт при следующем запуске
+    assert store.imported_at(PROFILES_FILE) is None
+    store.close()
+    write(PROFILES_FILE, {'Спайдер': LINE})
+    write(PRODUCTS_FILE, {'Сок': '1'})
+    store = LocalStore(str(folder / 'store.db'))
+    assert store.lines() == {'Спайдер': LINE}
+    assert store.products() == {'Вода': '04607186140139'}
+    store.close()
+
+
+def test_unreadable_json_is_retried(folder):
+    (folder / PRODUCTS_FILE).write_text('{', encoding='utf-8')
+    store = LocalStore(str(folder / 'store.db'))
+    assert store.products() == {} and store.imported_at(PRODUCTS_FILE) is None
+    write(PRODUCTS_FILE, {'Вода': '1'})
+    store.migrate_json()
+    assert store.products() == {'Вода': '1'}
+
+
+def test_changed_json_is_offered_for_reimport(folder):
+    write(PRODUCTS_FILE, {'Вода': '1'}, mtime=1_000_000_000)
+    store = LocalStore(str(folder / 'store.db'))
+    assert store.changed_json() == []
+    write(PRODUCTS_FILE, {'Вода': '2', 'Сок': '3'})
+    os.utime(PRODUCTS_FILE, (store.imported_at(PRODUCTS_FILE).timestamp() + 5,) * 2)
+    assert store.changed_json() == [PRODUCTS_FILE]
+    assert store.reimport_json(PRODUCTS_FILE)
+    assert store.products() == {'Вода': '2', 'Сок': '3'}
+    # Отметка о переносе обновилась вместе с импортом
+    os.utime(PRODUCTS_FILE, (1_000_000_000,) * 2)
+    assert store.changed_json() == []
+
+
+def test_declined_reimport_is_not_offered_again(folder):
+    write(PROFILES_FILE, {'Спайдер': LINE})
+    store = LocalStore(str(folder / 'store.db'))
+    # Перенос был давно, файл правили после него
+    with store.conn:
+        store.conn.execute(META_UPSERT, (f'imported:{PROFILES_FILE}', '2001-09-09T01:46:40'))
+    assert store.changed_json() == [PROFILES_FILE]
+    # Путь из диалога — абсолютный
+    store.mark_json_current(str(folder / PROFILES_FILE))
+    assert store.changed_json() == []
+
+
+def test_put_products_rolls_back_on_error(folder):
+    store = LocalStore(str(folder / 'store.db'))
+    store.put_products({'Вода': '1'})
+    with pytest.raises(sqlite3.Error):
+        store.put_products({'Сок': '2', 'Вода': '9'}, [("INSERT INTO no_such_table VALUES (?)", (1,))])
+    assert store.products() == {'Вода': '1'}
+    with pytest.raises(sqlite3.Error):
+        store.put_products({'Сок': '2', ('не', 'строка'): '3'})
+    assert store.products() == {'Вода': '1'}
+
+
+def test_put_product_rename_moves_record_to_end(folder):
+    store = LocalStore(str(folder / 'store.db'))
+    store.put_products({'Вода': '1', 'Сок': '2', 'Квас': '3'})
+    store.put_product('Вода 5л', '4', old_name='Вода')
+    assert list(store.products().items()) == [('Сок', '2'), ('Квас', '3'), ('Вода 5л', '4')]
+    # Изменение без переименования оставляет запись на месте
+    store.put_product('Сок', '5', old_name='Сок')
+    assert list(store.products()) == ['Сок', 'Квас', 'Вода 5л']
+    assert store.products()['Сок'] == '5'